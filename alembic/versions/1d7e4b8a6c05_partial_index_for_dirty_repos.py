@@ -0,0 +1,30 @@
+"""Partial index for repos that need to be updated
+
+Revision ID: 1d7e4b8a6c05
+Revises: 5a1f7c3e9b2d
+Create Date: 2026-10-16 15:31:09.772140
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d7e4b8a6c05'
+down_revision = '5a1f7c3e9b2d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_repos_dirty',
+        'repos',
+        ['id'],
+        unique=False,
+        postgresql_where=sa.text('needs_update = true AND is_queued = false')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_repos_dirty', table_name='repos')
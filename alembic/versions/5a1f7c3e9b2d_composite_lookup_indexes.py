@@ -0,0 +1,43 @@
+"""Composite indexes for binary and repo lookups
+
+Revision ID: 5a1f7c3e9b2d
+Revises: 2f0e6f3b8a41
+Create Date: 2026-10-16 14:02:47.518309
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a1f7c3e9b2d'
+down_revision = '2f0e6f3b8a41'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+identity = [
+    'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch', 'flavor',
+    'name'
+]
+
+
+def upgrade():
+    # racing uploads may have created the same binary more than once, keep
+    # the newest row since that is the one that got the last file
+    op.execute(
+        "DELETE FROM binaries WHERE id NOT IN "
+        "(SELECT max(id) FROM binaries GROUP BY %s)" % ', '.join(identity)
+    )
+    op.create_unique_constraint('uq_binaries_identity', 'binaries', identity)
+    op.create_index(
+        'ix_repos_lookup',
+        'repos',
+        ['project_id', 'ref', 'sha1', 'distro', 'distro_version', 'flavor'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_repos_lookup', table_name='repos')
+    op.drop_constraint('uq_binaries_identity', 'binaries', type_='unique')
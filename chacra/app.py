@@ -1,5 +1,5 @@
 from pecan import make_app
-from chacra import models, async
+from chacra import models, async, spool
 
 
 def setup_app(config):
@@ -12,6 +12,8 @@ def setup_app(config):
         logging=getattr(config, 'logging', {}),
         **app_conf
     )
+    # request bodies spooled by the web server are removed if not adopted
+    app = spool.SpoolCleanup(app)
 
     # make a series of health checks, post if they are good
     async.post_if_healthy()
@@ -85,6 +85,14 @@ app.conf.update(
             'task': 'chacra.async.recurring.purge_repos',
             'schedule': timedelta(days=1),
         },
+        'prune-blobs': {
+            'task': 'chacra.async.recurring.prune_blobs',
+            'schedule': timedelta(days=1),
+        },
+        'expire-uploads': {
+            'task': 'chacra.async.recurring.expire_uploads',
+            'schedule': timedelta(days=1),
+        },
     },
 )
 
@@ -125,6 +133,41 @@ def post_status(status, repo_obj, _callback=None):
     )
 
 
+def settle_time(repo):
+    """
+    Seconds to wait before building ``repo`` so that uploads have settled, see
+    ``Repo.settle_time``. ``max_quiet_time`` defaults to ten times the
+    ``quiet_time``.
+    """
+    quiet_time = pecan.conf.quiet_time
+    max_quiet_time = getattr(pecan.conf, 'max_quiet_time', quiet_time * 10)
+    return repo.settle_time(quiet_time, max_quiet_time)
+
+
+def reschedule_if_busy(repo, task):
+    """
+    Send ``task`` for ``repo`` again (and return ``True``) if binaries are
+    still being added to it. The repo stays queued in the meantime so that it
+    is not sent more than once.
+    """
+    countdown = settle_time(repo)
+    if not countdown:
+        return False
+    logger.info('repo %s is still getting binaries, will build in %ss', repo, countdown)
+    task.apply_async((repo.id,), countdown=countdown, queue='build_repos')
+    return True
+
+
+def queue_follow_up(repo):
+    """
+    A repo can be marked as needing an update while it is being built, in
+    which case it is skipped by the pollers (it is updating). Once the build
+    is done it gets sent again, exactly once since it needs to be claimed.
+    """
+    from chacra.async import recurring
+    recurring.queue_repos([repo.id])
+
+
 def post_requested(repo):
     post_status('requested', repo)
 
@@ -174,3 +217,7 @@ def post_if_healthy():
         args=({}, None),
         kwargs=dict(url=url),
     )
+
+
+# send repos to be built when they are marked (see ``trigger_builds``)
+from chacra.async import trigger  # noqa
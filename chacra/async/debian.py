@@ -1,13 +1,189 @@
 from celery import shared_task
 from chacra import models
 from chacra.async import base, post_ready, post_building
+from chacra.async import lease, reschedule_if_busy, queue_follow_up
 from chacra import util
 from chacra.metrics import Counter, Timer
+import json
 import logging
+import os
 import subprocess
 
 logger = logging.getLogger(__name__)
 
+MANIFEST = 'chacra-manifest.json'
+
+
+def call(command):
+    try:
+        subprocess.check_call(command)
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+def manifest_path(repository_path):
+    # next to the reprepro database so that they go away together
+    return os.path.join(repository_path, 'db', MANIFEST)
+
+
+def read_manifest(repository_path):
+    """
+    The packages added to the repository by the last build, as
+    ``{distro_version: {path: entry}}``, see ``update_binaries``. A missing
+    (or unreadable) manifest means everything gets added again.
+    """
+    try:
+        with open(manifest_path(repository_path)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(repository_path, manifest):
+    path = manifest_path(repository_path)
+    util.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.rename(path + '.tmp', path)
+
+
+def manifest_entry(project_name, binary):
+    return {
+        'project': project_name,
+        'type': binary.extension,
+        'package': util.reprepro_package_name(binary.path),
+        'checksum': binary.checksum,
+    }
+
+
+def include(repository_path, batches):
+    """
+    Add every batch (see ``util.reprepro_batches``) with a reprepro call
+    instead of one per binary. If a batch fails its binaries are added one at
+    a time so that a single bad binary does not keep the rest out of the
+    repository. Returns the binaries that could not be added.
+    """
+    failed = set()
+    for project_name, include_flag, distro_version, batch in batches:
+        paths = [b.path for b in batch]
+        command = util.reprepro_include_command(
+            repository_path, project_name, include_flag, distro_version, paths)
+        logger.info(
+            'adding %s binaries with: %s', len(batch), ' '.join(command[:-len(paths)]))
+        if call(command):
+            continue
+        if len(batch) == 1:
+            logger.error('failed to add binary %s', batch[0].name)
+            failed.add(batch[0])
+            continue
+        logger.warning('failed to add binaries to %s, adding them one at a time', distro_version)
+        for binary in batch:
+            if not call(command[:-len(paths)] + [binary.path]):
+                logger.error('failed to add binary %s', binary.name)
+                failed.add(binary)
+    return failed
+
+
+def update_binaries(repository_path, binaries, distro_versions=None, fallback_version=None):
+    """
+    Make the repository contain ``binaries``, touching only what changed
+    since the last build: the binaries are compared against the manifest of
+    that build (path and checksum for every distro version), new or changed
+    ones are added, and packages that are no longer wanted are removed.
+    Indexes are exported once at the end, and only for the distro versions
+    that changed.
+
+    A package that changed or went away is removed by name and every wanted
+    binary of that package is added again, so a replaced file (or a
+    downgrade) does not clash with what reprepro has registered already.
+
+    Anything that fails (adding, removing or exporting) is left out of the
+    manifest, so that the next build does it again.
+    """
+    manifest = read_manifest(repository_path)
+    wanted = {}
+    batches = []
+    for project_name, include_flag, distro_version, batch in util.reprepro_batches(
+            binaries, distro_versions=distro_versions, fallback_version=fallback_version):
+        entries = wanted.setdefault(distro_version, {})
+        for binary in batch:
+            entries[binary.path] = manifest_entry(project_name, binary)
+        batches.append((project_name, include_flag, distro_version, batch))
+
+    # packages to remove, by distro version and (project, type) so that each
+    # removal is a single reprepro call
+    removals = {}
+    for distro_version, included in manifest.items():
+        entries = wanted.get(distro_version, {})
+        for path, entry in included.items():
+            if entries.get(path) == entry:
+                continue
+            key = (entry['project'], entry['type'])
+            removals.setdefault(distro_version, {}).setdefault(key, set()).add(entry['package'])
+
+    changed = []
+    for project_name, include_flag, distro_version, batch in batches:
+        included = manifest.get(distro_version, {})
+        removed = set()
+        for (_, package_type), packages in removals.get(distro_version, {}).items():
+            removed.update((package_type, package) for package in packages)
+        batch = [
+            b for b in batch
+            if included.get(b.path) != wanted[distro_version][b.path] or
+            (b.extension, wanted[distro_version][b.path]['package']) in removed
+        ]
+        if batch:
+            changed.append((project_name, include_flag, distro_version, batch))
+
+    if not changed and not removals:
+        logger.info('repository is up to date: %s', repository_path)
+        return
+
+    exports = {}
+    failed_removals = set()
+    for distro_version, packages in removals.items():
+        for (project_name, package_type), names in packages.items():
+            exports.setdefault(project_name, set()).add(distro_version)
+            command = util.reprepro_remove_command(
+                repository_path, project_name, package_type, distro_version, names)
+            logger.info('running command: %s', ' '.join(command))
+            if not call(command):
+                logger.error('failed to remove %s from %s', ', '.join(sorted(names)), distro_version)
+                failed_removals.update(
+                    (distro_version, package_type, name) for name in names)
+
+    for project_name, include_flag, distro_version, batch in changed:
+        exports.setdefault(project_name, set()).add(distro_version)
+    failed = include(repository_path, changed)
+
+    failed_exports = set()
+    for project_name, versions in exports.items():
+        command = util.reprepro_export_command(repository_path, project_name, versions)
+        logger.info('running command: %s', ' '.join(command))
+        if not call(command):
+            logger.error('failed to export %s', ', '.join(sorted(versions)))
+            failed_exports.update(versions)
+
+    # binaries that failed are left out so that the next build tries again
+    for binary in failed:
+        for entries in wanted.values():
+            entries.pop(binary.path, None)
+    # and packages that could not be removed are kept as they were, so that
+    # the next build sees them as stale again
+    for distro_version, included in manifest.items():
+        for path, entry in included.items():
+            if (distro_version, entry['type'], entry['package']) in failed_removals:
+                wanted.setdefault(distro_version, {})[path] = entry
+    # distro versions that could not be exported only keep those packages, so
+    # that the next build adds every binary and exports them again
+    for distro_version in failed_exports:
+        wanted[distro_version] = dict(
+            (path, entry) for path, entry in wanted.get(distro_version, {}).items()
+            if (distro_version, entry['type'], entry['package']) in failed_removals
+        )
+    write_manifest(repository_path, wanted)
+
 
 @shared_task(base=base.SQLATask)
 def create_deb_repo(repo_id):
@@ -17,6 +193,8 @@ def create_deb_repo(repo_id):
     # get the root path for storing repos
     # TODO: Is it possible we can get an ID that doesn't exist anymore?
     repo = models.Repo.get(repo_id)
+    if reschedule_if_busy(repo, create_deb_repo):
+        return
     timer = Timer(__name__, suffix="create.deb.%s" % repo.metric_name)
     counter = Counter(__name__, suffix="create.deb.%s" % repo.metric_name)
     timer.start()
@@ -32,104 +210,100 @@ def create_deb_repo(repo_id):
     # Determine paths for this repository
     paths = util.repo_paths(repo)
 
+    # Only one build at a time, changes that come in while another worker
+    # builds it get a build of their own once that one is done
+    build_lease = lease.Lease(repo.id)
+    if not build_lease.acquire():
+        logger.info("repository is being built by another worker: %s", repo)
+        repo.is_queued = False
+        models.commit()
+        return
+
     # Before doing work that might take very long to complete, set the repo
-    # path in the object, mark needs_update as False, and mark it as being
-    # updated so we prevent piling up if other binaries are being posted
+    # path in the object and mark needs_update as False
     repo.path = paths['absolute']
-    repo.is_updating = True
     repo.is_queued = False
     repo.needs_update = False
     models.commit()
 
-    # determine if other repositories might need to be queried to add extra
-    # binaries (repos are tied to binaries which are all related with  refs,
-    # archs, distros, and distro versions.
-    conf_extra_repos = util.get_extra_repos(repo.project.name, repo.ref)
-    combined_versions = util.get_combined_repos(repo.project.name)
-    extra_binaries = []
-
-    # See if there are any generic/universal binaries so that they can be
-    # automatically added from the current project
-    for binary in util.get_extra_binaries(
-            repo.project.name,
-            repo.distro,
-            None,
-            distro_versions=['generic', 'universal', 'any'],
-            ref=repo.ref,
-            sha1=repo.sha1):
-        extra_binaries.append(binary)
-
-    for project_name, project_refs in conf_extra_repos.items():
-        for ref in project_refs:
-            logger.info('fetching binaries for project: %s, ref: %s', project_name, ref)
-            found_binaries = util.get_extra_binaries(
-                project_name,
+    with build_lease:
+        # determine if other repositories might need to be queried to add extra
+        # binaries (repos are tied to binaries which are all related with  refs,
+        # archs, distros, and distro versions.
+        conf_extra_repos = util.get_extra_repos(repo.project.name, repo.ref)
+        combined_versions = util.get_combined_repos(repo.project.name)
+        extra_binaries = []
+
+        # See if there are any generic/universal binaries so that they can be
+        # automatically added from the current project
+        for binary in util.get_extra_binaries(
+                repo.project.name,
+                repo.distro,
                 None,
-                repo.distro_version,
-                distro_versions=combined_versions,
-                ref=ref if ref != 'all' else None
-            )
-            extra_binaries += found_binaries
+                distro_versions=['generic', 'universal', 'any'],
+                ref=repo.ref,
+                sha1=repo.sha1):
+            extra_binaries.append(binary)
 
-            # See if there are any generic/universal binaries so that they can be
-            # automatically added from projects coming from extra repos
-            for binary in util.get_extra_binaries(
+        for project_name, project_refs in conf_extra_repos.items():
+            for ref in project_refs:
+                logger.info('fetching binaries for project: %s, ref: %s', project_name, ref)
+                found_binaries = util.get_extra_binaries(
                     project_name,
-                    repo.distro,
                     None,
-                    distro_versions=['generic', 'universal', 'any'],
-                    ref=ref if ref != 'all' else None):
-                extra_binaries.append(binary)
+                    repo.distro_version,
+                    distro_versions=combined_versions,
+                    ref=ref if ref != 'all' else None
+                )
+                extra_binaries += found_binaries
 
-    # check for the option to 'combine' repositories with different
-    # debian/ubuntu versions
-    for distro_version in combined_versions:
-        logger.info(
-            'fetching distro_version %s for project: %s',
-            distro_version,
-            repo.project.name
-        )
-        # When combining distro_versions we cannot filter by distribution as
-        # well, otherwise it will be an impossible query. E.g. "get wheezy,
-        # precise and trusty but only for the Ubuntu distro"
-        extra_binaries += util.get_extra_binaries(
-            repo.project.name,
-            None,
-            distro_version,
-            ref=repo.ref,
-            sha1=repo.sha1
-        )
+                # See if there are any generic/universal binaries so that they can be
+                # automatically added from projects coming from extra repos
+                for binary in util.get_extra_binaries(
+                        project_name,
+                        repo.distro,
+                        None,
+                        distro_versions=['generic', 'universal', 'any'],
+                        ref=ref if ref != 'all' else None):
+                    extra_binaries.append(binary)
+
+        # check for the option to 'combine' repositories with different
+        # debian/ubuntu versions
+        for distro_version in combined_versions:
+            logger.info(
+                'fetching distro_version %s for project: %s',
+                distro_version,
+                repo.project.name
+            )
+            # When combining distro_versions we cannot filter by distribution as
+            # well, otherwise it will be an impossible query. E.g. "get wheezy,
+            # precise and trusty but only for the Ubuntu distro"
+            extra_binaries += util.get_extra_binaries(
+                repo.project.name,
+                None,
+                distro_version,
+                ref=repo.ref,
+                sha1=repo.sha1
+            )
 
-    # try to create the absolute path to the repository if it doesn't exist
-    util.makedirs(paths['absolute'])
+        # try to create the absolute path to the repository if it doesn't exist
+        util.makedirs(paths['absolute'])
 
-    all_binaries = extra_binaries + [b for b in repo.binaries]
-    timer.intermediate('collection')
+        all_binaries = extra_binaries + [b for b in repo.binaries]
+        timer.intermediate('collection')
 
-    for binary in set(all_binaries):
         # XXX This is really not a good alternative but we are not going to be
         # using .changes for now although we can store it.
-        if binary.extension == 'changes':
-            continue
-        try:
-            commands = util.reprepro_commands(
-                paths['absolute'],
-                binary,
-                distro_versions=combined_versions,
-                fallback_version=repo.distro_version
-            )
-        except KeyError:  # probably a tar.gz or similar file that should not be added directly
-            continue
-        for command in commands:
-            logger.info('running command: %s', ' '.join(command))
-            try:
-                subprocess.check_call(command)
-            except subprocess.CalledProcessError:
-                logger.error('failed to add binary %s', binary.name)
+        binaries = [b for b in set(all_binaries) if b.extension != 'changes']
+        update_binaries(
+            paths['absolute'],
+            binaries,
+            distro_versions=combined_versions,
+            fallback_version=repo.distro_version
+        )
 
     logger.info("finished processing repository: %s", repo)
-    repo.is_updating = False
-    models.commit()
     timer.stop()
     counter += 1
     post_ready(repo)
+    queue_follow_up(repo)
@@ -0,0 +1,161 @@
+"""
+Leases for repos that are being built. A build holds a lease (an owner and
+an expiry) instead of just flagging the repo with ``is_updating``, and renews
+it from a background thread while it runs. A worker that dies (or gets
+killed) stops renewing it, so the repo is built again once the lease expires
+rather than staying ``is_updating`` forever. A build that fails flags the
+repo as needing an update again so that the poller retries it.
+
+Leases last ``build_lease_time`` seconds (5 minutes by default) and are
+renewed every third of that.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import uuid
+
+import pecan
+from sqlalchemy import true
+
+from chacra import models
+from chacra.models.repos import lease_expired, update_repos
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TIME = 300
+
+
+def lease_time():
+    return getattr(pecan.conf, 'build_lease_time', DEFAULT_LEASE_TIME)
+
+
+def recover_expired():
+    """
+    Mark the repos whose lease expired (their worker is gone) as needing an
+    update again, and return their ids.
+    """
+    table = models.Repo.__table__
+    now = datetime.datetime.utcnow()
+    repo_ids = update_repos(
+        (table.c.is_updating == True) & lease_expired(now),
+        is_updating=False,
+        needs_update=True,
+        lease_owner=None,
+        lease_expires=None,
+    )
+    models.commit()
+    if repo_ids:
+        logger.warning('recovered repos with expired build leases: %s', repo_ids)
+    return repo_ids
+
+
+class Lease(object):
+    """
+    The lease on a repo for a build. Once acquired, use it as a context
+    manager around the build so that it is renewed while the build runs and
+    released when it is done (or fails)::
+
+        lease = Lease(repo.id)
+        if lease.acquire():
+            with lease:
+                build(repo)
+    """
+
+    def __init__(self, repo_id, duration=None):
+        self.repo_id = repo_id
+        self.duration = duration or lease_time()
+        self.owner = '%s:%s:%s' % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _expires(self):
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.duration)
+
+    def _update(self, query, **values):
+        table = models.Repo.__table__
+        updated = bool(update_repos((table.c.id == self.repo_id) & query, **values))
+        models.commit()
+        return updated
+
+    def acquire(self):
+        """
+        Take the lease if the repo is not being built, or if the lease of
+        that build expired. Returns ``False`` if another build holds it.
+        """
+        table = models.Repo.__table__
+        now = datetime.datetime.utcnow()
+        return self._update(
+            (table.c.is_updating == False) |
+            (table.c.is_updating == None) |
+            lease_expired(now),
+            is_updating=True,
+            lease_owner=self.owner,
+            lease_expires=self._expires(),
+        )
+
+    def renew(self):
+        """
+        Extend the lease, returns ``False`` if it was lost (it expired and
+        another worker took it).
+        """
+        table = models.Repo.__table__
+        return self._update(
+            table.c.lease_owner == self.owner,
+            lease_expires=self._expires(),
+        )
+
+    def release(self):
+        table = models.Repo.__table__
+        return self._update(
+            table.c.lease_owner == self.owner,
+            is_updating=False,
+            lease_owner=None,
+            lease_expires=None,
+        )
+
+    def retry(self):
+        """
+        Flag the repo as needing an update again, ``needs_update`` is cleared
+        when a build starts so a failed build would otherwise never be tried
+        again.
+        """
+        return self._update(true(), needs_update=True)
+
+    def beat(self):
+        """
+        Renew the lease until the build is done. This runs in its own thread,
+        with its own database session.
+        """
+        try:
+            while not self._stop.wait(self.duration / 3.0):
+                if not self.renew():
+                    logger.warning(
+                        'lost the build lease for repo %s (%s)', self.repo_id, self.owner)
+                    return
+        except Exception:
+            logger.exception('could not renew the build lease for repo %s', self.repo_id)
+        finally:
+            models.clear()
+
+    def __enter__(self):
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self.beat, name='lease-%s' % self.repo_id)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._heartbeat.join()
+        # any changes from the build that were not committed are discarded
+        # along with it when the build fails, and the poller builds it again
+        if exc[0] is not None:
+            models.rollback()
+            self.retry()
+        if not self.release():
+            logger.warning(
+                'build lease for repo %s was lost before it was released', self.repo_id)
+        return False
@@ -7,54 +7,85 @@ import requests
 import shutil
 from sqlalchemy import desc
 from celery import shared_task
-from chacra import models
-from chacra.async import base, debian, rpm, post_queued, post_deleted
+from chacra import models, storage
+from chacra.async import base, debian, lease, rpm, post_queued, post_deleted, settle_time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def send_repos(repo_ids):
+    """
+    Call the tasks that create (or update) the repositories for
+    ``repo_ids``, which must have been claimed already.
+    """
+    for r in models.Repo.query.filter(models.Repo.id.in_(repo_ids)):
+        if r.type is None:
+            r.type = r.infer_type()
+            if r.type is None:
+                logger.warning('failed to infer repository type')
+            else:
+                logger.warning('inferred repo type as: %s', r.type)
+
+        if r.type == 'rpm':
+            task = rpm.create_rpm_repo
+        elif r.type == 'deb':
+            task = debian.create_deb_repo
+        else:
+            logger.warning('got a repository with an unknown type: %s', r)
+            # release it so that it is tried again on the next cycle
+            r.is_queued = False
+            continue
+        logger.info("repo %s needs to be updated/created", r)
+        try:
+            task.apply_async(
+                (r.id,),
+                countdown=settle_time(r),
+                queue='build_repos',
+            )
+        except Exception:
+            # the claim is committed already, release it so that the repo is
+            # not left queued forever and is sent again on the next cycle
+            logger.exception('could not send repo %s to be built', r)
+            r.is_queued = False
+            continue
+        post_queued(r)
+
+    models.commit()
+
+
 @shared_task(base=base.SQLATask)
 def poll_repos():
     """
     Poll the repository objects that need to be updated and call the tasks
-    that can create (or update) repositories with that information
-
+    that can create (or update) repositories with that information. Repos are
+    usually sent as soon as they are marked (see ``queue_repos``), so this is
+    only a safety net for the ones that were missed.
     """
     logger.info('polling repos....')
-    for r in models.Repo.query.filter_by(needs_update=True, is_queued=False).all():
-        # this repo is being processed, do not pile up and try to get it
-        # processed again until it is done doing work
-        if r.is_updating:
-            continue
-        if r.needs_update:
-            logger.info("repo %s needs to be updated/created", r)
-            r.is_queued = True
-            post_queued(r)
-            if r.type == 'rpm':
-                rpm.create_rpm_repo.apply_async(
-                    (r.id,),
-                    countdown=pecan.conf.quiet_time,
-                    queue='build_repos',
-                    )
-            elif r.type == 'deb':
-                debian.create_deb_repo.apply_async(
-                    (r.id,),
-                    countdown=pecan.conf.quiet_time,
-                    queue='build_repos',
-                    )
-            else:
-                _type = r.infer_type()
-                if _type is None:
-                    logger.warning('failed to infer repository type')
-                    logger.warning('got a repository with an unknown type: %s', r)
-                else:
-                    logger.warning('inferred repo type as: %s', _type)
-                    r.type = _type
+    # builds that died are built again
+    lease.recover_expired()
+    # claiming is atomic so that more than one poller can run at once without
+    # queuing the same repo twice
+    repo_ids = models.repos.claim_dirty_repos()
+    if not repo_ids:
+        logger.info('completed repo polling, no repos need to be updated')
+        return
+    send_repos(repo_ids)
+    logger.info('completed repo polling')
 
-            models.commit()
 
-    logger.info('completed repo polling')
+@shared_task(base=base.SQLATask)
+def queue_repos(repo_ids):
+    """
+    Send the repos in ``repo_ids`` to be built, called right after the
+    transaction that marked them as needing an update is committed. Repos
+    that are already queued are skipped so that a burst of uploads only
+    produces one build, which waits for the rest of the burst to settle.
+    """
+    repo_ids = models.repos.claim_dirty_repos(repo_ids)
+    if repo_ids:
+        send_repos(repo_ids)
 
 
 @shared_task(base=base.SQLATask)
@@ -120,7 +151,7 @@ def delete_repositories(repo_objects, lifespan, keep_minimum):
         logger.info('repo %s is being processed for removal', r)
         for b in r.binaries:
             try:
-                os.remove(b.path)
+                storage.remove(b.path, b.checksum)
             except OSError as err:
                 # no such file, ignore
                 if err.errno == errno.ENOENT:
@@ -141,6 +172,27 @@ def delete_repositories(repo_objects, lifespan, keep_minimum):
         models.commit()
 
 
+@shared_task
+def prune_blobs():
+    """
+    Remove blobs from the blob store that no binary is using anymore
+    """
+    if not storage.blob_root():
+        logger.info('blob_root option is unset, will skip pruning blobs')
+        return
+    removed = storage.prune_blobs()
+    logger.info('completed pruning blobs, removed %s', removed)
+
+
+@shared_task
+def expire_uploads():
+    """
+    Remove resumable uploads that were abandoned by their clients
+    """
+    removed = storage.expire_uploads(pecan.conf.binary_root)
+    logger.info('completed expiring uploads, removed %s', removed)
+
+
 @shared_task(acks_late=True, bind=True, default_retry_delay=30)
 def callback(self, data, project_name, url=None):
     """
@@ -1,7 +1,12 @@
+import hashlib
 import os
+import time
+from multiprocessing.pool import ThreadPool
 from celery import shared_task
+from pecan import conf
 from chacra import models
 from chacra.async import base, post_ready, post_building
+from chacra.async import lease, reschedule_if_busy, queue_follow_up
 from chacra import util
 from chacra.metrics import Counter, Timer
 import logging
@@ -9,6 +14,124 @@ import subprocess
 
 logger = logging.getLogger(__name__)
 
+# how many createrepo processes run at the same time for a repository when
+# ``createrepo_workers`` is not configured
+DEFAULT_WORKERS = 4
+
+# fingerprints and checksum caches of the arch directories, at the root of
+# the repository
+STATE_DIR = '.createrepo'
+
+
+def fingerprint(directory):
+    """
+    A checksum of the RPMs in ``directory``: their names, and the sizes and
+    modification times of the files they link to. It changes whenever
+    createrepo would find something different in it.
+    """
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.rpm'):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            # a link to a binary that is gone
+            continue
+        digest.update('%s %s %s\n' % (name, stat.st_size, stat.st_mtime))
+    return digest.hexdigest()
+
+
+def fingerprint_path(repository_path, directory):
+    return os.path.join(repository_path, STATE_DIR, '%s.fingerprint' % directory)
+
+
+def read_fingerprint(repository_path, directory):
+    try:
+        with open(fingerprint_path(repository_path, directory)) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def write_fingerprint(repository_path, directory, value):
+    path = fingerprint_path(repository_path, directory)
+    util.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def createrepo_command(repository_path, directory):
+    """
+    Update the metadata of ``directory`` reusing the existing one, with a
+    checksum cache that is kept between builds so that only new RPMs are read.
+    """
+    return [
+        'createrepo',
+        '--update',
+        '--cachedir', os.path.join(repository_path, STATE_DIR, 'cache', directory),
+        os.path.join(repository_path, directory),
+    ]
+
+
+def update_metadata(repository_path, directory):
+    """
+    Run createrepo for the ``directory`` (like 'x86_64') of the repository
+    unless its RPMs did not change since the last time it was run. Returns
+    ``True`` if it was run.
+    """
+    path = os.path.join(repository_path, directory)
+    current = fingerprint(path)
+    has_metadata = os.path.exists(os.path.join(path, 'repodata', 'repomd.xml'))
+    if has_metadata and current == read_fingerprint(repository_path, directory):
+        logger.info('no changes in %s, skipping createrepo', path)
+        return False
+    subprocess.check_call(createrepo_command(repository_path, directory))
+    write_fingerprint(repository_path, directory, current)
+    return True
+
+
+class CreaterepoError(Exception):
+
+    def __init__(self, directories):
+        self.directories = directories
+
+    def __str__(self):
+        return 'createrepo failed for: %s' % ', '.join(self.directories)
+
+
+def timed_update(args):
+    """
+    Run :func:`update_metadata` in a worker thread, returning the directory,
+    whether createrepo was run, how long it took and the error if it failed.
+    """
+    repository_path, directory = args
+    start = time.time()
+    try:
+        ran = update_metadata(repository_path, directory)
+    except Exception as err:
+        # anything raised here would make ``pool.map`` lose the results of
+        # every other directory
+        logger.exception('could not update the metadata of %s', directory)
+        return directory, True, time.time() - start, err
+    return directory, ran, time.time() - start, None
+
+
+def update_all_metadata(repository_path, directories, workers=None):
+    """
+    Run :func:`update_metadata` for every directory at the same time, with at
+    most ``workers`` createrepo processes, since the metadata of each
+    directory is independent from the others. A failure in one directory does
+    not stop the rest, see :func:`timed_update` for the results.
+    """
+    workers = workers or getattr(conf, 'createrepo_workers', DEFAULT_WORKERS)
+    pool = ThreadPool(processes=max(1, min(workers, len(directories))))
+    try:
+        return pool.map(timed_update, [(repository_path, d) for d in directories])
+    finally:
+        pool.close()
+        pool.join()
+
 
 @shared_task(base=base.SQLATask)
 def create_rpm_repo(repo_id):
@@ -19,6 +142,8 @@ def create_rpm_repo(repo_id):
     # get the root path for storing repos
     # TODO: Is it possible we can get an ID that doesn't exist anymore?
     repo = models.Repo.get(repo_id)
+    if reschedule_if_busy(repo, create_rpm_repo):
+        return
     post_building(repo)
     timer = Timer(__name__, suffix="create.rpm.%s" % repo.metric_name)
     counter = Counter(__name__, suffix="create.rpm.%s" % repo.metric_name)
@@ -34,51 +159,69 @@ def create_rpm_repo(repo_id):
     paths = util.repo_paths(repo)
     repo_dirs = [os.path.join(paths['absolute'], d) for d in directories]
 
+    # Only one build at a time, changes that come in while another worker
+    # builds it get a build of their own once that one is done
+    build_lease = lease.Lease(repo.id)
+    if not build_lease.acquire():
+        logger.info("repository is being built by another worker: %s", repo)
+        repo.is_queued = False
+        models.commit()
+        return
+
     # Before doing work that might take very long to complete, set the repo
     # path in the object and mark needs_update as False
     repo.path = paths['absolute']
-    repo.is_updating = True
     repo.is_queued = False
     repo.needs_update = False
     models.commit()
 
-    # this is safe to do, behind the scenes it is just trying to create them if
-    # they don't exist and it will include the 'absolute' path
-    for d in repo_dirs:
-        util.makedirs(d)
-
-    # now that structure is done, we need to symlink the RPMs that belong
-    # to this repo so that we can create the metadata.
-    conf_extra_repos = util.get_extra_repos(repo.project.name, repo.ref)
-    extra_binaries = []
-    for project_name, project_refs in conf_extra_repos.items():
-        for ref in project_refs:
-            extra_binaries += util.get_extra_binaries(
-                project_name,
-                repo.distro,
-                repo.distro_version,
-                ref=ref if ref != 'all' else None
-            )
-
-    all_binaries = extra_binaries + [b for b in repo.binaries]
-    timer.intermediate('collection')
-    for binary in all_binaries:
-        source = binary.path
-        arch_directory = util.infer_arch_directory(binary.name)
-        destination_dir = os.path.join(paths['absolute'], arch_directory)
-        destination = os.path.join(destination_dir, binary.name)
-        try:
-            if not os.path.exists(destination):
-                os.symlink(source, destination)
-        except OSError:
-            logger.exception('could not symlink')
+    with build_lease:
+        # this is safe to do, behind the scenes it is just trying to create them if
+        # they don't exist and it will include the 'absolute' path
+        for d in repo_dirs:
+            util.makedirs(d)
+
+        # now that structure is done, we need to symlink the RPMs that belong
+        # to this repo so that we can create the metadata.
+        conf_extra_repos = util.get_extra_repos(repo.project.name, repo.ref)
+        extra_binaries = []
+        for project_name, project_refs in conf_extra_repos.items():
+            for ref in project_refs:
+                extra_binaries += util.get_extra_binaries(
+                    project_name,
+                    repo.distro,
+                    repo.distro_version,
+                    ref=ref if ref != 'all' else None
+                )
+
+        all_binaries = extra_binaries + [b for b in repo.binaries]
+        timer.intermediate('collection')
+        for binary in all_binaries:
+            source = binary.path
+            arch_directory = util.infer_arch_directory(binary.name)
+            destination_dir = os.path.join(paths['absolute'], arch_directory)
+            destination = os.path.join(destination_dir, binary.name)
+            try:
+                if not os.path.exists(destination):
+                    os.symlink(source, destination)
+            except OSError:
+                logger.exception('could not symlink')
 
-    for d in repo_dirs:
-        subprocess.check_call(['createrepo', d])
+        timer.intermediate('symlinks')
+
+        failed = []
+        for directory, ran, elapsed, err in update_all_metadata(paths['absolute'], directories):
+            if ran:
+                timer.send('createrepo.%s' % directory, elapsed)
+            if err is not None:
+                logger.error('createrepo failed for %s: %s', directory, err)
+                failed.append(directory)
+        timer.intermediate('createrepo')
+        if failed:
+            raise CreaterepoError(failed)
 
     logger.info("finished processing repository: %s", repo)
-    repo.is_updating = False
-    models.commit()
     timer.stop()
     counter += 1
     post_ready(repo)
+    queue_follow_up(repo)
@@ -0,0 +1,71 @@
+"""
+Send repos to be built as soon as the transaction that marks them as needing
+an update is committed, instead of waiting for the next ``poll_repos`` cycle.
+Enabled with ``trigger_builds = True`` in the configuration.
+
+Repos are collected for the whole transaction, so a request that uploads many
+binaries sends a single message, and ``queue_repos`` skips repos that are
+queued already.
+"""
+import logging
+
+import pecan
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from chacra import models
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(pecan.conf, 'trigger_builds', False)
+
+
+def mark(target, value, oldvalue, initiator):
+    """
+    Keep track of repos that get ``needs_update`` set, they don't have an id
+    yet if they are new so the objects are kept until the flush.
+    """
+    if not value:
+        return
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('dirty_repos', set()).add(target)
+
+
+def collect(session, flush_context):
+    repos = session.info.pop('dirty_repos', None)
+    if not repos:
+        return
+    repo_ids = session.info.setdefault('dirty_repo_ids', set())
+    for repo in repos:
+        if repo.id is not None and repo.needs_update:
+            repo_ids.add(repo.id)
+
+
+def send(session):
+    session.info.pop('dirty_repos', None)
+    repo_ids = session.info.pop('dirty_repo_ids', None)
+    if not repo_ids or not enabled():
+        return
+    from chacra.async import recurring
+    try:
+        recurring.queue_repos.apply_async(
+            args=(sorted(repo_ids),),
+            queue='poll_repos',
+        )
+    except Exception:
+        # the transaction is committed already, ``poll_repos`` picks them up
+        logger.exception('could not send repos to be built: %s', sorted(repo_ids))
+
+
+def discard(session):
+    session.info.pop('dirty_repos', None)
+    session.info.pop('dirty_repo_ids', None)
+
+
+event.listen(models.Repo.needs_update, 'set', mark)
+event.listen(models.Session, 'after_flush_postexec', collect)
+event.listen(models.Session, 'after_commit', send)
+event.listen(models.Session, 'after_rollback', discard)
@@ -0,0 +1,32 @@
+"""
+``Cache-Control`` policies so that a caching proxy can sit in front of the
+API.
+
+Binaries for a concrete sha1 (anything but ``head``) never change unless they
+are replaced with ``force``. A download URL that pins the ``generation`` of the
+binary (which changes whenever its content is replaced) is cached forever, for
+anything else caches must revalidate after ``cache_max_age`` seconds.
+"""
+from pecan import conf
+
+
+# one year, the maximum recommended by RFC 7234
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def is_pinned(sha1):
+    return sha1 is not None and sha1 != 'head'
+
+
+def revalidate():
+    return 'public, max-age=%d, must-revalidate' % getattr(conf, 'cache_max_age', 60)
+
+
+def binary_cache_control(binary, generation=None):
+    """
+    The ``Cache-Control`` value for downloading ``binary`` from a URL that
+    requested ``generation``
+    """
+    if is_pinned(binary.sha1) and generation and generation == binary.generation:
+        return IMMUTABLE
+    return revalidate()
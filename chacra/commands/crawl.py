@@ -0,0 +1,196 @@
+import datetime
+import logging
+import os
+from multiprocessing import Pool, cpu_count
+
+from pecan.commands.base import BaseCommand
+
+from chacra import models, storage, util
+from chacra.models.binaries import get_or_create_repo
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def out(string):
+    print "==> %s" % string
+
+
+def walk(path):
+    """
+    Yield the path of every file under ``path``. ``scandir`` is used when it
+    is available since it avoids a ``stat`` call per entry.
+    """
+    if scandir is None:
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in filenames:
+                yield os.path.join(dirpath, name)
+        return
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = scandir(directory)
+        except OSError:
+            logger.warning('could not read %s', directory)
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+
+def find_files(path, startswith=None, endswith=None, has=None):
+    """
+    Yield the path of every file under ``path`` whose name matches all the
+    filters that are set.
+    """
+    for file_path in walk(path):
+        name = os.path.basename(file_path)
+        if name.startswith('.'):
+            continue
+        if startswith and not name.startswith(startswith):
+            continue
+        if endswith and not name.endswith(endswith):
+            continue
+        if has and has not in name:
+            continue
+        yield file_path
+
+
+def inspect_file(path):
+    """
+    Runs in a worker process, returns the path along with the size and
+    checksum of the file, or ``None`` for both if it could not be read.
+    """
+    try:
+        return path, os.path.getsize(path), storage.checksum(path)
+    except (IOError, OSError):
+        return path, None, None
+
+
+class CrawlCommand(BaseCommand):
+    """
+    Load a pecan environment and import the binaries found in a directory
+    tree, for rebuilding a server from existing files.
+    """
+
+    arguments = BaseCommand.arguments + (
+        dict(name='path', help='the directory to crawl'),
+        dict(name='--project', required=True),
+        dict(name='--ref', required=True),
+        dict(name='--sha1', default='head'),
+        dict(name='--distro', required=True),
+        dict(name='--version', dest='distro_version', required=True),
+        dict(name='--arch', required=True),
+        dict(name='--flavor', default='default'),
+        dict(name='--startswith', help='only import names starting with this'),
+        dict(name='--endswith', help='only import names ending with this'),
+        dict(name='--has', help='only import names that include this'),
+        dict(name='--workers', type=int, default=cpu_count(),
+             help='number of processes used to hash files'),
+        dict(name='--batch-size', dest='batch_size', type=int, default=500,
+             help='number of binaries inserted per transaction'),
+    )
+
+    def run(self, args):
+        super(CrawlCommand, self).run(args)
+        out("LOADING ENVIRONMENT")
+        self.load_app()
+        models.start()
+        try:
+            imported = self.crawl(args)
+        except:
+            models.rollback()
+            out("ROLLING BACK... ")
+            raise
+        out("IMPORTED %s BINARIES" % imported)
+
+    def crawl(self, args):
+        project = models.projects.get_or_create(name=args.project)
+        repo = None
+        # binaries already registered are skipped, along with files with the
+        # same name found in other directories
+        seen = set(
+            name for name, in models.Binary.filter_by(
+                project=project,
+                ref=args.ref,
+                sha1=args.sha1,
+                distro=args.distro,
+                distro_version=args.distro_version,
+                arch=args.arch,
+                flavor=args.flavor,
+            ).with_entities(models.Binary.name)
+        )
+        paths = []
+        for path in find_files(args.path, args.startswith, args.endswith, args.has):
+            name = os.path.basename(path)
+            if name not in seen:
+                seen.add(name)
+                paths.append(path)
+        if not paths:
+            out("NO NEW BINARIES FOUND IN %s" % args.path)
+            return 0
+
+        out("HASHING %s FILES WITH %s WORKERS" % (len(paths), args.workers))
+        pool = Pool(processes=max(1, args.workers))
+        imported = 0
+        batch = []
+        try:
+            for path, size, checksum in pool.imap_unordered(inspect_file, paths):
+                if checksum is None:
+                    out("COULD NOT READ %s, SKIPPING" % path)
+                    continue
+                if repo is None:
+                    repo = get_or_create_repo(
+                        project, args.ref, args.distro, args.distro_version,
+                        sha1=args.sha1, flavor=args.flavor,
+                        name=os.path.basename(path),
+                    )
+                    models.flush()
+                now = datetime.datetime.utcnow()
+                batch.append(dict(
+                    name=os.path.basename(path),
+                    path=path,
+                    size=size,
+                    checksum=checksum,
+                    created=now,
+                    modified=now,
+                    project_id=project.id,
+                    repo_id=repo.id,
+                    ref=args.ref,
+                    sha1=args.sha1,
+                    distro=args.distro,
+                    distro_version=args.distro_version,
+                    arch=args.arch,
+                    flavor=args.flavor,
+                ))
+                if len(batch) >= args.batch_size:
+                    imported += self.insert(batch)
+                    batch = []
+        finally:
+            pool.close()
+            pool.join()
+        if batch:
+            imported += self.insert(batch)
+
+        if imported:
+            binary = models.Binary.filter_by(repo=repo).first()
+            util.mark_related_repos(binary)
+            models.commit()
+        return imported
+
+    def insert(self, batch):
+        models.Session.bulk_insert_mappings(models.Binary, batch)
+        models.commit()
+        out("INSERTED %s BINARIES" % len(batch))
+        return len(batch)
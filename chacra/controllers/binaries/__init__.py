@@ -1,10 +1,11 @@
 import os
 import logging
 import pecan
-from pecan import expose, abort, request, response, conf
+from pecan import expose, abort, request, response
 from pecan.secure import secure
 from webob.static import FileIter
 from chacra.models import Binary, Project
+from chacra import caching, downloads, spool, storage, util
 from chacra.controllers import error
 from chacra.auth import basic_auth
 
@@ -13,7 +14,7 @@ logger = logging.getLogger(__name__)
 
 class BinaryController(object):
 
-    def __init__(self, binary_name):
+    def __init__(self, binary_name, binary=None):
         self.binary_name = binary_name
         self.project = Project.get(request.context['project_id'])
         self.distro_version = request.context['distro_version']
@@ -22,6 +23,10 @@ class BinaryController(object):
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
         self.flavor = request.context.get('flavor', 'default')
+        # already resolved along with the whole URL (see controllers.resolve)
+        if binary is not None:
+            self.binary = binary
+            return
         self.binary = Binary.query.filter_by(
             name=binary_name,
             ref=self.ref,
@@ -37,54 +42,72 @@ class BinaryController(object):
         """
         Special method for internal redirect URI's so that webservers (like
         Nginx) can serve downloads to clients while the app just delegates.
-        This method will require an Nginx configuration that points to
-        resources and match `binary_root` URIs::
+        For Nginx this requires an ``internal`` location for every directory
+        configured in ``download_locations`` (``binary_root`` by default)::
 
-            location /home/ubuntu/repos/ {
+            location /b/ {
               internal;
-              alias   /files/;
+              alias   /opt/binaries/;
             }
 
-        `alias` can be anything, it would probably make sense to have a set of rules that allow
-        distinct URIs, like::
-
-            location /home/ubuntu/repos/rpm-firefly/ {
-              internal;
-              alias   /files/rpm-firefly/;
-            }
-
-
         There are two ways to get binaries into this app: via existing files in
         certain paths POSTing JSON to the arch/ endpoint, or via actual upload
         of the binary. So if many locations need to be supported, they each
         need to have a corresponding section in Nginx to be configured.
+
+        See :mod:`chacra.downloads` for the supported backends.
         """
         if not self.binary:
             abort(404)
-        # we need to slap some headers so Nginx can serve this
-        # TODO: maybe disable this for testing?
         # XXX Maybe we don't need to set Content-Disposition here?
         response.headers['Content-Disposition'] = 'attachment; filename=%s' % str(self.binary.name)
-        if conf.delegate_downloads is False:
-            f = open(self.binary.path, 'rb')
+        response.cache_control = caching.binary_cache_control(
+            self.binary, request.GET.get('generation'))
+        if not downloads.offload(self.binary.path, response):
+            self.serve_file()
+
+    def serve_file(self):
+        """
+        Serve the binary from this process. The checksum is used as a strong
+        ETag and, along with the modification time of the file, allows
+        WebOb to answer conditional requests with a 304 and to serve byte
+        ranges so that interrupted downloads can be resumed.
+        """
+        f = open(self.binary.path, 'rb')
+        stat = os.fstat(f.fileno())
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        # ranges need to seek in the file, full downloads go through the
+        # server's file wrapper so that it can use sendfile
+        if request.range or file_wrapper is None:
             response.app_iter = FileIter(f)
         else:
-            relative_path = self.binary.path.split(pecan.conf.binary_root)[-1].strip('/')
-            # FIXME: this should be read from configuration, this is not configurable
-            # at the moment and relies on the nginx config being properly set
-            path = os.path.join('/b/', relative_path)
-            logger.info('setting path header: %s', path)
-            response.headers['X-Accel-Redirect'] = path
+            response.app_iter = file_wrapper(f, storage.CHUNK_SIZE)
+        response.content_length = stat.st_size
+        response.last_modified = stat.st_mtime
+        if self.binary.checksum:
+            response.etag = str(self.binary.checksum)
+        response.accept_ranges = 'bytes'
+        response.conditional_response = True
 
     @secure(basic_auth)
     @index.when(method='POST', template='json')
     def index_post(self):
+        # the web server wrote the body to disk and only passed its path
+        spooled = self.spooled_file()
+        if spooled is not None:
+            return self.adopt_file(spooled)
+
         try:
             data = request.json
             name = data.get('name')
         except ValueError:
             error('/errors/invalid/', 'could not decode JSON body')
 
+        # asks to reuse content that was already uploaded (by checksum), so
+        # that the client can skip sending the bytes
+        if data.get('link'):
+            return self.link_existing(data)
+
         # updates the binary only if explicitly told to do so
         if self.binary:
             if not data.get('force'):
@@ -119,6 +142,120 @@ class BinaryController(object):
 
         return {}
 
+    def link_existing(self, data):
+        """
+        Create (or update, with "force") the binary from content that is
+        already stored, matching it by checksum and (optionally) size. When
+        the content is not found a 404 is returned and the client should go
+        ahead and upload the binary.
+        """
+        checksum = data.get('checksum')
+        if not checksum:
+            error('/errors/invalid/', "could not find required key: 'checksum'")
+        if not storage.valid_checksum(checksum):
+            error('/errors/invalid/', 'invalid checksum: %s' % checksum)
+        size = data.get('size')
+        if self.binary and not data.get('force'):
+            error('/errors/invalid/', 'file already exists and "force" flag was not used')
+
+        source = self.find_content(checksum, size)
+        if source is None:
+            error(
+                '/errors/not_found/',
+                'no binary found with checksum: %s' % checksum
+            )
+
+        destination = os.path.join(self.create_directory(), self.binary_name)
+        if os.path.exists(destination):
+            response.status = 200
+        else:
+            response.status = 201
+        storage.link(source, destination, checksum=checksum)
+        size = os.path.getsize(destination)
+
+        if self.binary is None:
+            self.binary = Binary(
+                self.binary_name, self.project, arch=self.arch,
+                distro=self.distro, distro_version=self.distro_version,
+                ref=self.ref, sha1=self.sha1, flavor=self.flavor,
+                path=destination, checksum=checksum, size=size
+            )
+        else:
+            self.binary.set_content(destination, checksum, size)
+        util.mark_related_repos(self.binary)
+        return {}
+
+    def spooled_file(self):
+        """
+        With ``upload_spool_root`` configured the web server can write the
+        request body to a file in that directory and pass its path in the
+        ``X-Upload-File`` header, instead of proxying the bytes. Returns
+        ``None`` when the request has no such file.
+
+        Files that are not adopted are removed by ``spool.SpoolCleanup`` once
+        the request is done.
+        """
+        header = request.headers.get('X-Upload-File')
+        if not header:
+            return None
+        if not spool.spool_root():
+            error('/errors/invalid/', 'upload hand-off is not enabled')
+        path = spool.spooled_path(header)
+        if path is None:
+            error('/errors/invalid/', 'uploaded file is not in the spool directory')
+        if not os.path.isfile(path):
+            error('/errors/invalid/', 'uploaded file does not exist: %s' % path)
+        return path
+
+    def adopt_file(self, path):
+        """
+        Move a request body that the web server wrote to ``path`` into place
+        and create (or update, with ``force``) the binary.
+        """
+        if self.binary and request.params.get('force', False) is False:
+            error('/errors/invalid/', 'file already exists and "force" flag was not used')
+
+        destination = os.path.join(self.create_directory(), self.binary_name)
+        if os.path.exists(destination):
+            response.status = 200
+        else:
+            response.status = 201
+        checksum, size = storage.adopt(path, destination)
+
+        if self.binary is None:
+            self.binary = Binary(
+                self.binary_name, self.project, arch=self.arch,
+                distro=self.distro, distro_version=self.distro_version,
+                ref=self.ref, sha1=self.sha1, flavor=self.flavor,
+                path=destination, checksum=checksum, size=size
+            )
+        else:
+            self.binary.set_content(destination, checksum, size)
+        util.mark_related_repos(self.binary)
+        return {}
+
+    def find_content(self, checksum, size=None):
+        """
+        Return the path to a file on disk with the given checksum, or ``None``
+        if no stored binary has that content.
+        """
+        if storage.blob_root():
+            blob = storage.blob_path(checksum)
+            if os.path.exists(blob):
+                if size is None or os.path.getsize(blob) == size:
+                    return blob
+
+        query = Binary.query.with_entities(Binary.path).filter(
+            Binary.checksum == checksum,
+            Binary.path != None)  # noqa
+        if size is not None:
+            query = query.filter(Binary.size == size)
+        # binaries can be removed from disk outside of chacra, so the first
+        # row may not be usable
+        for path, in query:
+            if os.path.exists(path):
+                return path
+
     @secure(basic_auth)
     @index.when(method='PUT', template='json')
     def index_put(self):
@@ -126,10 +263,11 @@ class BinaryController(object):
         if contents is False:
             error('/errors/invalid/', 'no file object found in "file" param in POST request')
         file_obj = contents.file
-        # this looks odd, path is not changing, but we need to 'ping' the object by
-        # re-saving the attribute so that the listener can update the checksum and modified
-        # timestamps
-        self.binary.path = self.save_file(file_obj)
+        # path is not changing, but the checksum and size computed while saving
+        # are handed over so that the listener does not need to read the file
+        # again
+        path, checksum, size = self.save_file(file_obj)
+        self.binary.set_content(path, checksum, size)
         return dict()
 
     @secure(basic_auth)
@@ -138,12 +276,13 @@ class BinaryController(object):
         if not self.binary:
             abort(404)
         binary_path = self.binary.path
+        checksum = self.binary.checksum
         repo = self.binary.repo
         project = self.binary.project
         self.binary.delete()
         try:
             if binary_path:
-                os.remove(binary_path)
+                storage.remove(binary_path, checksum)
         except (IOError, OSError):
             msg = "Could not remove the binary path: %s" % binary_path
             logger.exception(msg)
@@ -173,7 +312,8 @@ class BinaryController(object):
     def save_file(self, file_obj):
         # TODO: we should just use self.binary.path for this
         dir_path = self.create_directory()
-        if self.binary_name in os.listdir(dir_path):
+        destination = os.path.join(dir_path, self.binary_name)
+        if os.path.exists(destination):
             # resource exists so we will update it
             response.status = 200
         else:
@@ -182,12 +322,8 @@ class BinaryController(object):
             # because we are PUT not POST
             response.status = 201
 
-        destination = os.path.join(dir_path, self.binary_name)
-
-        with open(destination, 'wb') as f:
-            file_iterable = FileIter(file_obj)
-            for chunk in file_iterable:
-                f.write(chunk)
+        checksum, size = storage.save(file_obj, destination)
 
-        # return the full path to the saved object:
-        return destination
+        # return the full path to the saved object, along with the checksum
+        # and size that were computed while writing it
+        return destination, checksum, size
@@ -4,13 +4,14 @@ import pecan
 from pecan import response
 from pecan.secure import secure
 from pecan import expose, abort, request
-from webob.static import FileIter
 from chacra.models import Binary
-from chacra import models, util
+from chacra import models, util, storage
 from chacra.controllers import error
-from chacra.controllers.util import repository_is_automatic
 from chacra.controllers.binaries import BinaryController
 from chacra.controllers.binaries import flavors as _flavors
+from chacra.controllers.binaries import uploads as _uploads
+from chacra.controllers.binaries import batch as _batch
+from chacra.controllers.binaries import register as _register
 from chacra.auth import basic_auth
 
 
@@ -34,37 +35,28 @@ class ArchController(object):
 
     @index.when(method='HEAD', template='json')
     def index_head(self):
-        binaries = self.project.binaries.filter_by(
-            distro=self.distro,
-            distro_version=self.distro_version,
-            ref=self.ref,
-            sha1=self.sha1,
-            arch=self.arch).all()
-
-        if not binaries:
+        if not Binary.exists(
+                project=self.project,
+                distro=self.distro,
+                distro_version=self.distro_version,
+                ref=self.ref,
+                sha1=self.sha1,
+                arch=self.arch):
             abort(404)
         return dict()
 
     @index.when(method='GET', template='json')
     def index_get(self):
-        binaries = self.project.binaries.filter_by(
-            distro=self.distro,
-            distro_version=self.distro_version,
-            ref=self.ref,
-            sha1=self.sha1,
-            arch=self.arch).all()
-
-        if not binaries:
-            abort(404)
-
         resp = {}
         for b in self.project.binaries.filter_by(
                 distro=self.distro,
                 distro_version=self.distro_version,
                 ref=self.ref,
                 sha1=self.sha1,
-                arch=self.arch).all():
+                arch=self.arch):
             resp[b.name] = b
+        if not resp:
+            abort(404)
         return resp
 
     def get_binary(self, name):
@@ -89,7 +81,7 @@ class ArchController(object):
                 if request.POST.get('force', False) is False:
                     error('/errors/invalid', 'resource already exists and "force" key was not used')
 
-        full_path = self.save_file(file_obj)
+        full_path, checksum, size = self.save_file(file_obj)
 
         if self.binary is None:
             path = full_path
@@ -102,10 +94,10 @@ class ArchController(object):
             self.binary = Binary(
                 self.binary_name, self.project, arch=arch,
                 distro=distro, distro_version=distro_version,
-                ref=ref, sha1=sha1, path=path, size=os.path.getsize(path)
+                ref=ref, sha1=sha1, path=path, size=size, checksum=checksum
             )
         else:
-            self.binary.path = full_path
+            self.binary.set_content(full_path, checksum, size)
 
         # check if this binary is interesting for other configured projects,
         # and if so, then mark those other repos so that they can be re-built
@@ -113,42 +105,7 @@ class ArchController(object):
         return dict()
 
     def mark_related_repos(self):
-        related_projects = util.get_related_projects(self.project.name)
-        repos = []
-        projects = []
-        for project_name, refs in related_projects.items():
-            p = models.projects.get_or_create(name=project_name)
-            projects.append(p)
-            repo_query = []
-            if refs == ['all']:
-                # we need all the repos available
-                repo_query = models.Repo.filter_by(project=p).all()
-            else:
-                for ref in refs:
-                    repo_query = models.Repo.filter_by(project=p, ref=ref).all()
-            if repo_query:
-                for r in repo_query:
-                    repos.append(r)
-
-        if not repos:
-            # there are no repositories associated with this project, so go ahead
-            # and create one so that it can be queried by the celery task later
-            for project in projects:
-                repo = models.Repo(
-                    project,
-                    self.ref,
-                    self.distro,
-                    self.distro_version,
-                    sha1=self.sha1,
-                )
-                repo.needs_update = repository_is_automatic(project.name)
-                repo.type = self.binary._get_repo_type()
-
-        else:
-            for repo in repos:
-                repo.needs_update = repository_is_automatic(repo.project.name)
-                if repo.type is None:
-                    repo.type = self.binary._get_repo_type()
+        util.mark_related_repos(self.binary)
 
     def create_directory(self):
         end_part = request.url.split('binaries/')[-1].rstrip('/')
@@ -161,25 +118,25 @@ class ArchController(object):
 
     def save_file(self, file_obj):
         dir_path = self.create_directory()
-        if self.binary_name in os.listdir(dir_path):
+        destination = os.path.join(dir_path, self.binary_name)
+        if os.path.exists(destination):
             # resource exists so we will update it
             response.status = 200
         else:
             # we will create a resource
             response.status = 201
 
-        destination = os.path.join(dir_path, self.binary_name)
-
-        with open(destination, 'wb') as f:
-            file_iterable = FileIter(file_obj)
-            for chunk in file_iterable:
-                f.write(chunk)
+        checksum, size = storage.save(file_obj, destination)
 
-        # return the full path to the saved object:
-        return destination
+        # return the full path to the saved object, along with the checksum
+        # and size that were computed while writing it
+        return destination, checksum, size
 
     @expose()
     def _lookup(self, name, *remainder):
         return BinaryController(name), remainder
 
     flavors = _flavors.FlavorsController()
+    uploads = _uploads.UploadsController()
+    batch = _batch.BatchController()
+    register = _register.RegisterController()
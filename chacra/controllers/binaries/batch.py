@@ -0,0 +1,151 @@
+"""
+Upload every binary of a build for an architecture (or flavor) in a single
+request, instead of one request per binary. The binaries can be sent as
+a multipart body with several ``file`` fields, or as a (optionally compressed)
+tar stream::
+
+    POST /binaries/ceph/master/head/centos/7/x86_64/batch/
+    Content-Type: application/x-tar
+
+All the binaries are written to temporary files first and only put in place
+once every one of them was accepted, then they are created in one transaction
+and their repository is marked to be rebuilt once. The ``force`` flag (a form field, or a query
+argument for tar streams) is required to replace existing binaries.
+"""
+import logging
+import os
+import tarfile
+from pecan import expose, abort, request, response
+from pecan.secure import secure
+from chacra import models, util, storage
+from chacra.controllers import error
+from chacra.controllers.binaries.uploads import (
+    binary_directory, binary_exists, context_binaries, valid_name
+)
+from chacra.auth import basic_auth
+
+logger = logging.getLogger(__name__)
+
+tar_content_types = [
+    'application/x-tar',
+    'application/x-gtar',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+]
+
+
+def request_files():
+    """
+    Yield the name and file object of every binary in the request, reading
+    tar streams one member at a time so they are never held in memory.
+    """
+    if request.content_type in tar_content_types:
+        tar = tarfile.open(fileobj=request.body_file, mode='r|*')
+        for member in tar:
+            if not member.isfile():
+                continue
+            yield os.path.basename(member.name), tar.extractfile(member)
+    else:
+        for field in request.POST.getall('file'):
+            if hasattr(field, 'file'):
+                # some clients send the full path of the file
+                yield os.path.basename(field.filename or ''), field.file
+
+
+class BatchController(object):
+
+    @expose(generic=True, template='json')
+    def index(self):
+        abort(405)
+
+    @secure(basic_auth)
+    @index.when(method='POST', template='json')
+    def index_post(self):
+        force = request.params.get('force', False) is not False
+        directory = binary_directory('batch')
+        util.makedirs(directory)
+        # a single query for all the binaries that might get replaced, so
+        # that no lookups happen while files are being written
+        existing = dict((b.name, b) for b in context_binaries())
+
+        staged = []
+        names = set()
+        try:
+            for name, file_obj in request_files():
+                if not valid_name(name):
+                    error('/errors/invalid/', 'invalid binary name: %s' % name)
+                if name in names:
+                    error('/errors/invalid/', 'binary was sent more than once: %s' % name)
+                names.add(name)
+                if binary_exists(existing.get(name)) and not force:
+                    error(
+                        '/errors/invalid/',
+                        '%s already exists and "force" key was not used' % name
+                    )
+                destination = os.path.join(directory, name)
+                temp_path, checksum, size = storage.stage(file_obj, destination)
+                staged.append((name, destination, temp_path, checksum, size))
+        except Exception as err:
+            # nothing was put in place yet
+            for name, destination, temp_path, checksum, size in staged:
+                storage.remove_quietly(temp_path)
+            if isinstance(err, tarfile.TarError):
+                error('/errors/invalid/', 'could not read tar stream: %s' % err)
+            raise
+
+        # every binary was accepted, only now are existing ones replaced
+        saved = []
+        created = []
+        try:
+            for name, destination, temp_path, checksum, size in staged:
+                if not os.path.exists(destination):
+                    created.append(destination)
+                storage.publish(temp_path, destination, checksum=checksum)
+                saved.append((name, destination, checksum, size))
+        except Exception:
+            for name, destination, temp_path, checksum, size in staged[len(saved):]:
+                if os.path.exists(temp_path):
+                    storage.remove_quietly(temp_path)
+            for path in created:
+                if os.path.exists(path):
+                    storage.remove_quietly(path)
+            raise
+
+        if not saved:
+            error('/errors/invalid/', 'no files found in request')
+
+        project = models.Project.get(request.context['project_id'])
+        repo = None
+        binaries = {}
+        for name, destination, checksum, size in saved:
+            binary = existing.get(name)
+            if binary is None:
+                # the repo is looked up (or created) for the first binary only
+                binary = models.Binary(
+                    name, project, repo=repo,
+                    arch=request.context['arch'],
+                    distro=request.context['distro'],
+                    distro_version=request.context['distro_version'],
+                    ref=request.context['ref'],
+                    sha1=request.context['sha1'],
+                    flavor=request.context.get('flavor', 'default'),
+                    path=destination,
+                    size=size,
+                    checksum=checksum,
+                )
+                repo = binary.repo
+            else:
+                binary.set_content(destination, checksum, size)
+            binaries[name] = binary
+
+        # every binary shares the same project, ref and distro so related
+        # repos only need to be marked once
+        util.mark_related_repos(binaries[saved[0][0]])
+        logger.info('stored %s binaries in %s', len(saved), directory)
+
+        if created:
+            response.status = 201
+        else:
+            response.status = 200
+        return binaries
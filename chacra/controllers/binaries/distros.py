@@ -2,6 +2,7 @@ from pecan import expose, abort, request
 from chacra import models
 from chacra.controllers import error
 from chacra.controllers.binaries.archs import ArchController
+from chacra.controllers.binaries.uploads import is_upload_path
 
 
 class DistroVersionController(object):
@@ -16,21 +17,22 @@ class DistroVersionController(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.distro_version not in self.project.distro_versions:
+        if not models.Binary.exists(
+                project=self.project, distro_version=self.distro_version):
             abort(404)
 
         resp = {}
-        for arch in self.project.archs:
-            binaries = [
-                b.name for b in models.Binary.filter_by(
-                    project=self.project,
-                    distro_version=self.distro_version,
-                    distro=self.distro_name,
-                    ref=self.ref,
-                    sha1=self.sha1,
-                    arch=arch).all()]
-            if binaries:
-                resp[arch] = list(set(binaries))
+        names = models.Binary.query.with_entities(
+            models.Binary.arch, models.Binary.name
+        ).filter_by(
+            project=self.project,
+            distro_version=self.distro_version,
+            distro=self.distro_name,
+            ref=self.ref,
+            sha1=self.sha1
+        ).distinct()
+        for arch, name in names:
+            resp.setdefault(arch, []).append(name)
         return resp
 
     @index.when(method='POST', template='json')
@@ -39,8 +41,9 @@ class DistroVersionController(object):
 
     @expose()
     def _lookup(self, name, *remainder):
-        if request.method in  ['HEAD', 'GET']:
-            if self.distro_version not in self.project.distro_versions:
+        if request.method in  ['HEAD', 'GET'] and not is_upload_path(remainder):
+            if not models.Binary.exists(
+                    project=self.project, distro_version=self.distro_version):
                 abort(404)
         return ArchController(name), remainder
 
@@ -57,23 +60,17 @@ class DistroController(object):
     def index(self):
         resp = {}
 
-        binaries = models.Binary.filter_by(
+        archs = models.Binary.query.with_entities(
+            models.Binary.distro_version, models.Binary.arch
+        ).filter_by(
             project=self.project,
             distro=self.distro_name,
             ref=self.ref,
-            sha1=self.sha1).all()
-
-        if not binaries:
-            abort(404)
-
-        distro_versions = set([b.distro_version for b in binaries])
+            sha1=self.sha1
+        ).distinct()
 
-        for distro_version in distro_versions:
-            resp[distro_version] = list(
-                set(
-                    [b.arch for b in binaries if b.distro_version == distro_version]
-                )
-            )
+        for distro_version, arch in archs:
+            resp.setdefault(distro_version, []).append(arch)
         if not resp:
             abort(404)
         return resp
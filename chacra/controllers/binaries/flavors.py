@@ -3,11 +3,12 @@ import logging
 import pecan
 from pecan import expose, abort, request, response
 from pecan.secure import secure
-from webob.static import FileIter
-from chacra import models, util
+from chacra import models, util, storage
 from chacra.controllers import error
-from chacra.controllers.util import repository_is_automatic
 from chacra.controllers.binaries import BinaryController
+from chacra.controllers.binaries import uploads as _uploads
+from chacra.controllers.binaries import batch as _batch
+from chacra.controllers.binaries import register as _register
 from chacra.auth import basic_auth
 
 logger = logging.getLogger(__name__)
@@ -31,31 +32,19 @@ class FlavorController(object):
 
     @index.when(method='HEAD', template='json')
     def index_head(self):
-        binaries = self.project.binaries.filter_by(
-            distro=self.distro,
-            distro_version=self.distro_version,
-            ref=self.ref,
-            sha1=self.sha1,
-            flavor=self.flavor,
-            arch=self.arch).all()
-
-        if not binaries:
+        if not models.Binary.exists(
+                project=self.project,
+                distro=self.distro,
+                distro_version=self.distro_version,
+                ref=self.ref,
+                sha1=self.sha1,
+                flavor=self.flavor,
+                arch=self.arch):
             abort(404)
         return dict()
 
     @index.when(method='GET', template='json')
     def index_get(self):
-        binaries = self.project.binaries.filter_by(
-            distro=self.distro,
-            distro_version=self.distro_version,
-            ref=self.ref,
-            sha1=self.sha1,
-            flavor=self.flavor,
-            arch=self.arch).all()
-
-        if not binaries:
-            abort(404)
-
         resp = {}
         for b in self.project.binaries.filter_by(
                 distro=self.distro,
@@ -63,8 +52,10 @@ class FlavorController(object):
                 ref=self.ref,
                 sha1=self.sha1,
                 flavor=self.flavor,
-                arch=self.arch).all():
+                arch=self.arch):
             resp[b.name] = b
+        if not resp:
+            abort(404)
         return resp
 
     def get_binary(self, name):
@@ -89,7 +80,7 @@ class FlavorController(object):
                 if request.POST.get('force', False) is False:
                     error('/errors/invalid', 'resource already exists and "force" key was not used')
 
-        full_path = self.save_file(file_obj)
+        full_path, checksum, size = self.save_file(file_obj)
 
         if self.binary is None:
             path = full_path
@@ -102,11 +93,11 @@ class FlavorController(object):
             self.binary = models.Binary(
                 self.binary_name, self.project, arch=arch,
                 distro=distro, distro_version=distro_version,
-                ref=ref, sha1=sha1, path=path, size=os.path.getsize(path),
+                ref=ref, sha1=sha1, path=path, size=size, checksum=checksum,
                 flavor=self.flavor
             )
         else:
-            self.binary.path = full_path
+            self.binary.set_content(full_path, checksum, size)
 
         # check if this binary is interesting for other configured projects,
         # and if so, then mark those other repos so that they can be re-built
@@ -115,42 +106,7 @@ class FlavorController(object):
         return dict()
 
     def mark_related_repos(self):
-        related_projects = util.get_related_projects(self.project.name)
-        repos = []
-        projects = []
-        for project_name, refs in related_projects.items():
-            p = models.projects.get_or_create(name=project_name)
-            projects.append(p)
-            repo_query = []
-            if refs == ['all']:
-                # we need all the repos available
-                repo_query = models.Repo.filter_by(project=p).all()
-            else:
-                for ref in refs:
-                    repo_query = models.Repo.filter_by(project=p, ref=ref).all()
-            if repo_query:
-                for r in repo_query:
-                    repos.append(r)
-
-        if not repos:
-            # there are no repositories associated with this project, so go ahead
-            # and create one so that it can be queried by the celery task later
-            for project in projects:
-                repo = models.Repo(
-                    project,
-                    self.ref,
-                    self.distro,
-                    self.distro_version,
-                    sha1=self.sha1,
-                )
-                repo.needs_update = repository_is_automatic(project.name)
-                repo.type = self.binary._get_repo_type()
-
-        else:
-            for repo in repos:
-                repo.needs_update = repository_is_automatic(repo.project.name)
-                if repo.type is None:
-                    repo.type = self.binary._get_repo_type()
+        util.mark_related_repos(self.binary)
 
     def create_directory(self):
         end_part = request.url.split('binaries/')[-1].rstrip('/')
@@ -163,50 +119,47 @@ class FlavorController(object):
 
     def save_file(self, file_obj):
         dir_path = self.create_directory()
-        if self.binary_name in os.listdir(dir_path):
+        destination = os.path.join(dir_path, self.binary_name)
+        if os.path.exists(destination):
             # resource exists so we will update it
             response.status = 200
         else:
             # we will create a resource
             response.status = 201
 
-        destination = os.path.join(dir_path, self.binary_name)
+        checksum, size = storage.save(file_obj, destination)
 
-        with open(destination, 'wb') as f:
-            file_iterable = FileIter(file_obj)
-            for chunk in file_iterable:
-                f.write(chunk)
-
-        # return the full path to the saved object:
-        return destination
+        # return the full path to the saved object, along with the checksum
+        # and size that were computed while writing it
+        return destination, checksum, size
 
     @expose()
     def _lookup(self, name, *remainder):
         return BinaryController(name), remainder
 
+    uploads = _uploads.UploadsController()
+    batch = _batch.BatchController()
+    register = _register.RegisterController()
+
 
 class FlavorsController(object):
 
     @expose('json', generic=True)
     def index(self):
-        project = models.Project.get(request.context['project_id'])
         resp = {}
-        binaries = models.Binary.filter_by(
-                    project=project,
-                    distro_version=request.context['distro_version'],
-                    distro=request.context['distro'],
-                    ref=request.context['ref'],
-                    sha1=request.context['sha1'],
-                    arch=request.context['arch']).all()
-
-        flavors = set([b.flavor for b in binaries])
-
-        for flavor in flavors:
-            resp[flavor] = list(
-                set(
-                    [b.name for b in binaries if b.flavor == flavor]
-                )
-            )
+        names = models.Binary.query.with_entities(
+            models.Binary.flavor, models.Binary.name
+        ).filter_by(
+            project_id=request.context['project_id'],
+            distro_version=request.context['distro_version'],
+            distro=request.context['distro'],
+            ref=request.context['ref'],
+            sha1=request.context['sha1'],
+            arch=request.context['arch']
+        ).distinct()
+
+        for flavor, name in names:
+            resp.setdefault(flavor, []).append(name)
 
         return resp
 
@@ -216,8 +169,8 @@ class FlavorsController(object):
 
     @expose()
     def _lookup(self, flavor, *remainder):
-        if request.method in ['HEAD', 'GET']:
-            project = models.Project.get(request.context['project_id'])
-            if flavor not in project.flavors:
+        if request.method in ['HEAD', 'GET'] and not _uploads.is_upload_path(remainder):
+            if not models.Binary.exists(
+                    project_id=request.context['project_id'], flavor=flavor):
                 abort(404)
         return FlavorController(flavor), remainder
@@ -13,21 +13,14 @@ class RefController(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.ref_name not in self.project.refs:
-            abort(404)
-        resp = {}
-        binaries = models.Binary.filter_by(
-            project=self.project,
-            ref=self.ref_name).all()
-
-        sha1s = set([b.sha1 for b in binaries])
-
-        for sha1 in sha1s:
-            resp[sha1] = list(
-                set(
-                    [b.distro for b in binaries if b.sha1 == sha1]
-                )
-            )
+        resp = models.projects.group_pairs(
+            models.Binary.query.with_entities(
+                models.Binary.sha1, models.Binary.distro
+            ).filter(
+                models.Binary.project_id == self.project.id,
+                models.Binary.ref == self.ref_name,
+            ).group_by(models.Binary.sha1, models.Binary.distro)
+        )
 
         if not resp:
             abort(404)
@@ -0,0 +1,186 @@
+"""
+Register binaries that are already on disk (e.g. when migrating from another
+server, or for builders writing to a shared filesystem) for an architecture
+(or flavor) in a single request::
+
+    POST /binaries/ceph/master/head/centos/7/x86_64/register/
+    {"binaries": [{"path": "/nfs/ceph/ceph-10.2.0-0.el7.x86_64.rpm"}, ...]}
+
+Each item requires a ``path``, and may include ``name`` (defaults to the file
+name in ``path``), ``built_by`` and ``checksum`` (which has to match the file,
+it is always computed by the server). Files are stat'ed and hashed
+in a bounded pool of threads (``register_workers`` in the configuration) and
+the rows are inserted in bulk in one transaction. The ``force`` flag is
+required to replace existing binaries.
+"""
+import datetime
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+from pecan import expose, abort, request, response, conf
+from pecan.secure import secure
+from chacra import models, util, storage
+from chacra.models.binaries import get_or_create_repo
+from chacra.controllers import error
+from chacra.controllers.binaries.uploads import context_binaries
+from chacra.auth import basic_auth
+
+logger = logging.getLogger(__name__)
+
+# how many files are stat'ed and hashed at the same time when
+# ``register_workers`` is not configured
+DEFAULT_WORKERS = 4
+
+
+def inspect_file(item):
+    """
+    Fill in the size and the checksum of the file at ``item['path']``. This
+    runs in a worker thread so it must not use the database session.
+
+    Returns the item, along with an error message if the file could not be
+    read or does not match the checksum that was sent.
+    """
+    path = item['path']
+    expected_checksum = item.get('checksum')
+    try:
+        item['size'] = os.path.getsize(path)
+        item['checksum'] = storage.checksum(path)
+    except (IOError, OSError) as err:
+        return item, 'could not read %s: %s' % (path, err.strerror)
+    if expected_checksum and expected_checksum != item['checksum']:
+        return item, 'checksum does not match the contents of %s' % path
+    return item, None
+
+
+def inspect_files(items, workers=None):
+    """
+    Run :func:`inspect_file` for every item using at most ``workers`` threads
+    """
+    workers = workers or getattr(conf, 'register_workers', DEFAULT_WORKERS)
+    pool = ThreadPool(processes=max(1, min(workers, len(items))))
+    try:
+        return pool.map(inspect_file, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def request_items():
+    """
+    The validated list of binaries to register from the JSON body, which can be
+    an object with a ``binaries`` key or just the list of binaries.
+    """
+    try:
+        data = request.json
+    except ValueError:
+        error('/errors/invalid/', 'could not decode JSON body')
+    if isinstance(data, dict):
+        data = data.get('binaries')
+    if not isinstance(data, list) or not data:
+        error('/errors/invalid/', 'no binaries found in request')
+
+    items = []
+    names = set()
+    for item in data:
+        if not isinstance(item, dict) or not item.get('path'):
+            error('/errors/invalid/', "could not find required key: 'path'")
+        name = item.get('name') or os.path.basename(item['path'])
+        if not name or name.startswith('.'):
+            error('/errors/invalid/', 'invalid binary name: %s' % name)
+        if name in names:
+            error('/errors/invalid/', 'binary was sent more than once: %s' % name)
+        checksum = item.get('checksum')
+        if checksum and not storage.valid_checksum(checksum):
+            error('/errors/invalid/', 'invalid checksum: %s' % checksum)
+        names.add(name)
+        items.append(dict(
+            name=name,
+            path=item['path'],
+            built_by=item.get('built_by'),
+            checksum=checksum,
+        ))
+    return items
+
+
+class RegisterController(object):
+
+    @expose(generic=True, template='json')
+    def index(self):
+        abort(405)
+
+    @secure(basic_auth)
+    @index.when(method='POST', template='json')
+    def index_post(self):
+        items = request_items()
+        force = request.params.get('force', False) is not False
+        if isinstance(request.json, dict):
+            force = force or bool(request.json.get('force'))
+
+        # a single query for all the binaries that might get replaced, only
+        # for their ids since the rows are updated in bulk
+        existing = dict(context_binaries().with_entities(
+            models.Binary.name, models.Binary.id))
+        names = set(i['name'] for i in items)
+        existing = dict((k, v) for k, v in existing.items() if k in names)
+        if existing and not force:
+            error(
+                '/errors/invalid/',
+                '%s already exists and "force" key was not used' % sorted(existing)[0]
+            )
+
+        for item, message in inspect_files(items):
+            if message:
+                error('/errors/invalid/', message)
+
+        project = models.Project.get(request.context['project_id'])
+        repo = get_or_create_repo(
+            project,
+            request.context['ref'],
+            request.context['distro'],
+            request.context['distro_version'],
+            sha1=request.context['sha1'],
+            flavor=request.context.get('flavor', 'default'),
+            name=items[0]['name'],
+        )
+        # the repo (if new) needs an id before the rows can point to it
+        models.flush()
+
+        now = datetime.datetime.utcnow()
+        new, updated = [], []
+        for item in items:
+            item['modified'] = now
+            if item['name'] in existing:
+                item['id'] = existing[item['name']]
+                # do not clear metadata that was not sent
+                updated.append(dict(
+                    (k, v) for k, v in item.items() if v is not None))
+            else:
+                item.update(
+                    created=now,
+                    project_id=project.id,
+                    repo_id=repo.id,
+                    arch=request.context['arch'],
+                    distro=request.context['distro'],
+                    distro_version=request.context['distro_version'],
+                    ref=request.context['ref'],
+                    sha1=request.context['sha1'],
+                    flavor=request.context.get('flavor', 'default'),
+                )
+                new.append(item)
+        if new:
+            models.Session.bulk_insert_mappings(models.Binary, new)
+        if updated:
+            models.Session.bulk_update_mappings(models.Binary, updated)
+
+        binaries = dict(
+            (b.name, b) for b in context_binaries() if b.name in names)
+        # every binary shares the same project, ref and distro so related
+        # repos only need to be marked once
+        util.mark_related_repos(binaries[items[0]['name']])
+        logger.info('registered %s binaries for %s', len(items), repo)
+
+        if new:
+            response.status = 201
+        else:
+            response.status = 200
+        return binaries
@@ -14,22 +14,19 @@ class SHA1Controller(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.sha1 not in self.project.sha1s:
+        if not models.Binary.exists(project=self.project, sha1=self.sha1):
             abort(404)
         resp = {}
-        binaries = models.Binary.filter_by(
+        distro_versions = models.Binary.query.with_entities(
+            models.Binary.distro, models.Binary.distro_version
+        ).filter_by(
             project=self.project,
             sha1=self.sha1,
-            ref=self.ref).all()
+            ref=self.ref
+        ).distinct()
 
-        distros = set([b.distro for b in binaries])
-
-        for distro in distros:
-            resp[distro] = list(
-                set(
-                    [b.distro_version for b in binaries if b.distro == distro ]
-                )
-            )
+        for distro, distro_version in distro_versions:
+            resp.setdefault(distro, []).append(distro_version)
 
         if not resp:
             abort(404)
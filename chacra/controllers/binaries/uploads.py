@@ -0,0 +1,255 @@
+"""
+Resumable uploads for binaries that are too large to be reliably sent in
+a single request. A client opens an upload, sends the bytes in as many ``PUT``
+requests as needed (resuming from the last offset the server has if
+a connection drops), and then finalizes it into a binary::
+
+    POST /binaries/ceph/master/head/ubuntu/xenial/x86_64/uploads/
+    {"name": "ceph-dbg_10.2.0_amd64.deb", "size": 2147483648}
+
+    PUT /binaries/ceph/master/head/ubuntu/xenial/x86_64/uploads/{id}/
+    Content-Range: bytes 0-1048575/2147483648
+
+    POST /binaries/ceph/master/head/ubuntu/xenial/x86_64/uploads/{id}/
+    {"checksum": "..."}
+
+A ``PUT`` with an empty body (or ``Content-Range: bytes */{size}``) reports the
+current offset without writing anything.
+"""
+import logging
+import numbers
+import os
+import re
+import pecan
+from pecan import expose, abort, request, response
+from pecan.secure import secure
+from webob.byterange import ContentRange
+from chacra import models, util, storage
+from chacra.controllers import error
+from chacra.auth import basic_auth
+
+logger = logging.getLogger(__name__)
+
+upload_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+def binary_directory(endpoint='uploads'):
+    """
+    The directory where the binary will be stored, following the URL layout
+    in the same way as binaries POSTed to the arch (or flavor) URL
+    """
+    end_part = request.url.split('binaries/')[-1].split('/%s/' % endpoint)[0]
+    return os.path.join(pecan.conf.binary_root, end_part.strip('/'))
+
+
+def context_binaries():
+    """
+    A query for the binaries of the arch (or flavor) in the current URL
+    """
+    return models.Binary.filter_by(
+        project_id=request.context['project_id'],
+        arch=request.context['arch'],
+        distro=request.context['distro'],
+        distro_version=request.context['distro_version'],
+        ref=request.context['ref'],
+        sha1=request.context['sha1'],
+        flavor=request.context.get('flavor', 'default'),
+    )
+
+
+def get_binary(name):
+    return context_binaries().filter_by(name=name).first()
+
+
+def binary_exists(binary):
+    return binary is not None and binary.path and os.path.exists(binary.path)
+
+
+def valid_name(name):
+    """
+    Binary names sent by clients become file names, so they cannot point
+    somewhere else or collide with the hidden files used while uploading
+    """
+    return bool(name) and '/' not in name and not name.startswith('.')
+
+
+def valid_size(size):
+    """
+    The size of an upload is optional, but when sent it has to be a number of
+    bytes
+    """
+    if size is None:
+        return True
+    if isinstance(size, bool) or not isinstance(size, numbers.Integral):
+        return False
+    return size >= 0
+
+
+def is_upload_path(remainder):
+    """
+    Uploads can be opened for a distro version (or flavor) that has no
+    binaries yet, so the checks for existing binaries done while routing
+    ``GET`` and ``HEAD`` requests do not apply to them
+    """
+    return 'uploads' in remainder
+
+
+def upload_json(upload):
+    return dict(
+        id=upload.id,
+        name=upload.name,
+        offset=upload.offset,
+        size=upload.size,
+    )
+
+
+class UploadsController(object):
+
+    @expose(generic=True, template='json')
+    def index(self):
+        abort(405)
+
+    @secure(basic_auth)
+    @index.when(method='POST', template='json')
+    def index_post(self):
+        try:
+            data = request.json
+        except ValueError:
+            error('/errors/invalid/', 'could not decode JSON body')
+        name = data.get('name')
+        if not name:
+            error('/errors/invalid/', "could not find required key: 'name'")
+        if not valid_name(name):
+            error('/errors/invalid/', 'invalid binary name: %s' % name)
+        size = data.get('size')
+        if not valid_size(size):
+            error('/errors/invalid/', 'invalid size: %s' % size)
+
+        # fail early, before any bytes are sent
+        if binary_exists(get_binary(name)) and not data.get('force'):
+            error('/errors/invalid/', 'resource already exists and "force" key was not used')
+
+        directory = binary_directory()
+        util.makedirs(directory)
+        upload = storage.PartialUpload.create(
+            directory,
+            name,
+            size=size,
+            force=bool(data.get('force')),
+        )
+        logger.info('started upload %s for %s', upload.id, name)
+        response.status = 201
+        return upload_json(upload)
+
+    @expose()
+    def _lookup(self, upload_id, *remainder):
+        return UploadController(upload_id), remainder
+
+
+class UploadController(object):
+
+    def __init__(self, upload_id):
+        self.upload = None
+        if upload_id_re.match(upload_id):
+            upload = storage.PartialUpload(binary_directory(), upload_id)
+            if upload.exists():
+                self.upload = upload
+
+    @expose(generic=True, template='json')
+    def index(self):
+        if self.upload is None:
+            abort(404)
+        return upload_json(self.upload)
+
+    @secure(basic_auth)
+    @index.when(method='PUT', template='json')
+    def index_put(self):
+        if self.upload is None:
+            abort(404)
+        content_range = ContentRange.parse(request.headers.get('Content-Range'))
+        size = self.upload.size
+        length = request.content_length
+        if content_range is None or content_range.start is None:
+            offset = self.upload.offset
+            limit = None if size is None else size - offset
+        else:
+            offset = content_range.start
+            limit = content_range.stop - content_range.start
+            if length is not None and length != limit:
+                error(
+                    '/errors/invalid/',
+                    'body has %s bytes but the range has %s' % (length, limit)
+                )
+        # a chunk that goes past the size could never be finalized
+        end = offset + (length if length is not None else limit or 0)
+        if size is not None and end > size:
+            error('/errors/invalid/', 'chunk goes past the size of the upload: %s' % size)
+
+        if self.upload.append(request.body_file, offset, limit=limit) is None:
+            # the client is out of sync, reply with the current state so that
+            # it knows where to resume from
+            response.status = 409
+        return upload_json(self.upload)
+
+    @secure(basic_auth)
+    @index.when(method='POST', template='json')
+    def index_post(self):
+        if self.upload is None:
+            abort(404)
+        data = {}
+        if request.body:
+            try:
+                data = request.json
+            except ValueError:
+                error('/errors/invalid/', 'could not decode JSON body')
+
+        if not self.upload.is_complete:
+            error(
+                '/errors/invalid/',
+                'upload is incomplete, got %s of %s bytes' % (self.upload.offset, self.upload.size)
+            )
+        name = self.upload.name
+        binary = get_binary(name)
+        if binary_exists(binary) and not (self.upload.force or data.get('force')):
+            error('/errors/invalid/', 'resource already exists and "force" key was not used')
+
+        expected_checksum = data.get('checksum')
+        if expected_checksum and expected_checksum != self.upload.checksum():
+            error('/errors/invalid/', 'checksum does not match the uploaded bytes')
+
+        destination = os.path.join(self.upload.directory, name)
+        if os.path.exists(destination):
+            response.status = 200
+        else:
+            response.status = 201
+        checksum, size = self.upload.publish(destination)
+        logger.info('finished upload %s for %s', self.upload.id, destination)
+
+        if binary is None:
+            binary = models.Binary(
+                name,
+                models.Project.get(request.context['project_id']),
+                arch=request.context['arch'],
+                distro=request.context['distro'],
+                distro_version=request.context['distro_version'],
+                ref=request.context['ref'],
+                sha1=request.context['sha1'],
+                flavor=request.context.get('flavor', 'default'),
+                path=destination,
+                size=size,
+                checksum=checksum,
+            )
+        else:
+            binary.set_content(destination, checksum, size)
+
+        util.mark_related_repos(binary)
+        return binary
+
+    @secure(basic_auth)
+    @index.when(method='DELETE', template='json')
+    def index_delete(self):
+        if self.upload is None:
+            abort(404)
+        self.upload.remove()
+        response.status = 204
+        return dict()
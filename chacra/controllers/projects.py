@@ -1,6 +1,7 @@
 from pecan import expose, abort, request
 from chacra.models import Project
 from chacra import models
+from chacra.controllers import resolve
 from chacra.controllers.binaries.refs import RefController
 
 
@@ -29,11 +30,12 @@ class ProjectsController(object):
 
     @expose('json')
     def index(self):
-        resp = {}
-        for project in Project.query.all():
-            resp[project.name] = project.refs
-        return resp
+        return models.projects.refs_by_project()
 
     @expose()
     def _lookup(self, project_name, *remainder):
+        if resolve.is_read():
+            resolved = resolve.binary_controller(project_name, remainder)
+            if resolved is not None:
+                return resolved
         return ProjectController(project_name), remainder
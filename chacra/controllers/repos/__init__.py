@@ -5,7 +5,7 @@ from pecan import expose, abort, request
 from pecan.secure import secure
 from pecan.ext.notario import validate
 
-from chacra.models import Project
+from chacra.models import Project, Repo
 from chacra.controllers import error
 from chacra.auth import basic_auth
 from chacra import schemas, async
@@ -22,13 +22,13 @@ class FlavorsController(object):
         self.distro_name = request.context['distro']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
-        self.repos = self.project.repos.filter_by(
+        flavors = self.project.repos.with_entities(Repo.flavor).filter_by(
             distro=self.distro_name,
             distro_version=self.distro_version,
             ref=self.ref,
             sha1=self.sha1,
-        ).all()
-        self.flavors = list(set([r.flavor for r in self.repos]))
+        ).distinct()
+        self.flavors = [flavor for flavor, in flavors]
 
     @expose('json', generic=True)
     def index(self):
@@ -47,7 +47,7 @@ class FlavorsController(object):
 
 class RepoController(object):
 
-    def __init__(self, distro_version, flavor=None):
+    def __init__(self, distro_version, flavor=None, repo=None):
         self.distro_version = distro_version
         self.project = Project.get(request.context['project_id'])
         self.distro_name = request.context['distro']
@@ -56,6 +56,10 @@ class RepoController(object):
         if not request.context.get('distro_version'):
             request.context['distro_version'] = self.distro_version
         self.flavor = flavor
+        # already resolved along with the whole URL (see controllers.resolve)
+        if repo is not None:
+            self.repo_obj = repo
+            return
         self.repo_obj = self.project.repos.filter_by(
             distro=self.distro_name,
             distro_version=self.distro_version,
@@ -1,5 +1,5 @@
 from pecan import expose, abort, request
-from chacra.models import Project
+from chacra.models import Project, Repo
 from chacra.controllers import error
 from chacra.controllers.repos import RepoController
 
@@ -15,15 +15,17 @@ class DistroController(object):
     @expose('json', generic=True)
     def index(self):
         # TODO: Improve this duplication here (and spread to other controllers)
-        if self.distro_name not in self.project.repo_distros:
+        if not Repo.exists(project=self.project, distro=self.distro_name):
             abort(404)
-        if self.ref not in self.project.repo_refs:
+        if not Repo.exists(project=self.project, ref=self.ref):
             abort(404)
-        resp = []
 
-        for repo in self.project.repos.filter_by(distro=self.distro_name, ref=self.ref, sha1=self.sha1).all():
-            resp.append(repo.distro_version)
-        return list(set(resp))
+        distro_versions = self.project.repos.with_entities(
+            Repo.distro_version
+        ).filter_by(
+            distro=self.distro_name, ref=self.ref, sha1=self.sha1
+        ).distinct()
+        return [distro_version for distro_version, in distro_versions]
 
     @index.when(method='POST', template='json')
     def index_post(self):
@@ -1,6 +1,7 @@
 from pecan import expose, abort, request
+from chacra import models
 from chacra.models import Project
-from chacra.controllers import error
+from chacra.controllers import error, resolve
 from chacra.controllers.repos.refs import RefController
 
 
@@ -20,13 +21,11 @@ class ProjectController(object):
         if request.method == 'POST':
             error('/errors/not_allowed',
                   'POST requests to this url are not allowed')
-        resp = {}
-        for ref in self.project.repo_refs:
-            resp[ref] = list(set(
-                [r.sha1 for r in
-                    self.project.repos.filter_by(ref=ref).all()]
-            ))
-        return resp
+        return models.projects.group_pairs(
+            models.Repo.query.with_entities(models.Repo.ref, models.Repo.sha1).filter(
+                models.Repo.project_id == self.project.id
+            ).group_by(models.Repo.ref, models.Repo.sha1)
+        )
 
     @expose()
     def _lookup(self, name, *remainder):
@@ -37,11 +36,12 @@ class ProjectsController(object):
 
     @expose('json')
     def index(self):
-        resp = {}
-        for project in Project.query.all():
-            resp[project.name] = project.repo_refs
-        return resp
+        return models.projects.repo_refs_by_project()
 
     @expose()
     def _lookup(self, project_name, *remainder):
+        if resolve.is_read():
+            resolved = resolve.repo_controller(project_name, remainder)
+            if resolved is not None:
+                return resolved
         return ProjectController(project_name), remainder
@@ -1,4 +1,5 @@
 from pecan import expose, abort, request
+from chacra import models
 from chacra.models import Project
 from chacra.controllers import error
 from chacra.controllers.repos.sha1s import SHA1Controller
@@ -13,18 +14,16 @@ class RefController(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.ref_name not in self.project.repo_refs:
+        resp = models.projects.group_pairs(
+            models.Repo.query.with_entities(
+                models.Repo.sha1, models.Repo.distro
+            ).filter(
+                models.Repo.project_id == self.project.id,
+                models.Repo.ref == self.ref_name,
+            ).group_by(models.Repo.sha1, models.Repo.distro)
+        )
+        if not resp:
             abort(404)
-        resp = {}
-        sha1s = list(set(
-            [r.sha1 for r in
-                self.project.repos.filter_by(ref=self.ref_name).all()]
-        ))
-        for sha1 in sha1s:
-            resp[sha1] = list(set(
-                [b.distro for b in
-                    self.project.repos.filter_by(ref=self.ref_name, sha1=sha1).all()]
-            ))
         return resp
 
     @index.when(method='POST', template='json')
@@ -1,5 +1,5 @@
 from pecan import expose, abort, request
-from chacra.models import Project
+from chacra.models import Project, Repo
 from chacra.controllers import error
 from chacra.controllers.repos.distros import DistroController
 
@@ -14,14 +14,15 @@ class SHA1Controller(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.sha1 not in self.project.repo_sha1s:
+        if not Repo.exists(project=self.project, sha1=self.sha1):
             abort(404)
-        resp = {}
-        for distro in self.project.repo_distros:
-            resp[distro] = list(set(
-                [b.distro_version for b in
-                    self.project.repos.filter_by(distro=distro, ref=self.ref, sha1=self.sha1).all()]
-            ))
+        # every distro of the project is listed, even without repos here
+        resp = dict((distro, []) for distro in self.project.repo_distros)
+        distro_versions = self.project.repos.with_entities(
+            Repo.distro, Repo.distro_version
+        ).filter_by(ref=self.ref, sha1=self.sha1).distinct()
+        for distro, distro_version in distro_versions:
+            resp[distro].append(distro_version)
         return resp
 
     @index.when(method='POST', template='json')
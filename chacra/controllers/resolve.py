@@ -0,0 +1,124 @@
+"""
+Resolve the deepest URLs, a binary or a repo, with a single query instead of
+going through every controller in the path, each one loading (and
+validating) its own part of the URL. Only ``GET`` and ``HEAD`` requests for
+objects that exist take this path, anything else (including a 404) falls back
+to the regular controllers so that behavior and error messages stay the same.
+"""
+from pecan import request
+from sqlalchemy.orm import contains_eager
+
+from chacra import models
+from chacra.controllers.binaries import BinaryController
+from chacra.controllers.repos import RepoController
+
+
+# names that are endpoints of the arch (or flavor) controllers, not binaries
+arch_endpoints = ['flavors', 'uploads', 'batch', 'register']
+
+
+def is_read():
+    return request.method in ('GET', 'HEAD')
+
+
+def path_parts(remainder):
+    """
+    The components of the path with the trailing slash removed, or ``None`` if
+    the path has empty components
+    """
+    parts = list(remainder)
+    if parts and parts[-1] == '':
+        parts.pop()
+    if '' in parts:
+        return None
+    return parts
+
+
+def binary_controller(project_name, remainder):
+    """
+    Return a ``(controller, remainder)`` tuple for the binary in the URL, or
+    ``None`` if the path is not one for an existing binary.
+    """
+    parts = path_parts(remainder)
+    if parts is None:
+        return None
+    if len(parts) == 6:
+        ref, sha1, distro, distro_version, arch, name = parts
+        flavor = 'default'
+    elif len(parts) == 8 and parts[5] == 'flavors':
+        ref, sha1, distro, distro_version, arch, _, flavor, name = parts
+    else:
+        return None
+    if name in arch_endpoints:
+        return None
+
+    binary = models.Binary.query.join(
+        models.Project, models.Binary.project_id == models.Project.id
+    ).options(
+        contains_eager(models.Binary.project)
+    ).filter(
+        models.Project.name == project_name,
+        models.Binary.name == name,
+        models.Binary.ref == ref,
+        models.Binary.sha1 == sha1,
+        models.Binary.distro == distro,
+        models.Binary.distro_version == distro_version,
+        models.Binary.arch == arch,
+        models.Binary.flavor == flavor,
+    ).first()
+    if binary is None:
+        return None
+
+    request.context.update(
+        project_id=binary.project_id,
+        ref=ref,
+        sha1=sha1,
+        distro=distro,
+        distro_version=distro_version,
+        arch=arch,
+        flavor=flavor,
+    )
+    return BinaryController(name, binary=binary), remainder[len(parts):]
+
+
+def repo_controller(project_name, remainder):
+    """
+    Return a ``(controller, remainder)`` tuple for the repo in the URL, or
+    ``None`` if the path is not one for an existing repo.
+    """
+    parts = path_parts(remainder)
+    if parts is None or len(parts) < 4:
+        return None
+    ref, sha1, distro, distro_version = parts[:4]
+    consumed = 4
+    flavor = None
+    if len(parts) > 4 and parts[4] == 'flavors':
+        # the list of flavors is left to the regular controllers
+        if len(parts) == 5:
+            return None
+        flavor = parts[5]
+        consumed = 6
+
+    repo = models.Repo.query.join(
+        models.Project, models.Repo.project_id == models.Project.id
+    ).options(
+        contains_eager(models.Repo.project)
+    ).filter(
+        models.Project.name == project_name,
+        models.Repo.ref == ref,
+        models.Repo.sha1 == sha1,
+        models.Repo.distro == distro,
+        models.Repo.distro_version == distro_version,
+        models.Repo.flavor == (flavor or 'default'),
+    ).first()
+    if repo is None:
+        return None
+
+    request.context.update(
+        project_id=repo.project_id,
+        ref=ref,
+        sha1=sha1,
+        distro=distro,
+        distro_version=distro_version,
+    )
+    return RepoController(distro_version, flavor, repo=repo), remainder[consumed:]
@@ -0,0 +1,116 @@
+"""
+Offload binary downloads to the web server in front of the application, so
+that it can send the file with ``sendfile`` while the application only sets
+a header. The backend is configured with ``download_offload``:
+
+* ``x-accel-redirect``: Nginx. Binaries are mapped to ``internal`` locations
+  with ``download_locations``, a mapping of directories (for example, each
+  ``binary_root`` mount) to the location that serves them. Pecan only accepts
+  paths as keys with ``__force_dict__``::
+
+      download_locations = {
+          '/opt/binaries': '/b/',
+          '/mnt/disk2/binaries': '/b2/',
+          '__force_dict__': True,
+      }
+
+  It defaults to ``binary_root`` served at ``/b/``.
+
+* ``x-sendfile``: Apache (mod_xsendfile) or lighttpd, which get the absolute
+  path of the binary.
+
+* ``internal``: the application serves the file itself.
+
+When ``download_offload`` is not set, ``delegate_downloads`` selects between
+``x-accel-redirect`` and ``internal``. Binaries that cannot be offloaded (like
+a path that is not in any of the locations) are served by the application.
+"""
+import logging
+import os
+
+from pecan import conf
+
+
+logger = logging.getLogger(__name__)
+
+
+def backend_name():
+    backend = getattr(conf, 'download_offload', None)
+    if backend:
+        return backend
+    if getattr(conf, 'delegate_downloads', False):
+        return 'x-accel-redirect'
+    return 'internal'
+
+
+def locations():
+    """
+    The configured ``(directory, location)`` pairs, longest directories first
+    so that nested mounts are matched before their parents.
+    """
+    configured = getattr(conf, 'download_locations', None)
+    if configured:
+        if hasattr(configured, 'to_dict'):
+            configured = configured.to_dict()
+        pairs = [
+            (directory, location) for directory, location in dict(configured).items()
+            if not directory.startswith('__')
+        ]
+    else:
+        pairs = [(conf.binary_root, '/b/')]
+    pairs = [(os.path.join(os.path.abspath(d), ''), l) for d, l in pairs]
+    return sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+
+
+def internal_location(path):
+    """
+    Map the absolute ``path`` of a binary to the internal location that serves
+    it, or ``None`` if it is not in any of the configured directories.
+    """
+    path = os.path.abspath(path)
+    for directory, location in locations():
+        if path.startswith(directory):
+            return os.path.join(location, path[len(directory):])
+
+
+def x_accel_redirect(path, response):
+    location = internal_location(path)
+    if location is None:
+        logger.warning('%s is not in any download location, will not offload', path)
+        return False
+    logger.info('setting X-Accel-Redirect header: %s', location)
+    # header values have to be native strings, paths from the database are
+    # unicode
+    response.headers['X-Accel-Redirect'] = str(location)
+    return True
+
+
+def x_sendfile(path, response):
+    response.headers['X-Sendfile'] = str(os.path.abspath(path))
+    return True
+
+
+def internal(path, response):
+    return False
+
+
+backends = {
+    'x-accel-redirect': x_accel_redirect,
+    'x-sendfile': x_sendfile,
+    'internal': internal,
+}
+
+
+def offload(path, response):
+    """
+    Set the headers so that the web server sends the file at ``path``.
+
+    Returns ``False`` when the application needs to serve it instead.
+    """
+    name = backend_name()
+    try:
+        backend = backends[name]
+    except KeyError:
+        logger.error('unknown download_offload backend: %s', name)
+        return False
+    return backend(path, response)
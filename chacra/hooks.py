@@ -1,6 +1,7 @@
 import logging
 from webob.exc import WSGIHTTPException
 from pecan.hooks import PecanHook
+from chacra import caching
 
 
 log = logging.getLogger(__name__)
@@ -24,3 +25,24 @@ class CustomErrorHook(PecanHook):
 
         log.exception('unhandled error by Chacra')
 
+
+
+class CacheHook(PecanHook):
+    """
+    Allow clients and caching proxies to keep JSON responses for a short
+    time, and revalidate them cheaply afterwards: the ETag is computed from
+    the body so that an unchanged response is answered with a 304.
+    """
+
+    def after(self, state):
+        request, response = state.request, state.response
+        if request.method not in ('GET', 'HEAD') or response.status_int != 200:
+            return
+        # controllers may set their own policy, like binary downloads
+        if 'Cache-Control' in response.headers:
+            return
+        if response.content_type != 'application/json':
+            return
+        response.cache_control = caching.revalidate()
+        response.md5_etag()
+        response.conditional_response = True
@@ -18,6 +18,15 @@ class _EntityBase(object):
     def get(cls, *args, **kwargs):
         return cls.query.get(*args, **kwargs)
 
+    @classmethod
+    def exists(cls, *args, **kwargs):
+        """
+        Like ``filter_by`` but only tells if there is a matching row, with an
+        ``EXISTS`` query that does not load any of them.
+        """
+        query = cls.query.filter_by(*args, **kwargs)
+        return query.session.query(query.exists()).scalar()
+
     def flush(self, *args, **kwargs):
         object_session(self).flush([self], *args, **kwargs)
 
@@ -34,6 +43,9 @@ class _EntityBase(object):
         that needs to update some fields
         """
         for key in data.keys():
+            # private attributes are never part of the metadata
+            if key.startswith('_'):
+                continue
             setattr(self, key, data[key])
 
 
@@ -1,13 +1,75 @@
-import hashlib
 import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
+import os
+from sqlalchemy import (
+    Column, Integer, String, ForeignKey, Boolean, DateTime, UniqueConstraint
+)
 from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.event import listen
 from sqlalchemy.orm.exc import DetachedInstanceError
 from sqlalchemy.exc import InvalidRequestError
 from chacra.models import Base, update_timestamp
 from chacra.models.repos import Repo
 from chacra.controllers import util
+from chacra import storage
+
+
+# distro versions for binaries that are not built for a specific release
+generic_distro_versions = ['generic', 'universal', 'any']
+
+
+def get_repo_type(name):
+    """
+    Infer the type of repository ('rpm' or 'deb') a binary named ``name``
+    belongs to, from its extension.
+    """
+    extension_map = {
+        'rpm': 'rpm',
+        'deb': 'deb',
+        'dsc': 'deb',
+        'changes': 'deb'
+    }
+
+    # XXX This is very naive, but 'deb' repos are the only ones that
+    # will have .tar or .tar.gz or just .gz extensions for source
+    # files, so fallback to that
+    return extension_map.get(name.split('.')[-1], 'deb')
+
+
+def get_or_create_repo(project, ref, distro, distro_version, sha1='head',
+                       flavor='default', name=None):
+    """
+    Find (or create) the repo for a binary named ``name``, which can be any of
+    them for binaries that are inserted in bulk. Bulk inserts do not go
+    through the model listeners, so the repo is marked to be rebuilt here as
+    well.
+    """
+    # try to find one that matches our needs first
+    repo = Repo.query.filter_by(
+        ref=ref,
+        sha1=sha1,
+        flavor=flavor,
+        distro=distro,
+        distro_version=distro_version,
+        project=project).first()
+
+    # create one otherwise
+    if repo is None:
+        repo = Repo(
+            project,
+            ref,
+            distro,
+            distro_version,
+            sha1=sha1,
+            flavor=flavor,
+        )
+    if repo.type is None and name:
+        repo.type = get_repo_type(name)
+    # only needs_update when binary is not generic and automatic repos
+    # are configured for this project
+    is_generic = distro_version in generic_distro_versions
+    repo.needs_update = not is_generic and util.repository_is_automatic(project.name)
+    return repo
 
 
 class Binary(Base):
@@ -27,7 +89,7 @@ class Binary(Base):
     modified = Column(DateTime, index=True)
     signed = Column(Boolean(), default=False)
     size = Column(Integer, default=0)
-    checksum = Column(String(256))
+    checksum = Column(String(256), index=True)
 
     project_id = Column(Integer, ForeignKey('projects.id'))
     project = relationship('Project', backref=backref('binaries', lazy='dynamic'))
@@ -35,6 +97,15 @@ class Binary(Base):
     repo_id = Column(Integer, ForeignKey('repos.id'))
     repo = relationship('Repo', backref=backref('binaries', lazy='dynamic'))
 
+    # a binary is identified by all of its URL parts, in the same order, so
+    # that lookups for a binary (and listings for any of its parent URLs) are
+    # a single index scan and concurrent uploads cannot create duplicates
+    __table_args__ = (
+        UniqueConstraint(
+            'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch',
+            'flavor', 'name', name='uq_binaries_identity'),
+    )
+
     allowed_keys = [
         'path',
         'distro',
@@ -47,7 +118,7 @@ class Binary(Base):
         'flavor',
     ]
 
-    def __init__(self, name, project, repo=None, **kw):
+    def __init__(self, name, project, repo=None, checksum=None, **kw):
         self.name = name
         self.project = project
         now = datetime.datetime.utcnow()
@@ -58,60 +129,45 @@ class Binary(Base):
         for key in self.allowed_keys:
             if key in kw.keys():
                 setattr(self, key, kw[key])
+        if checksum is not None:
+            self.set_content(self.path, checksum, self.size)
         self.repo = repo or self._get_or_create_repo()
         # ensure that the repo.type is set
         self._set_repo_type()
 
+    def set_content(self, path, checksum, size):
+        """
+        Point the binary to ``path`` along with the ``checksum`` and ``size``
+        that ``chacra.storage`` computed while writing it, so that the
+        listener does not need to read the whole file again. A checksum set
+        any other way (like a JSON update) is always derived from the content.
+        """
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+        self._content_checksum = checksum
+
     @property
     def extension(self):
         return self.name.split('.')[-1]
 
     def _get_repo_type(self):
-        extension_map = {
-            'rpm': 'rpm',
-            'deb': 'deb',
-            'dsc': 'deb',
-            'changes': 'deb'
-        }
-
-        # XXX This is very naive, but 'deb' repos are the only ones that
-        # will have .tar or .tar.gz or just .gz extensions for source
-        # files, so fallback to that
-        return extension_map.get(self.extension, 'deb')
+        return get_repo_type(self.name)
 
     def _set_repo_type(self):
         if self.repo.type is None:
             self.repo.type = self._get_repo_type()
 
     def _get_or_create_repo(self):
-        """
-        A repo model object may exist for this binary, if it exists, then
-        return it otherwise create it and then return it.
-        """
-        # try to find one that matches our needs first
-        repo = Repo.query.filter_by(
-            ref=self.ref,
+        return get_or_create_repo(
+            self.project,
+            self.ref,
+            self.distro,
+            self.distro_version,
             sha1=self.sha1,
             flavor=self.flavor,
-            distro=self.distro,
-            distro_version=self.distro_version,
-            project=self.project).first()
-
-        # create one otherwise
-        if not repo:
-            repo = Repo(
-                self.project,
-                self.ref,
-                self.distro,
-                self.distro_version,
-                sha1=self.sha1,
-                flavor=self.flavor,
-                type=self._get_repo_type(),
-            )
-        # only needs_update when binary is not generic and automatic repos
-        # are configured for this project
-        repo.needs_update = not self.is_generic and util.repository_is_automatic(self.project.name)
-        return repo
+            name=self.name,
+        )
 
     def __repr__(self):
         try:
@@ -119,6 +175,15 @@ class Binary(Base):
         except DetachedInstanceError:
             return '<Binary detached>'
 
+    @property
+    def generation(self):
+        """
+        Changes every time the content of the binary is replaced, so that
+        download URLs can pin it and be cached forever.
+        """
+        if self.checksum:
+            return self.checksum[:16]
+
     @property
     def last_changed(self):
         if self.modified > self.created:
@@ -139,8 +204,7 @@ class Binary(Base):
         * universal
         * any
         """
-        target_versions = ['generic', 'universal', 'any']
-        if self.distro_version in target_versions:
+        if self.distro_version in generic_distro_versions:
             return True
         return False
 
@@ -158,6 +222,7 @@ class Binary(Base):
             distro=self.distro,
             distro_version=self.distro_version,
             checksum=self.checksum,
+            generation=self.generation,
             arch=self.arch,
             ref=self.ref,
             sha1=self.sha1,
@@ -181,11 +246,52 @@ def generate_checksum(mapper, connection, target):
     # paths and files, this should be required.
     if not target.path:
         return
-    chsum = hashlib.sha512()
-    with open(target.path) as f:
-        for chunk in iter(lambda: f.read(4096), ""):
-            chsum.update(chunk)
-        target.checksum = chsum.hexdigest()
+    added = get_history(target, 'checksum').added
+    if added:
+        # uploads compute the checksum while the file is being written, when
+        # it is handed over with ``set_content`` there is no need to read the
+        # whole file again
+        trusted = getattr(target, '_content_checksum', None)
+        target._content_checksum = None
+        if added[0] == trusted:
+            return
+    elif target.checksum and not content_changed(target):
+        # metadata-only changes (like ``built_by`` or ``signed``) and repeated
+        # flushes of the same object should not read the whole file again
+        return
+    target.checksum = storage.checksum(target.path)
+    # keep the size in sync with the bytes that were just read, otherwise the
+    # next save would think the content changed again
+    size = os.path.getsize(target.path)
+    if target.size != size:
+        target.size = size
+
+
+def content_changed(target):
+    """
+    Tell if the bytes behind ``target.path`` might be different from the ones
+    that produced ``target.checksum``. The identity of the content is tracked
+    with the path and size of the file, and its modification time compared
+    to the last time the binary was saved.
+    """
+    if get_history(target, 'path').has_changes():
+        return True
+    if get_history(target, 'size').has_changes():
+        return True
+    try:
+        stat = os.stat(target.path)
+    except OSError:
+        # nothing to read, keep whatever checksum was there
+        return False
+    if stat.st_size != target.size:
+        return True
+    # ``modified`` is updated by a listener that runs after this one, so it
+    # still holds the last time this binary was saved
+    added, unchanged, deleted = get_history(target, 'modified')
+    last_saved = (deleted or unchanged or [None])[0]
+    if last_saved is None:
+        return True
+    return datetime.datetime.utcfromtimestamp(stat.st_mtime) > last_saved
 
 
 def update_repo(mapper, connection, target):
@@ -14,47 +14,46 @@ class Project(Base):
     def __init__(self, name):
         self.name = name
 
+    def _binary_values(self, column):
+        """
+        The distinct values of a single ``binaries`` column for this project,
+        without loading any rows.
+
+        The project is compared as a relationship instead of by its id, which
+        is not known yet for a project that was not flushed.
+        """
+        query = Binary.query.filter_by(project=self).with_entities(
+            column).group_by(column)
+        return [value for value, in query]
+
+    def _repo_values(self, column):
+        query = Repo.query.filter_by(project=self).with_entities(
+            column).group_by(column)
+        return [value for value, in query]
+
     @property
     def archs(self):
-        return list(set(
-            [b.arch for b in
-             Binary.query.distinct(Binary.arch).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.arch)
 
     @property
     def distro_versions(self):
-        return list(set(
-            [b.distro_version for b in
-             Binary.query.distinct(Binary.distro_version).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.distro_version)
 
     @property
     def distros(self):
-        return list(set(
-            [b.distro for b in
-             Binary.query.distinct(Binary.distro).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.distro)
 
     @property
     def refs(self):
-        return list(set(
-            [b.ref for b in
-             Binary.query.distinct(Binary.ref).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.ref)
 
     @property
     def sha1s(self):
-        return list(set(
-            [b.sha1 for b in
-             Binary.query.distinct(Binary.sha1).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.sha1)
 
     @property
     def flavors(self):
-        return list(set(
-            [b.flavor for b in
-             Binary.query.distinct(Binary.flavor).filter_by(project=self).all()]
-        ))
+        return self._binary_values(Binary.flavor)
 
     @property
     def built_repos(self):
@@ -62,19 +61,19 @@ class Project(Base):
 
     @property
     def repo_refs(self):
-        return list(set([r.ref for r in self.repos.all()]))
+        return self._repo_values(Repo.ref)
 
     @property
     def repo_sha1s(self):
-        return list(set([r.sha1 for r in self.repos.all()]))
+        return self._repo_values(Repo.sha1)
 
     @property
     def repo_distros(self):
-        return list(set([r.distro for r in self.repos.all()]))
+        return self._repo_values(Repo.distro)
 
     @property
     def repo_distro_versions(self):
-        return list(set([r.distro_version for r in self.repos.all()]))
+        return self._repo_values(Repo.distro_version)
 
     def __repr__(self):
         try:
@@ -83,15 +82,10 @@ class Project(Base):
             return '<Project detached>'
 
     def __json__(self):
-        json_ = {}
-        for ref in self.refs:
-            json_[ref] = list(
-                set(
-                    [b.sha1 for b in
-                     Binary.query.distinct(Binary.sha1).filter_by(ref=ref, project=self).all()]
-                )
-            )
-        return json_
+        return group_pairs(
+            Binary.query.filter_by(project=self).with_entities(
+                Binary.ref, Binary.sha1).group_by(Binary.ref, Binary.sha1)
+        )
 
 
 def get_or_create(name, **kw):
@@ -99,3 +93,38 @@ def get_or_create(name, **kw):
     if not project:
         project = Project(name=name)
     return project
+
+
+def group_pairs(rows):
+    """
+    Group ``(key, value)`` rows into a dictionary of lists, keys with a ``None``
+    value (from outer joins) map to an empty list.
+    """
+    grouped = {}
+    for key, value in rows:
+        values = grouped.setdefault(key, [])
+        if value is not None:
+            values.append(value)
+    return grouped
+
+
+def refs_by_project():
+    """
+    Map every project name to the refs of its binaries in a single query
+    """
+    return group_pairs(
+        Project.query.with_entities(Project.name, Binary.ref).outerjoin(
+            Binary, Binary.project_id == Project.id
+        ).group_by(Project.name, Binary.ref)
+    )
+
+
+def repo_refs_by_project():
+    """
+    Map every project name to the refs of its repos in a single query
+    """
+    return group_pairs(
+        Project.query.with_entities(Project.name, Repo.ref).outerjoin(
+            Repo, Repo.project_id == Project.id
+        ).group_by(Project.name, Repo.ref)
+    )
@@ -1,12 +1,15 @@
 import datetime
+import math
 import os
 import socket
 from pecan import conf
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
+from sqlalchemy import (
+    Column, Integer, String, ForeignKey, Boolean, DateTime, Index, or_, select
+)
 from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy.event import listen
 from sqlalchemy.orm.exc import DetachedInstanceError
-from chacra.models import Base, update_timestamp
+from chacra.models import Base, Session, update_timestamp
 from chacra.models.types import JSONType
 
 
@@ -25,6 +28,13 @@ class Repo(Base):
     needs_update = Column(Boolean(), default=True)
     is_updating = Column(Boolean(), default=False)
     is_queued = Column(Boolean(), default=False)
+    # first and last time it was marked as needing an update since it was
+    # last built
+    dirty_since = Column(DateTime)
+    dirtied = Column(DateTime)
+    # the worker building the repo, and until when (see async.lease)
+    lease_owner = Column(String(256))
+    lease_expires = Column(DateTime)
     type = Column(String(12))
     size = Column(Integer, default=0)
     extra = deferred(Column(JSONType(), default={}))
@@ -32,6 +42,17 @@ class Repo(Base):
     project_id = Column(Integer, ForeignKey('projects.id'))
     project = relationship('Project', backref=backref('repos', lazy='dynamic'))
 
+    # the lookup done for every binary that is created, and the (few) repos
+    # that are waiting to be picked up by ``poll_repos``
+    __table_args__ = (
+        Index(
+            'ix_repos_lookup', 'project_id', 'ref', 'sha1', 'distro',
+            'distro_version', 'flavor'),
+        Index(
+            'ix_repos_dirty', 'id',
+            postgresql_where=(needs_update == True) & (is_queued == False)),
+    )
+
     def __init__(self, project, ref, distro, distro_version, **kwargs):
         self.project = project
         self.ref = ref
@@ -117,6 +138,117 @@ class Repo(Base):
     def archs(self):
         return list(set(b.arch for b in self.binaries))
 
+    def settle_time(self, quiet_time, max_quiet_time, now=None):
+        """
+        The number of seconds to wait before building, so that binaries that
+        keep coming in (like a build uploading for several minutes) end up in
+        a single build: ``quiet_time`` after the repo was last marked as
+        needing an update, but no more than ``max_quiet_time`` after it was
+        first marked.
+        """
+        if self.dirtied is None:
+            return 0
+        now = now or datetime.datetime.utcnow()
+        wait = self.dirtied + datetime.timedelta(seconds=quiet_time) - now
+        if self.dirty_since is not None:
+            limit = self.dirty_since + datetime.timedelta(seconds=max_quiet_time) - now
+            wait = min(wait, limit)
+        return max(0, int(math.ceil(wait.total_seconds())))
+
+
+def lease_expired(now):
+    """
+    The condition for repos whose build lease expired (or that were flagged
+    as updating without one).
+    """
+    table = Repo.__table__
+    return (table.c.lease_expires == None) | (table.c.lease_expires < now)
+
+
+def supports_returning():
+    """
+    ``UPDATE ... RETURNING`` is only available in PostgreSQL, SQLite (used by
+    the development configuration) does not have it
+    """
+    return Session.get_bind().dialect.name == 'postgresql'
+
+
+def update_repos(condition, **values):
+    """
+    Set ``values`` on every repo that matches ``condition`` and return their
+    ids. This is a single ``UPDATE ... RETURNING`` when the database supports
+    it, otherwise the ids are selected first and each row is updated on its
+    own with the same condition, keeping only the ones that still matched it
+    so that a row changed in between is never returned.
+
+    Callers commit the changes.
+    """
+    table = Repo.__table__
+    if supports_returning():
+        query = table.update().where(condition).values(**values).returning(table.c.id)
+        return [repo_id for repo_id, in Session.execute(query)]
+
+    candidates = Session.execute(select([table.c.id]).where(condition))
+    repo_ids = []
+    for repo_id, in candidates.fetchall():
+        query = table.update().where(
+            (table.c.id == repo_id) & condition
+        ).values(**values)
+        if Session.execute(query).rowcount == 1:
+            repo_ids.append(repo_id)
+    return repo_ids
+
+
+def claim_dirty_repos(repo_ids=None):
+    """
+    Mark every repo that needs to be updated (and is not queued or being
+    updated already) as queued, with a single ``UPDATE`` where the database
+    supports it (see ``update_repos``), and return their ids. Only the repos
+    in ``repo_ids`` are claimed when it is given.
+
+    Concurrent callers never get the same repo: an ``UPDATE`` that waits on a
+    row locked by another one checks the conditions again once it is
+    released, and by then the repo is queued. The claim is committed right
+    away so that rows are not kept locked while tasks are sent.
+
+    Repos that are being updated are skipped, unless their build lease
+    expired.
+    """
+    table = Repo.__table__
+    now = datetime.datetime.utcnow()
+    condition = (
+        (table.c.needs_update == True) &
+        (table.c.is_queued == False) &
+        or_(
+            table.c.is_updating == False,
+            table.c.is_updating == None,
+            lease_expired(now),
+        )
+    )
+    if repo_ids is not None:
+        condition = condition & table.c.id.in_(repo_ids)
+    ids = update_repos(condition, is_queued=True)
+    Session.commit()
+    return ids
+
+
+def update_dirtied(target, value, oldvalue, initiator):
+    """
+    Keep track of when a repo gets marked as needing an update, the times are
+    reset when it no longer needs one (when a build starts).
+    """
+    if not value:
+        target.dirty_since = None
+        return
+    now = datetime.datetime.utcnow()
+    target.dirtied = now
+    if target.dirty_since is None:
+        target.dirty_since = now
+
+
 # listen for timestamp modifications
 listen(Repo, 'before_insert', update_timestamp)
 listen(Repo, 'before_update', update_timestamp)
+
+# listen for repos being marked as needing an update
+listen(Repo.needs_update, 'set', update_dirtied)
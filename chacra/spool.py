@@ -0,0 +1,54 @@
+"""
+Request bodies that the web server writes to ``upload_spool_root`` and hands
+off with the ``X-Upload-File`` header (see the README). The web server never
+removes these files, so every request that does not adopt its file must
+remove it, whatever the outcome: a failed authentication, an invalid request
+or an unexpected error. ``SpoolCleanup`` wraps the whole application for that.
+"""
+import logging
+import os
+
+from pecan import conf
+
+from chacra import storage
+
+logger = logging.getLogger(__name__)
+
+
+def spool_root():
+    return getattr(conf, 'upload_spool_root', None)
+
+
+def spooled_path(path):
+    """
+    The real path of ``path`` if it is a file inside ``upload_spool_root``,
+    otherwise ``None`` so that nothing outside of it is ever touched.
+    """
+    root = spool_root()
+    if not root or not path:
+        return None
+    path = os.path.realpath(path)
+    if not path.startswith(os.path.join(os.path.realpath(root), '')):
+        return None
+    return path
+
+
+class SpoolCleanup(object):
+    """
+    Remove the spooled file of a request once it is handled, unless the
+    request adopted it (moving it out of the spool directory).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path = spooled_path(environ.get('HTTP_X_UPLOAD_FILE'))
+        if path is None:
+            return self.app(environ, start_response)
+        try:
+            return self.app(environ, start_response)
+        finally:
+            if os.path.exists(path):
+                logger.info('removing spooled file that was not adopted: %s', path)
+                storage.remove_quietly(path)
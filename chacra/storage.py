@@ -0,0 +1,488 @@
+"""
+Helpers to deal with binaries on disk. Binaries can be several gigabytes in
+size so anything that reads or writes them should go through here to avoid
+going over the bytes more than once.
+
+This module must not import models, since models rely on it to compute
+checksums.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+from pecan import conf
+
+
+logger = logging.getLogger(__name__)
+
+
+# Binaries are large, so reads and writes use large buffers to reduce the
+# number of system calls
+CHUNK_SIZE = 1024 * 1024
+
+# hex digest of ``new_checksum``
+checksum_re = re.compile(r'^[0-9a-f]{128}$')
+
+
+def new_checksum():
+    """
+    The hashing object used for every binary checksum
+    """
+    return hashlib.sha512()
+
+
+def valid_checksum(value):
+    """
+    Checksums sent by clients end up as paths in the blob store, so anything
+    that is not a hex digest of ``new_checksum`` is never trusted
+    """
+    return isinstance(value, basestring) and checksum_re.match(value) is not None
+
+
+def checksum(path, chunk_size=CHUNK_SIZE):
+    """
+    Read the file at ``path`` and return its hex digest
+    """
+    chsum = new_checksum()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            chsum.update(chunk)
+    return chsum.hexdigest()
+
+
+def save(file_obj, destination, chunk_size=CHUNK_SIZE, fsync=None):
+    """
+    Stream the contents of ``file_obj`` into ``destination`` computing the
+    checksum and size while the bytes are written, so that the file does not
+    need to be read back again.
+
+    The bytes go to a temporary file in the same directory which is then
+    renamed into place, so that readers (and tools like ``createrepo`` or
+    ``reprepro``) never see a partially written file.
+
+    ``fsync`` defaults to the ``fsync_uploads`` configuration option, when
+    enabled the file and its directory are flushed to disk before returning,
+    trading throughput for durability.
+
+    With the blob store enabled, content that was already uploaded is linked
+    into ``destination`` and the new copy is discarded.
+
+    Returns a tuple with the hex digest and the size of the file.
+    """
+    temp_path, chsum, size = stage(file_obj, destination, chunk_size=chunk_size)
+    try:
+        publish(temp_path, destination, checksum=chsum, fsync=fsync)
+    except Exception:
+        remove_quietly(temp_path)
+        raise
+    return chsum, size
+
+
+def stage(file_obj, destination, chunk_size=CHUNK_SIZE):
+    """
+    Stream the contents of ``file_obj`` into a temporary file next to
+    ``destination`` without publishing it, for callers that need to check
+    several files before any of them is put in place (see ``publish``).
+
+    Returns a tuple with the temporary path, the hex digest and the size.
+    """
+    chsum = new_checksum()
+    size = 0
+    temp_path = temporary_path(destination)
+    # O_EXCL ensures no other upload is writing to this same temporary file,
+    # and the mode is still subject to the umask like a regular open()
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+                chsum.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        remove_quietly(temp_path)
+        raise
+    return temp_path, chsum.hexdigest(), size
+
+
+def link(source, destination, checksum=None):
+    """
+    Place the content of ``source`` at ``destination`` without transferring
+    it again. A hardlink is used when possible, falling back to a copy when
+    ``source`` is in a different filesystem. Sharing the inode is safe for the
+    same reason it is safe for blobs (see the blob store notes below).
+    """
+    temp_path = temporary_path(destination)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    try:
+        publish(temp_path, destination, checksum=checksum)
+    except Exception:
+        remove_quietly(temp_path)
+        raise
+
+
+def adopt(path, destination, fsync=None):
+    """
+    Move a complete file written by someone else (like a request body that
+    the web server spooled to disk) into ``destination``. The file is read
+    once to compute its checksum but never copied, unless ``path`` is in
+    a different filesystem than ``destination``.
+
+    Returns a tuple with the hex digest and the size of the file.
+    """
+    temp_path = temporary_path(destination)
+    try:
+        os.rename(path, temp_path)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        with open(path, 'rb') as f:
+            result = save(f, destination, fsync=fsync)
+        remove_quietly(path)
+        return result
+    try:
+        chsum = checksum(temp_path)
+        size = os.path.getsize(temp_path)
+        publish(temp_path, destination, checksum=chsum, fsync=fsync)
+    except Exception:
+        remove_quietly(temp_path)
+        raise
+    return chsum, size
+
+
+def temporary_path(destination):
+    """
+    A unique, hidden, path next to ``destination`` so that it lives in the
+    same filesystem and can be renamed atomically.
+    """
+    directory, name = os.path.split(destination)
+    return os.path.join(directory, '.%s.%s.tmp' % (name, uuid.uuid4().hex))
+
+
+def fsync_directory(path):
+    """
+    Ensure that a rename into ``path`` survives a crash
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish(path, destination, checksum=None, fsync=None):
+    """
+    Atomically move a fully written file at ``path`` into ``destination``,
+    both must live in the same filesystem.
+
+    When ``checksum`` is given and the blob store is enabled, ``destination``
+    ends up as a hardlink to the blob with that same content.
+    """
+    if fsync is None:
+        fsync = getattr(conf, 'fsync_uploads', False)
+    if checksum:
+        path = link_blob(path, checksum)
+    if os.path.exists(destination) and os.path.samefile(path, destination):
+        # same content uploaded again, rename() would be a no-op and leave
+        # ``path`` behind
+        remove_quietly(path)
+        return
+    if fsync:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.rename(path, destination)
+    if fsync:
+        fsync_directory(os.path.dirname(destination))
+
+
+def remove(path, checksum=None):
+    """
+    Remove a binary from disk, along with its blob when no other binary is
+    using that same content anymore.
+    """
+    os.remove(path)
+    if checksum:
+        release_blob(checksum)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        logger.warning('could not remove %s', path)
+
+
+#
+# Content-addressed blob store
+#
+# Identical binaries are often uploaded for many refs, sha1s and distro
+# versions. When ``blob_root`` is configured every binary is also linked as
+# ``blob_root/<2 chars>/<2 chars>/<checksum>`` and an upload with the same
+# content becomes a hardlink to the existing blob instead of another copy.
+#
+# The link count of a blob is its reference count: a count of 1 means that only
+# the blob store is holding on to it. Binaries are always replaced by renaming
+# a new file into place, never written in place, so a hardlink is never
+# modified through another path.
+#
+
+def blob_root():
+    return getattr(conf, 'blob_root', None)
+
+
+def blob_path(checksum):
+    if not valid_checksum(checksum):
+        raise ValueError('invalid checksum: %r' % (checksum,))
+    return os.path.join(blob_root(), checksum[:2], checksum[2:4], checksum)
+
+
+def link_blob(path, checksum):
+    """
+    Link the fully written file at ``path`` into the blob store. If there is
+    a blob with the same content already, ``path`` is discarded and a new
+    link to that blob (next to ``path``) is returned instead.
+
+    Returns the path that should be published.
+    """
+    if not blob_root():
+        return path
+    blob = blob_path(checksum)
+    try:
+        _makedirs(os.path.dirname(blob))
+        os.link(path, blob)
+        return path
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            # e.g. the blob store is in a different filesystem, the binary is
+            # still stored, just not deduplicated
+            logger.exception('could not link %s into the blob store', path)
+            return path
+    link = temporary_path(path)
+    try:
+        os.link(blob, link)
+    except OSError:
+        logger.exception('could not link blob %s', blob)
+        return path
+    remove_quietly(path)
+    return link
+
+
+def release_blob(checksum):
+    """
+    Remove the blob for ``checksum`` if no binary is linked to it anymore
+    """
+    if not blob_root() or not valid_checksum(checksum):
+        return
+    blob = blob_path(checksum)
+    try:
+        links = os.stat(blob).st_nlink
+    except OSError:
+        return
+    # another upload may link to the blob right after this check, that upload
+    # keeps its own link to the content so nothing is lost, the content is
+    # just no longer deduplicated against
+    if links == 1:
+        remove_quietly(blob)
+
+
+def prune_blobs():
+    """
+    Remove every blob that no binary is linked to. Binaries that get replaced
+    by a new upload (or removed outside of chacra) leave their blob behind,
+    so this should run periodically.
+
+    Returns the number of blobs removed.
+    """
+    root = blob_root()
+    if not root or not os.path.isdir(root):
+        return 0
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                logger.warning('could not prune blob %s', path)
+    return removed
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+# partial uploads that are not touched in this many seconds are considered
+# abandoned, see ``expire_uploads``
+DEFAULT_UPLOAD_EXPIRY = 7 * 24 * 60 * 60
+
+upload_re = re.compile(r'^\.[0-9a-f]{32}\.upload(\.json)?$')
+
+
+class PartialUpload(object):
+    """
+    A binary that is uploaded in several requests so that a dropped connection
+    does not require starting over. The bytes received so far live in a hidden
+    file in the same directory as the final binary, along with a small JSON
+    file with the metadata of the upload.
+
+    The checksum is computed once, when the upload is finalized, instead of
+    while the chunks are received: chunks can be handled by any process so
+    keeping the hashing state around would mean reading back all the bytes
+    received so far whenever a chunk lands on a different process.
+    """
+
+    def __init__(self, directory, upload_id):
+        self.id = upload_id
+        self.directory = directory
+        self.path = os.path.join(directory, '.%s.upload' % upload_id)
+        self.metadata_path = '%s.json' % self.path
+        self._checksum = None
+
+    @classmethod
+    def create(cls, directory, name, size=None, force=False):
+        upload = cls(directory, uuid.uuid4().hex)
+        with open(upload.metadata_path, 'w') as f:
+            json.dump(dict(name=name, size=size, force=force), f)
+        # create the (empty) file that will receive the bytes
+        open(upload.path, 'wb').close()
+        return upload
+
+    def exists(self):
+        return os.path.exists(self.metadata_path) and os.path.exists(self.path)
+
+    @property
+    def metadata(self):
+        with open(self.metadata_path) as f:
+            return json.load(f)
+
+    @property
+    def name(self):
+        return self.metadata['name']
+
+    @property
+    def size(self):
+        return self.metadata.get('size')
+
+    @property
+    def force(self):
+        return self.metadata.get('force', False)
+
+    @property
+    def offset(self):
+        return os.path.getsize(self.path)
+
+    @property
+    def is_complete(self):
+        if self.size is None:
+            return True
+        return self.offset == self.size
+
+    def append(self, file_obj, offset, limit=None, chunk_size=CHUNK_SIZE):
+        """
+        Append the contents of ``file_obj`` at ``offset``, which must match the
+        number of bytes already received, reading at most ``limit`` bytes.
+        Bytes that make it to disk are kept even if reading ``file_obj``
+        fails, so that the client can resume from the new offset.
+
+        Returns the new offset, or ``None`` if ``offset`` does not match.
+        """
+        with open(self.path, 'ab') as f:
+            # only one request can be appending to this upload at a time
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                return None
+            remaining = limit
+            try:
+                while remaining is None or remaining > 0:
+                    size = chunk_size if remaining is None else min(chunk_size, remaining)
+                    chunk = file_obj.read(size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    current += len(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+            finally:
+                f.flush()
+        self._checksum = None
+        return current
+
+    def checksum(self):
+        """
+        The hex digest of the bytes received, read from disk only once
+        """
+        if self._checksum is None:
+            self._checksum = checksum(self.path)
+        return self._checksum
+
+    def publish(self, destination):
+        """
+        Move the received bytes into ``destination`` and discard the upload.
+
+        Returns a tuple with the hex digest and the size of the file.
+        """
+        size = self.offset
+        checksum = self.checksum()
+        publish(self.path, destination, checksum=checksum)
+        self.remove()
+        return checksum, size
+
+    def remove(self):
+        for path in (self.path, self.metadata_path):
+            if os.path.exists(path):
+                remove_quietly(path)
+
+
+def expire_uploads(root, max_age=None):
+    """
+    Remove the partial uploads under ``root`` that were not touched in
+    ``max_age`` seconds (the ``upload_expiry`` configuration option, a week
+    by default), since clients that gave up on them never finalize or
+    discard them. The metadata file of an upload is removed along with its
+    bytes, as well as either one when the other is missing.
+
+    Returns the number of uploads removed.
+    """
+    if max_age is None:
+        max_age = getattr(conf, 'upload_expiry', DEFAULT_UPLOAD_EXPIRY)
+    if not root or not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        uploads = {}
+        for name in filenames:
+            if upload_re.match(name):
+                path = os.path.join(dirpath, name)
+                uploads.setdefault(path.rsplit('.upload', 1)[0], []).append(path)
+        for paths in uploads.values():
+            try:
+                # appending chunks only touches the file with the bytes
+                touched = max(os.path.getmtime(path) for path in paths)
+            except OSError:
+                continue
+            if touched >= cutoff:
+                continue
+            for path in paths:
+                remove_quietly(path)
+            removed += 1
+    return removed
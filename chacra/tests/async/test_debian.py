@@ -0,0 +1,152 @@
+import subprocess
+import pecan
+from chacra.async import debian
+from chacra.models import Binary, Project
+
+
+class TestUpdateBinaries(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def binary(self, name, distro_version='trusty', checksum='aaaa'):
+        return Binary(
+            name,
+            self.p,
+            ref='firefly',
+            distro='ubuntu',
+            distro_version=distro_version,
+            arch='all',
+            path='/path/%s' % name,
+            checksum=checksum,
+        )
+
+    def patch_calls(self, monkeypatch, fail=lambda command: False):
+        calls = []
+
+        def check_call(command):
+            calls.append(command)
+            if fail(command):
+                raise subprocess.CalledProcessError(1, command)
+        monkeypatch.setattr(debian.subprocess, 'check_call', check_call)
+        return calls
+
+    def update(self, monkeypatch, tmpdir, binaries):
+        pecan.conf.distributions_root = str(tmpdir)
+        calls = self.patch_calls(monkeypatch)
+        debian.update_binaries(str(tmpdir), binaries)
+        return calls
+
+    def test_one_call_per_distro_version_and_one_export(self, session, monkeypatch, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        calls = self.patch_calls(monkeypatch)
+        binaries = [
+            self.binary('ceph-1.1.deb'),
+            self.binary('rbd-1.1.deb'),
+            self.binary('ceph-1.1.deb', 'xenial'),
+        ]
+        debian.update_binaries(str(tmpdir), binaries)
+        includes = [c for c in calls if 'includedeb' in c]
+        exports = [c for c in calls if 'export' in c]
+        assert len(includes) == 2
+        assert len(exports) == 1
+        assert exports[0][-2:] == ['trusty', 'xenial']
+        assert calls[-1] == exports[0]
+
+    def test_failed_batch_is_added_one_at_a_time(self, session, monkeypatch, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        # the batch fails because of the bad binary
+        calls = self.patch_calls(monkeypatch, fail=lambda c: '/path/bad-1.1.deb' in c)
+        debian.update_binaries(
+            str(tmpdir), [self.binary('ceph-1.1.deb'), self.binary('bad-1.1.deb')])
+        singles = [c[-1] for c in calls if 'includedeb' in c][1:]
+        assert sorted(singles) == ['/path/bad-1.1.deb', '/path/ceph-1.1.deb']
+        assert 'export' in calls[-1]
+
+    def test_failed_binaries_are_added_again(self, session, monkeypatch, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        self.patch_calls(monkeypatch, fail=lambda c: '/path/bad-1.1.deb' in c)
+        binaries = [self.binary('ceph-1.1.deb'), self.binary('bad-1.1.deb')]
+        debian.update_binaries(str(tmpdir), binaries)
+        calls = self.patch_calls(monkeypatch)
+        debian.update_binaries(str(tmpdir), binaries)
+        assert [c[-1] for c in calls if 'includedeb' in c] == ['/path/bad-1.1.deb']
+
+    def test_manifest_is_written(self, session, monkeypatch, tmpdir):
+        self.update(monkeypatch, tmpdir, [self.binary('ceph_1.1_amd64.deb')])
+        manifest = debian.read_manifest(str(tmpdir))
+        assert manifest['trusty']['/path/ceph_1.1_amd64.deb']['package'] == 'ceph'
+
+    def test_nothing_to_do_when_up_to_date(self, session, monkeypatch, tmpdir):
+        binaries = [self.binary('ceph_1.1_amd64.deb'), self.binary('rbd_1.1_amd64.deb')]
+        self.update(monkeypatch, tmpdir, binaries)
+        assert self.update(monkeypatch, tmpdir, binaries) == []
+
+    def test_only_new_binaries_are_added(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        self.update(monkeypatch, tmpdir, [ceph])
+        calls = self.update(monkeypatch, tmpdir, [ceph, self.binary('rbd_1.1_amd64.deb')])
+        assert len(calls) == 2
+        assert calls[0][-1] == '/path/rbd_1.1_amd64.deb'
+        assert calls[1][-2:] == ['export', 'trusty']
+
+    def test_only_changed_distro_versions_are_exported(self, session, monkeypatch, tmpdir):
+        binaries = [self.binary('ceph_1.1_amd64.deb'), self.binary('ceph_1.1_amd64.deb', 'xenial')]
+        self.update(monkeypatch, tmpdir, binaries)
+        binaries.append(self.binary('rbd_1.1_amd64.deb', 'xenial'))
+        calls = self.update(monkeypatch, tmpdir, binaries)
+        assert calls[-1][-2:] == ['export', 'xenial']
+
+    def test_gone_binaries_are_removed(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        self.update(monkeypatch, tmpdir, [ceph, self.binary('rbd_1.1_amd64.deb')])
+        calls = self.update(monkeypatch, tmpdir, [ceph])
+        assert calls[0][-4:] == ['deb', 'remove', 'trusty', 'rbd']
+        assert [c for c in calls if 'includedeb' in c] == []
+        assert calls[-1][-2:] == ['export', 'trusty']
+
+    def test_changed_binaries_are_replaced(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        self.update(monkeypatch, tmpdir, [ceph])
+        ceph.set_content(ceph.path, 'bbbb', ceph.size)
+        calls = self.update(monkeypatch, tmpdir, [ceph])
+        assert calls[0][-4:] == ['deb', 'remove', 'trusty', 'ceph']
+        assert calls[1][-1] == '/path/ceph_1.1_amd64.deb'
+
+    def test_new_version_keeps_its_package(self, session, monkeypatch, tmpdir):
+        self.update(monkeypatch, tmpdir, [self.binary('ceph_1.1_amd64.deb')])
+        calls = self.update(monkeypatch, tmpdir, [self.binary('ceph_1.2_amd64.deb')])
+        # the old version is removed by name, so the new one is added after it
+        assert calls[0][-4:] == ['deb', 'remove', 'trusty', 'ceph']
+        assert calls[1][-1] == '/path/ceph_1.2_amd64.deb'
+
+    def test_failed_removals_are_tried_again(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        self.update(monkeypatch, tmpdir, [ceph, self.binary('rbd_1.1_amd64.deb')])
+        pecan.conf.distributions_root = str(tmpdir)
+        self.patch_calls(monkeypatch, fail=lambda c: 'remove' in c)
+        debian.update_binaries(str(tmpdir), [ceph])
+        manifest = debian.read_manifest(str(tmpdir))
+        assert '/path/rbd_1.1_amd64.deb' in manifest['trusty']
+        calls = self.update(monkeypatch, tmpdir, [ceph])
+        assert calls[0][-4:] == ['deb', 'remove', 'trusty', 'rbd']
+        assert '/path/rbd_1.1_amd64.deb' not in debian.read_manifest(str(tmpdir))['trusty']
+
+    def test_failed_exports_are_tried_again(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        pecan.conf.distributions_root = str(tmpdir)
+        self.patch_calls(monkeypatch, fail=lambda c: 'export' in c)
+        debian.update_binaries(str(tmpdir), [ceph])
+        calls = self.update(monkeypatch, tmpdir, [ceph])
+        assert calls[0][-1] == '/path/ceph_1.1_amd64.deb'
+        assert calls[-1][-2:] == ['export', 'trusty']
+        assert self.update(monkeypatch, tmpdir, [ceph]) == []
+
+    def test_failed_exports_keep_failed_removals(self, session, monkeypatch, tmpdir):
+        ceph = self.binary('ceph_1.1_amd64.deb')
+        self.update(monkeypatch, tmpdir, [ceph, self.binary('rbd_1.1_amd64.deb')])
+        pecan.conf.distributions_root = str(tmpdir)
+        self.patch_calls(monkeypatch, fail=lambda c: 'export' in c or 'remove' in c)
+        debian.update_binaries(str(tmpdir), [ceph])
+        calls = self.update(monkeypatch, tmpdir, [ceph])
+        assert calls[0][-4:] == ['deb', 'remove', 'trusty', 'rbd']
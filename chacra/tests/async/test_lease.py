@@ -0,0 +1,101 @@
+import datetime
+import py.test
+from chacra.async import lease
+from chacra.models import Repo, Project
+
+
+class TestLease(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    @py.test.fixture(autouse=True, params=[True, False], ids=['returning', 'no-returning'])
+    def returning(self, request, monkeypatch):
+        # SQLite (in the development configuration) has no RETURNING
+        monkeypatch.setattr('chacra.models.repos.supports_returning', lambda: request.param)
+
+    def create_repo(self, session, **kw):
+        repo = Repo(self.p, ref='firefly', distro='centos', distro_version='7')
+        for key, value in kw.items():
+            setattr(repo, key, value)
+        session.commit()
+        return repo.id
+
+    def expire(self, session, repo_id):
+        repo = Repo.get(repo_id)
+        repo.lease_expires = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        session.commit()
+
+    def test_acquire(self, session):
+        repo_id = self.create_repo(session)
+        build_lease = lease.Lease(repo_id)
+        assert build_lease.acquire() is True
+        repo = Repo.get(repo_id)
+        assert repo.is_updating is True
+        assert repo.lease_owner == build_lease.owner
+        assert repo.lease_expires > datetime.datetime.utcnow()
+
+    def test_only_one_owner(self, session):
+        repo_id = self.create_repo(session)
+        assert lease.Lease(repo_id).acquire() is True
+        assert lease.Lease(repo_id).acquire() is False
+
+    def test_expired_lease_can_be_taken(self, session):
+        repo_id = self.create_repo(session)
+        first = lease.Lease(repo_id)
+        first.acquire()
+        self.expire(session, repo_id)
+        second = lease.Lease(repo_id)
+        assert second.acquire() is True
+        assert first.renew() is False
+        assert first.release() is False
+        assert Repo.get(repo_id).lease_owner == second.owner
+
+    def test_release(self, session):
+        repo_id = self.create_repo(session)
+        build_lease = lease.Lease(repo_id)
+        build_lease.acquire()
+        assert build_lease.release() is True
+        repo = Repo.get(repo_id)
+        assert repo.is_updating is False
+        assert repo.lease_owner is None
+
+    def test_released_when_build_fails(self, session):
+        repo_id = self.create_repo(session)
+        build_lease = lease.Lease(repo_id)
+        build_lease.acquire()
+        with py.test.raises(RuntimeError):
+            with build_lease:
+                raise RuntimeError('createrepo failed')
+        assert Repo.get(repo_id).is_updating is False
+
+    def test_failed_build_is_tried_again(self, session):
+        repo_id = self.create_repo(session, needs_update=False)
+        build_lease = lease.Lease(repo_id)
+        build_lease.acquire()
+        with py.test.raises(RuntimeError):
+            with build_lease:
+                raise RuntimeError('createrepo failed')
+        assert Repo.get(repo_id).needs_update is True
+
+    def test_successful_build_is_not_tried_again(self, session):
+        repo_id = self.create_repo(session, needs_update=False)
+        build_lease = lease.Lease(repo_id)
+        build_lease.acquire()
+        with build_lease:
+            pass
+        assert Repo.get(repo_id).needs_update is False
+
+    def test_recover_expired(self, session):
+        repo_id = self.create_repo(session, needs_update=False)
+        lease.Lease(repo_id).acquire()
+        self.expire(session, repo_id)
+        assert lease.recover_expired() == [repo_id]
+        repo = Repo.get(repo_id)
+        assert repo.is_updating is False
+        assert repo.needs_update is True
+
+    def test_does_not_recover_valid_leases(self, session):
+        repo_id = self.create_repo(session, needs_update=False)
+        lease.Lease(repo_id).acquire()
+        assert lease.recover_expired() == []
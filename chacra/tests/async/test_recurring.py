@@ -1,7 +1,11 @@
 import datetime
 import os
+from StringIO import StringIO
+import pytest
 from pecan import conf
 from chacra.tests import conftest
+from chacra import storage
+from chacra import async
 from chacra.async import recurring
 from chacra.models import Repo, Project, Binary
 
@@ -123,6 +127,26 @@ class TestPurgeRepos(object):
         recurring.purge_repos(_now=self.now)
         assert len(Binary.query.all()) == 0
 
+    def test_releases_blobs_of_deleted_binaries(self, session, fake, monkeypatch, tmpdir):
+        conf.blob_root = str(tmpdir.join('blobs'))
+        p = tmpdir.join('binary')
+        checksum, size = storage.save(StringIO('contents'), str(p))
+        fake_datetime = fake(utcnow=lambda: self.old, now=self.now)
+        monkeypatch.setattr(datetime, 'datetime', fake_datetime)
+        Binary(
+            'ceph-10.0.0.rpm', self.p, distro='centos',
+            distro_version='6',
+            arch='i386',
+            path=str(p),
+            checksum=checksum,
+            size=size,
+            repo=self.repo
+        )
+        session.commit()
+        recurring.purge_repos(_now=self.now)
+        assert not p.check()
+        assert not os.path.exists(storage.blob_path(checksum))
+
     def test_if_disabled_it_does_not_purge_binaries(self, session, fake, monkeypatch, tmpdir):
         conf.purge_repos = False
         p = tmpdir.join('binary')
@@ -149,3 +173,165 @@ class TestPurgeRepos(object):
         assert len(Repo.query.all()) == 1
 
 
+
+
+class RepoTasks(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    @pytest.fixture(autouse=True)
+    def quiet_time(self):
+        previous = getattr(conf, 'quiet_time', None)
+        conf.quiet_time = 0
+        try:
+            yield
+        finally:
+            conf.quiet_time = previous
+
+    def create_repo(self, **kw):
+        repo = Repo(
+            self.p,
+            ref='firefly',
+            distro=kw.pop('distro', 'centos'),
+            distro_version=kw.pop('distro_version', '7'),
+        )
+        repo.type = kw.pop('type', 'rpm')
+        for key, value in kw.items():
+            setattr(repo, key, value)
+        return repo
+
+    def patch_tasks(self, monkeypatch, recorder):
+        rpm_task, deb_task = recorder(), recorder()
+        monkeypatch.setattr(recurring.rpm.create_rpm_repo, 'apply_async', rpm_task)
+        monkeypatch.setattr(recurring.debian.create_deb_repo, 'apply_async', deb_task)
+        return rpm_task, deb_task
+
+
+class TestPollRepos(RepoTasks):
+
+    def test_queues_dirty_repos(self, session, monkeypatch, recorder):
+        rpm_task, deb_task = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(needs_update=True)
+        self.create_repo(distro='ubuntu', distro_version='trusty', type='deb', needs_update=True)
+        session.commit()
+        recurring.poll_repos()
+        assert len(rpm_task.recorder_calls) == 1
+        assert len(deb_task.recorder_calls) == 1
+        assert all(r.is_queued for r in Repo.query.all())
+
+    def test_skips_repos_being_updated(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(
+            needs_update=True,
+            is_updating=True,
+            lease_owner='worker',
+            lease_expires=datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
+        )
+        session.commit()
+        recurring.poll_repos()
+        assert rpm_task.recorder_calls == []
+        assert Repo.query.one().is_queued is False
+
+    def test_queues_repos_being_updated_without_a_lease(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(needs_update=True, is_updating=True)
+        session.commit()
+        recurring.poll_repos()
+        assert len(rpm_task.recorder_calls) == 1
+
+    def test_skips_clean_repos(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(needs_update=False)
+        session.commit()
+        recurring.poll_repos()
+        assert rpm_task.recorder_calls == []
+
+    def test_repos_are_claimed_once(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(needs_update=True)
+        session.commit()
+        recurring.poll_repos()
+        recurring.poll_repos()
+        assert len(rpm_task.recorder_calls) == 1
+
+    def test_unknown_type_is_released(self, session, monkeypatch, recorder):
+        rpm_task, deb_task = self.patch_tasks(monkeypatch, recorder)
+        self.create_repo(needs_update=True, type=None)
+        session.commit()
+        recurring.poll_repos()
+        assert rpm_task.recorder_calls == deb_task.recorder_calls == []
+        assert Repo.query.one().is_queued is False
+
+
+    def test_claims_without_returning(self, session, monkeypatch, recorder):
+        # like SQLite, in the development configuration
+        monkeypatch.setattr('chacra.models.repos.supports_returning', lambda: False)
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        repo = self.create_repo(needs_update=True)
+        self.create_repo(distro_version='6', needs_update=True, is_queued=True)
+        session.commit()
+        recurring.poll_repos()
+        recurring.poll_repos()
+        assert len(rpm_task.recorder_calls) == 1
+        assert rpm_task.recorder_calls[0]['args'] == ((repo.id,),)
+
+    def test_repos_that_fail_to_send_are_released(self, session, monkeypatch, recorder):
+        rpm_task, deb_task = self.patch_tasks(monkeypatch, recorder)
+
+        def broker_down(*a, **kw):
+            raise IOError('connection refused')
+        monkeypatch.setattr(recurring.rpm.create_rpm_repo, 'apply_async', broker_down)
+        self.create_repo(needs_update=True)
+        self.create_repo(distro='ubuntu', distro_version='trusty', type='deb', needs_update=True)
+        session.commit()
+        recurring.poll_repos()
+        assert len(deb_task.recorder_calls) == 1
+        rpm_repo = Repo.filter_by(type='rpm').one()
+        assert rpm_repo.is_queued is False
+        assert rpm_repo.needs_update is True
+        assert Repo.filter_by(type='deb').one().is_queued is True
+
+
+class TestQueueRepos(RepoTasks):
+
+    def test_only_queues_given_repos(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        repo = self.create_repo(needs_update=True)
+        other = self.create_repo(distro_version='6', needs_update=True)
+        session.commit()
+        recurring.queue_repos([repo.id])
+        assert len(rpm_task.recorder_calls) == 1
+        assert rpm_task.recorder_calls[0]['args'] == ((repo.id,),)
+        assert other.is_queued is False
+
+    def test_queued_repos_are_skipped(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        repo = self.create_repo(needs_update=True, is_queued=True)
+        session.commit()
+        recurring.queue_repos([repo.id])
+        assert rpm_task.recorder_calls == []
+
+
+class TestBuildSettling(RepoTasks):
+
+    def test_busy_repo_is_sent_again(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        monkeypatch.setattr(conf, 'quiet_time', 30, raising=False)
+        repo = self.create_repo(needs_update=True, is_queued=True)
+        session.commit()
+        recurring.rpm.create_rpm_repo(repo.id)
+        assert len(rpm_task.recorder_calls) == 1
+        assert 0 < rpm_task.recorder_calls[0]['kwargs']['countdown'] <= 30
+        repo = Repo.get(repo.id)
+        assert repo.is_queued is True
+        assert repo.is_updating is False
+
+    def test_follow_up_is_claimed_once(self, session, monkeypatch, recorder):
+        rpm_task, _ = self.patch_tasks(monkeypatch, recorder)
+        # marked while it was being built
+        repo = self.create_repo(needs_update=True)
+        session.commit()
+        async.queue_follow_up(repo)
+        async.queue_follow_up(repo)
+        assert len(rpm_task.recorder_calls) == 1
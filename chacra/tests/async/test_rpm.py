@@ -0,0 +1,118 @@
+import os
+import py.test
+from chacra.async import rpm
+
+
+class TestUpdateMetadata(object):
+
+    def setup_repo(self, tmpdir, monkeypatch, *names):
+        arch = tmpdir.mkdir('x86_64')
+        for name in names:
+            arch.join(name).write(name)
+        calls = []
+
+        def check_call(command):
+            calls.append(command)
+            # what createrepo leaves behind
+            arch.ensure('repodata', 'repomd.xml')
+        monkeypatch.setattr(rpm.subprocess, 'check_call', check_call)
+        return arch, calls
+
+    def test_runs_createrepo_the_first_time(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is True
+        assert calls[0][:2] == ['createrepo', '--update']
+        assert calls[0][-1] == str(arch)
+
+    def test_cache_is_kept_in_the_repo(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        cachedir = calls[0][calls[0].index('--cachedir') + 1]
+        assert cachedir == os.path.join(str(tmpdir), '.createrepo', 'cache', 'x86_64')
+
+    def test_unchanged_directory_is_skipped(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is False
+        assert len(calls) == 1
+
+    def test_empty_directory_is_skipped_once_it_has_metadata(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch)
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is False
+
+    def test_new_rpm_runs_createrepo(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        arch.join('ceph-1.1.rpm').write('ceph-1.1.rpm')
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is True
+
+    def test_changed_rpm_runs_createrepo(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        arch.join('ceph-1.0.rpm').write('rebuilt ceph-1.0.rpm')
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is True
+
+    def test_missing_metadata_runs_createrepo(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+        rpm.update_metadata(str(tmpdir), 'x86_64')
+        arch.join('repodata').remove()
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is True
+
+    def test_failed_createrepo_is_tried_again(self, tmpdir, monkeypatch):
+        arch, calls = self.setup_repo(tmpdir, monkeypatch, 'ceph-1.0.rpm')
+
+        def fail(command):
+            raise rpm.subprocess.CalledProcessError(1, command)
+        monkeypatch.setattr(rpm.subprocess, 'check_call', fail)
+        with py.test.raises(rpm.subprocess.CalledProcessError):
+            rpm.update_metadata(str(tmpdir), 'x86_64')
+        assert rpm.read_fingerprint(str(tmpdir), 'x86_64') is None
+
+
+class TestUpdateAllMetadata(object):
+
+    def setup_repo(self, tmpdir, monkeypatch, fail=()):
+        for directory in ('noarch', 'x86_64'):
+            tmpdir.mkdir(directory).join('ceph-1.0.rpm').write(directory)
+
+        def check_call(command):
+            if os.path.basename(command[-1]) in fail:
+                raise rpm.subprocess.CalledProcessError(1, command)
+            tmpdir.join(os.path.basename(command[-1])).ensure('repodata', 'repomd.xml')
+        monkeypatch.setattr(rpm.subprocess, 'check_call', check_call)
+
+    def test_every_directory_is_updated(self, tmpdir, monkeypatch):
+        self.setup_repo(tmpdir, monkeypatch)
+        results = rpm.update_all_metadata(str(tmpdir), ['noarch', 'x86_64'], workers=2)
+        assert [(r[0], r[1], r[3]) for r in results] == [
+            ('noarch', True, None), ('x86_64', True, None)]
+
+    def test_failures_are_collected_per_directory(self, tmpdir, monkeypatch):
+        self.setup_repo(tmpdir, monkeypatch, fail=['noarch'])
+        results = rpm.update_all_metadata(str(tmpdir), ['noarch', 'x86_64'], workers=2)
+        errors = dict((r[0], r[3]) for r in results)
+        assert isinstance(errors['noarch'], rpm.subprocess.CalledProcessError)
+        assert errors['x86_64'] is None
+        # the one that worked is not built again
+        assert rpm.update_metadata(str(tmpdir), 'x86_64') is False
+
+    def test_unchanged_directories_are_not_timed(self, tmpdir, monkeypatch):
+        self.setup_repo(tmpdir, monkeypatch)
+        rpm.update_all_metadata(str(tmpdir), ['noarch', 'x86_64'])
+        results = rpm.update_all_metadata(str(tmpdir), ['noarch', 'x86_64'])
+        assert [r[1] for r in results] == [False, False]
+
+    def test_any_error_is_collected_per_directory(self, tmpdir, monkeypatch):
+        self.setup_repo(tmpdir, monkeypatch)
+        write_fingerprint = rpm.write_fingerprint
+
+        def fail(repository_path, directory, value):
+            if directory == 'noarch':
+                raise IOError('disk full')
+            write_fingerprint(repository_path, directory, value)
+        monkeypatch.setattr(rpm, 'write_fingerprint', fail)
+        results = rpm.update_all_metadata(str(tmpdir), ['noarch', 'x86_64'], workers=2)
+        errors = dict((r[0], r[3]) for r in results)
+        assert isinstance(errors['noarch'], IOError)
+        assert errors['x86_64'] is None
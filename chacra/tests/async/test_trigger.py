@@ -0,0 +1,65 @@
+import pytest
+from pecan import conf
+from chacra.async import recurring
+from chacra.models import Repo, Project
+
+
+class TestTriggerBuilds(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    @pytest.fixture(autouse=True)
+    def trigger_builds(self):
+        previous = getattr(conf, 'trigger_builds', False)
+        try:
+            yield
+        finally:
+            conf.trigger_builds = previous
+
+    def create_repo(self, distro_version='7'):
+        repo = Repo(self.p, ref='firefly', distro='centos', distro_version=distro_version)
+        repo.type = 'rpm'
+        return repo
+
+    def patch_queue(self, monkeypatch, recorder, enabled=True):
+        conf.trigger_builds = enabled
+        queue = recorder()
+        monkeypatch.setattr(recurring.queue_repos, 'apply_async', queue)
+        return queue
+
+    def test_sends_marked_repos_on_commit(self, session, monkeypatch, recorder):
+        queue = self.patch_queue(monkeypatch, recorder)
+        repo = self.create_repo()
+        repo.needs_update = True
+        session.commit()
+        assert len(queue.recorder_calls) == 1
+        assert queue.recorder_calls[0]['kwargs']['args'] == ([repo.id],)
+
+    def test_sends_one_message_per_transaction(self, session, monkeypatch, recorder):
+        queue = self.patch_queue(monkeypatch, recorder)
+        for version in ['6', '7']:
+            self.create_repo(version).needs_update = True
+        session.commit()
+        assert len(queue.recorder_calls) == 1
+        assert len(queue.recorder_calls[0]['kwargs']['args'][0]) == 2
+
+    def test_clean_repos_are_not_sent(self, session, monkeypatch, recorder):
+        queue = self.patch_queue(monkeypatch, recorder)
+        self.create_repo().needs_update = False
+        session.commit()
+        assert queue.recorder_calls == []
+
+    def test_rolled_back_repos_are_not_sent(self, session, monkeypatch, recorder):
+        queue = self.patch_queue(monkeypatch, recorder)
+        self.create_repo().needs_update = True
+        session.flush()
+        session.rollback()
+        session.commit()
+        assert queue.recorder_calls == []
+
+    def test_disabled(self, session, monkeypatch, recorder):
+        queue = self.patch_queue(monkeypatch, recorder, enabled=False)
+        self.create_repo().needs_update = True
+        session.commit()
+        assert queue.recorder_calls == []
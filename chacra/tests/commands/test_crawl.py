@@ -0,0 +1,65 @@
+import py.test
+
+from chacra import storage
+from chacra.commands import crawl
+
+
+@py.test.fixture
+def tree(tmpdir):
+    tmpdir.join('el7/ceph-9.0.0-0.el7.x86_64.rpm').write('hello tharrrr', ensure=True)
+    tmpdir.join('el7/ceph-9.0.0-0.el7.noarch.rpm').write('noarch', ensure=True)
+    tmpdir.join('el7/sub/ceph-common-9.0.0-0.el7.x86_64.rpm').write('common', ensure=True)
+    tmpdir.join('el7/.ceph-9.0.0-0.el7.x86_64.rpm.tmp').write('partial', ensure=True)
+    tmpdir.join('ceph_9.0.0-1trusty_amd64.deb').write('deb', ensure=True)
+    return tmpdir
+
+
+def names(paths):
+    return sorted(path.split('/')[-1] for path in paths)
+
+
+class TestFindFiles(object):
+
+    def test_finds_files_recursively(self, tree):
+        assert names(crawl.find_files(str(tree))) == [
+            'ceph-9.0.0-0.el7.noarch.rpm',
+            'ceph-9.0.0-0.el7.x86_64.rpm',
+            'ceph-common-9.0.0-0.el7.x86_64.rpm',
+            'ceph_9.0.0-1trusty_amd64.deb',
+        ]
+
+    def test_startswith(self, tree):
+        assert names(crawl.find_files(str(tree), startswith='ceph-common')) == [
+            'ceph-common-9.0.0-0.el7.x86_64.rpm']
+
+    def test_endswith(self, tree):
+        assert names(crawl.find_files(str(tree), endswith='x86_64.rpm')) == [
+            'ceph-9.0.0-0.el7.x86_64.rpm',
+            'ceph-common-9.0.0-0.el7.x86_64.rpm',
+        ]
+
+    def test_has(self, tree):
+        assert names(crawl.find_files(str(tree), has='trusty')) == [
+            'ceph_9.0.0-1trusty_amd64.deb']
+
+    def test_all_filters_must_match(self, tree):
+        found = crawl.find_files(
+            str(tree), startswith='ceph-', endswith='.rpm', has='noarch')
+        assert names(found) == ['ceph-9.0.0-0.el7.noarch.rpm']
+
+    def test_walk_without_scandir(self, tree, monkeypatch):
+        monkeypatch.setattr(crawl, 'scandir', None)
+        assert len(list(crawl.find_files(str(tree)))) == 4
+
+
+class TestInspectFile(object):
+
+    def test_size_and_checksum(self, tmpdir):
+        path = tmpdir.join('ceph.rpm')
+        path.write('hello tharrrr')
+        result = crawl.inspect_file(str(path))
+        assert result == (str(path), 13, storage.checksum(str(path)))
+
+    def test_missing_file(self, tmpdir):
+        path = str(tmpdir.join('ceph.rpm'))
+        assert crawl.inspect_file(path) == (path, None, None)
@@ -26,6 +26,13 @@ class TestArchController(object):
             '/binaries/ceph/giant/head/centos/el7/x86_64/', expect_errors=True)
         assert result.status_int == 404
 
+    def test_arch_found_with_head(self, session):
+        project = Project('ceph')
+        Binary('ceph-1.0.0.rpm', project, ref='giant', sha1="head", distro='centos', distro_version='el6', arch='x86_64')
+        session.commit()
+        result = session.app.head('/binaries/ceph/giant/head/centos/el6/x86_64/')
+        assert result.status_int == 200
+
     def test_single_arch_should_have_one_item(self, session):
         p = Project('ceph')
         Binary('ceph-9.0.0-0.el6.x86_64.rpm', p, ref='giant', sha1="head", distro='centos', distro_version='el6', arch='x86_64')
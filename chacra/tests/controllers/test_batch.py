@@ -0,0 +1,170 @@
+import io
+import os
+import tarfile
+
+import pecan
+import py.test
+
+from chacra.models import Binary, Repo
+from chacra.tests import util
+
+
+base_urls = [
+    '/binaries/ceph/giant/head/centos/el7/x86_64/batch/',
+    '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/default/batch/',
+]
+
+files = [
+    ('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr'),
+    ('file', 'ceph-common-9.0.0-0.el7.x86_64.rpm', 'something changed'),
+]
+
+
+def make_tar(contents, mode='w'):
+    body = io.BytesIO()
+    tar = tarfile.open(fileobj=body, mode=mode)
+    for name, data in contents:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    tar.close()
+    return body.getvalue()
+
+
+def post_tar(session, url, body, content_type='application/x-tar', **kw):
+    return session.app.post(
+        url,
+        params=body,
+        content_type=content_type,
+        headers={'Authorization': util.make_credentials()},
+        **kw
+    )
+
+
+class TestBatchController(object):
+
+    @py.test.mark.parametrize('url', base_urls)
+    def test_multipart_creates_every_binary(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(url, upload_files=files)
+        assert result.status_int == 201
+        assert sorted(result.json.keys()) == [
+            'ceph-9.0.0-0.el7.x86_64.rpm', 'ceph-common-9.0.0-0.el7.x86_64.rpm']
+        assert Binary.query.count() == 2
+
+    def test_binaries_share_one_repo(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files)
+        assert Repo.query.count() == 1
+        assert Repo.query.one().binaries.count() == 2
+
+    def test_binaries_follow_the_url_layout(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files)
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el7.x86_64.rpm').one()
+        assert binary.path == os.path.join(
+            str(tmpdir), 'ceph/giant/head/centos/el7/x86_64/ceph-9.0.0-0.el7.x86_64.rpm')
+        assert binary.checksum.startswith('318b')
+        assert binary.size == 13
+
+    @py.test.mark.parametrize('mode, content_type', [
+        ('w', 'application/x-tar'),
+        ('w:gz', 'application/gzip'),
+    ])
+    def test_tar_stream_creates_every_binary(self, session, tmpdir, mode, content_type):
+        pecan.conf.binary_root = str(tmpdir)
+        body = make_tar([(name, data) for _, name, data in files], mode=mode)
+        result = post_tar(session, base_urls[0], body, content_type=content_type)
+        assert result.status_int == 201
+        binary = Binary.filter_by(name='ceph-common-9.0.0-0.el7.x86_64.rpm').one()
+        assert open(binary.path).read() == 'something changed'
+
+    def test_tar_directories_are_ignored(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        body = make_tar([('build/RPMS/ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr')])
+        post_tar(session, base_urls[0], body)
+        assert Binary.query.one().name == 'ceph-9.0.0-0.el7.x86_64.rpm'
+
+    def test_invalid_tar_stream(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = post_tar(session, base_urls[0], 'not a tar file', expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_existing_binaries_require_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files[:1])
+        result = session.app.post(base_urls[0], upload_files=files, expect_errors=True)
+        assert result.status_int == 400
+        assert 'force' in result.json['message']
+
+    def test_rejected_batch_leaves_no_files_behind(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files[1:])
+        session.app.post(base_urls[0], upload_files=files, expect_errors=True)
+        directory = tmpdir.join('ceph/giant/head/centos/el7/x86_64')
+        assert [p.basename for p in directory.listdir()] == [
+            'ceph-common-9.0.0-0.el7.x86_64.rpm']
+
+    def test_rejected_forced_batch_does_not_replace_files(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files[:1])
+        result = session.app.post(
+            base_urls[0],
+            params={'force': True},
+            upload_files=[
+                ('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'something changed'),
+                ('file', '.hidden.rpm', 'hello tharrrr'),
+            ],
+            expect_errors=True,
+        )
+        assert result.status_int == 400
+        binary = Binary.query.one()
+        assert open(binary.path).read() == 'hello tharrrr'
+        assert binary.checksum.startswith('318b')
+        directory = tmpdir.join('ceph/giant/head/centos/el7/x86_64')
+        assert [p.basename for p in directory.listdir()] == ['ceph-9.0.0-0.el7.x86_64.rpm']
+
+    def test_multipart_paths_are_reduced_to_the_file_name(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            base_urls[0],
+            upload_files=[('file', '../../ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr')])
+        binary = Binary.query.one()
+        assert binary.name == 'ceph-9.0.0-0.el7.x86_64.rpm'
+        assert binary.path == os.path.join(
+            str(tmpdir), 'ceph/giant/head/centos/el7/x86_64/ceph-9.0.0-0.el7.x86_64.rpm')
+
+    def test_forced_batch_updates_binaries(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(base_urls[0], upload_files=files[:1])
+        result = session.app.post(
+            base_urls[0],
+            params={'force': True},
+            upload_files=[('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'something changed')],
+        )
+        assert result.status_int == 200
+        binary = Binary.query.one()
+        assert binary.checksum.startswith('a5725e467')
+
+    def test_duplicate_names_are_invalid(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(
+            base_urls[0], upload_files=[files[0], files[0]], expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_no_files_is_invalid(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(base_urls[0], params={'force': True}, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_auth_fails(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(
+            base_urls[0],
+            upload_files=files,
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True
+        )
+        assert result.status_int == 401
@@ -437,6 +437,295 @@ class TestBinaryController(object):
         assert response.status_int == 200
 
 
+class TestDownloads(object):
+
+    def setup(self):
+        self.url = '/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/'
+
+    def upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', 'hello tharrrr')]
+        )
+        return Binary.get(1)
+
+    def test_serves_the_whole_file(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(self.url)
+        assert result.status_int == 200
+        assert result.body == 'hello tharrrr'
+        assert result.headers['Content-Length'] == '13'
+        assert result.headers['Accept-Ranges'] == 'bytes'
+
+    def test_checksum_is_a_strong_etag(self, session, tmpdir):
+        binary = self.upload(session, tmpdir)
+        result = session.app.get(self.url)
+        assert result.headers['ETag'] == '"%s"' % binary.checksum
+
+    def test_sets_last_modified(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(self.url)
+        assert result.headers['Last-Modified']
+
+    def test_serves_byte_ranges(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(self.url, headers={'Range': 'bytes=6-'})
+        assert result.status_int == 206
+        assert result.body == 'tharrrr'
+        assert result.headers['Content-Range'] == 'bytes 6-12/13'
+
+    def test_unsatisfiable_range(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(
+            self.url, headers={'Range': 'bytes=20-30'}, expect_errors=True)
+        assert result.status_int == 416
+
+    def test_if_none_match(self, session, tmpdir):
+        binary = self.upload(session, tmpdir)
+        result = session.app.get(
+            self.url, headers={'If-None-Match': str('"%s"' % binary.checksum)})
+        assert result.status_int == 304
+        assert result.body == ''
+
+    def test_if_none_match_with_other_etag(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(self.url, headers={'If-None-Match': '"abc"'})
+        assert result.status_int == 200
+
+    def test_if_modified_since(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        last_modified = session.app.get(self.url).headers['Last-Modified']
+        result = session.app.get(
+            self.url, headers={'If-Modified-Since': last_modified})
+        assert result.status_int == 304
+
+
+    def test_head_binaries_must_revalidate(self, session, tmpdir):
+        binary = self.upload(session, tmpdir)
+        result = session.app.get(self.url + '?generation=%s' % binary.generation)
+        assert result.headers['Cache-Control'] == 'public, max-age=60, must-revalidate'
+
+    def test_pinned_generation_is_immutable(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', 'hello tharrrr')]
+        )
+        binary = Binary.get(1)
+        result = session.app.get(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/'
+            '?generation=%s' % binary.generation)
+        assert result.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    def test_pinned_sha1_without_generation_must_revalidate(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', 'hello tharrrr')]
+        )
+        result = session.app.get(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
+        assert result.headers['Cache-Control'] == 'public, max-age=60, must-revalidate'
+
+    def test_offloads_to_nginx(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        pecan.conf.download_offload = 'x-accel-redirect'
+        try:
+            result = session.app.get(self.url)
+        finally:
+            pecan.conf.download_offload = None
+        assert result.headers['X-Accel-Redirect'] == (
+            '/b/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm')
+        assert result.body == ''
+
+
+class TestChecksumNegotiation(object):
+
+    def setup(self):
+        self.url = '/binaries/ceph/giant/head/ceph/el6/x86_64/'
+        self.target = '/binaries/ceph/firefly/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/'
+
+    def upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            self.url,
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', 'hello tharrrr')]
+        )
+        binary = Binary.get(1)
+        return binary.checksum, binary.path
+
+    def test_known_content_creates_binary(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        result = session.app.post_json(
+            self.target, params={'link': True, 'checksum': checksum, 'size': 13})
+        assert result.status_int == 201
+        binary = Binary.filter_by(ref='firefly').one()
+        assert binary.checksum == checksum
+        assert binary.size == 13
+        assert open(binary.path).read() == 'hello tharrrr'
+
+    def test_known_content_is_linked(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        session.app.post_json(self.target, params={'link': True, 'checksum': checksum})
+        binary = Binary.filter_by(ref='firefly').one()
+        assert os.path.samefile(binary.path, path)
+
+    def test_unknown_content_is_not_found(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.post_json(
+            self.target, params={'link': True, 'checksum': 'a' * 128}, expect_errors=True)
+        assert result.status_int == 404
+        assert Binary.filter_by(ref='firefly').count() == 0
+
+    def test_size_mismatch_is_not_found(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        result = session.app.post_json(
+            self.target,
+            params={'link': True, 'checksum': checksum, 'size': 1},
+            expect_errors=True)
+        assert result.status_int == 404
+
+    def test_missing_file_on_disk_is_not_found(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        os.remove(path)
+        result = session.app.post_json(
+            self.target, params={'link': True, 'checksum': checksum}, expect_errors=True)
+        assert result.status_int == 404
+
+    def test_existing_binary_requires_force(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        result = session.app.post_json(
+            self.url + 'ceph-9.0.0-0.el6.x86_64.rpm/',
+            params={'link': True, 'checksum': checksum},
+            expect_errors=True)
+        assert result.status_int == 400
+
+    def test_marks_the_repo_to_be_built(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        session.app.post_json(self.target, params={'link': True, 'checksum': checksum})
+        binary = Binary.filter_by(ref='firefly').one()
+        assert binary.repo.needs_update is True
+
+    def test_checksum_requires_the_link_key(self, session, tmpdir):
+        checksum, path = self.upload(session, tmpdir)
+        # metadata updates that include the checksum keep working as before
+        result = session.app.post_json(
+            self.url + 'ceph-9.0.0-0.el6.x86_64.rpm/',
+            params={'checksum': checksum, 'force': True, 'built_by': 'alfredo'})
+        assert result.status_int == 200
+        binary = Binary.get(1)
+        assert binary.built_by == 'alfredo'
+        assert binary.path == path
+
+    def test_link_requires_a_checksum(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.post_json(
+            self.target, params={'link': True}, expect_errors=True)
+        assert result.status_int == 400
+
+    @py.test.mark.parametrize('checksum', ['../../../etc/passwd', 'A' * 128, 'a' * 127])
+    def test_invalid_checksum_is_rejected(self, session, tmpdir, checksum):
+        self.upload(session, tmpdir)
+        pecan.conf.blob_root = str(tmpdir.join('blobs'))
+        try:
+            result = session.app.post_json(
+                self.target,
+                params={'link': True, 'checksum': checksum},
+                expect_errors=True)
+        finally:
+            pecan.conf.blob_root = None
+        assert result.status_int == 400
+        assert Binary.filter_by(ref='firefly').count() == 0
+
+
+class TestUploadHandoff(object):
+
+    def setup(self):
+        self.url = '/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/'
+
+    def spool(self, tmpdir, contents='hello tharrrr'):
+        pecan.conf.binary_root = str(tmpdir.join('binaries'))
+        pecan.conf.upload_spool_root = str(tmpdir.join('spool'))
+        spooled = tmpdir.join('spool', '0000000001')
+        spooled.write(contents, ensure=True)
+        return spooled
+
+    def teardown(self):
+        pecan.conf.upload_spool_root = None
+
+    def post(self, session, path, url=None, **kw):
+        return session.app.post(
+            url or self.url,
+            headers={
+                'Authorization': util.make_credentials(),
+                'X-Upload-File': str(path),
+            },
+            **kw
+        )
+
+    def test_spooled_file_creates_binary(self, session, tmpdir):
+        spooled = self.spool(tmpdir)
+        result = self.post(session, spooled)
+        assert result.status_int == 201
+        binary = Binary.query.one()
+        assert binary.size == 13
+        assert binary.checksum.startswith('318b')
+        assert open(binary.path).read() == 'hello tharrrr'
+        assert binary.path == str(tmpdir.join(
+            'binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm'))
+
+    def test_spooled_file_is_moved(self, session, tmpdir):
+        spooled = self.spool(tmpdir)
+        self.post(session, spooled)
+        assert not spooled.check()
+
+    def test_existing_binary_requires_force(self, session, tmpdir):
+        self.post(session, self.spool(tmpdir))
+        spooled = self.spool(tmpdir, 'something changed')
+        result = self.post(session, spooled, expect_errors=True)
+        assert result.status_int == 400
+        assert not spooled.check()
+
+    def test_forced_upload_updates_binary(self, session, tmpdir):
+        self.post(session, self.spool(tmpdir))
+        spooled = self.spool(tmpdir, 'something changed')
+        result = self.post(session, spooled, url=self.url + '?force=1')
+        assert result.status_int == 200
+        binary = Binary.query.one()
+        assert binary.checksum.startswith('a5725e467')
+        assert open(binary.path).read() == 'something changed'
+
+    def test_file_outside_spool_is_invalid(self, session, tmpdir):
+        self.spool(tmpdir)
+        other = tmpdir.join('other')
+        other.write('hello tharrrr')
+        result = self.post(session, other, expect_errors=True)
+        assert result.status_int == 400
+        assert other.check()
+        assert Binary.query.count() == 0
+
+    def test_failed_authentication_removes_spooled_file(self, session, tmpdir):
+        spooled = self.spool(tmpdir)
+        result = session.app.post(
+            self.url,
+            headers={
+                'Authorization': util.make_credentials(correct=False),
+                'X-Upload-File': str(spooled),
+            },
+            expect_errors=True,
+        )
+        assert result.status_int == 401
+        assert not spooled.check()
+
+    def test_handoff_must_be_enabled(self, session, tmpdir):
+        spooled = self.spool(tmpdir)
+        pecan.conf.upload_spool_root = None
+        result = self.post(session, spooled, expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+
 class TestRelatedProjects(object):
 
     @py.test.mark.parametrize(
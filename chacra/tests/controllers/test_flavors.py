@@ -162,6 +162,39 @@ class TestFlavorController(object):
             '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/default/', expect_errors=True)
         assert result.status_int == 404
 
+    def test_flavor_found_with_head(self, session):
+        project = Project('ceph')
+        Binary(
+            'ceph-1.0.0.rpm',
+            project,
+            ref='giant',
+            sha1="head",
+            distro='centos',
+            distro_version='el6',
+            arch='x86_64'
+        )
+        session.commit()
+        result = session.app.head(
+            '/binaries/ceph/giant/head/centos/el6/x86_64/flavors/default/')
+        assert result.status_int == 200
+
+    def test_unknown_flavor_not_found(self, session):
+        project = Project('ceph')
+        Binary(
+            'ceph-1.0.0.rpm',
+            project,
+            ref='giant',
+            sha1="head",
+            distro='centos',
+            distro_version='el6',
+            arch='x86_64'
+        )
+        session.commit()
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el6/x86_64/flavors/tcmalloc/',
+            expect_errors=True)
+        assert result.status_int == 404
+
     def test_single_flavor_should_have_one_item(self, session):
         p = Project('ceph')
         Binary(
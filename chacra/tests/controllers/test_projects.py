@@ -31,6 +31,26 @@ class TestProjectsController(object):
         assert result.status_int == 200
         assert len(json) == 20
 
+    def test_listing_can_be_cached_briefly(self, session):
+        result = session.app.get('/binaries/')
+        assert result.headers['Cache-Control'] == 'public, max-age=60, must-revalidate'
+        assert result.headers['ETag']
+
+    def test_unchanged_listing_is_not_modified(self, session):
+        Project('foobar')
+        session.commit()
+        etag = session.app.get('/binaries/').headers['ETag']
+        result = session.app.get('/binaries/', headers={'If-None-Match': etag})
+        assert result.status_int == 304
+
+    def test_changed_listing_is_sent_again(self, session):
+        etag = session.app.get('/binaries/').headers['ETag']
+        Project('foobar')
+        session.commit()
+        result = session.app.get('/binaries/', headers={'If-None-Match': etag})
+        assert result.status_int == 200
+        assert result.json == {'foobar': []}
+
     def test_create_project(self, session):
         session.app.post('/binaries/rhcs-ceph/')
         result = session.app.get('/binaries/rhcs-ceph/')
@@ -0,0 +1,147 @@
+import py.test
+
+from chacra import storage
+from chacra.models import Binary, Repo
+from chacra.tests import util
+
+
+base_urls = [
+    '/binaries/ceph/giant/head/centos/el7/x86_64/register/',
+    '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/default/register/',
+]
+
+
+@py.test.fixture
+def paths(tmpdir):
+    rpm = tmpdir.join('ceph-9.0.0-0.el7.x86_64.rpm')
+    rpm.write('hello tharrrr')
+    common = tmpdir.join('ceph-common-9.0.0-0.el7.x86_64.rpm')
+    common.write('something changed')
+    return [str(rpm), str(common)]
+
+
+def register(session, url, binaries, **kw):
+    return session.app.post_json(
+        url,
+        params=dict(binaries=binaries, **kw.pop('body', {})),
+        headers={'Authorization': util.make_credentials()},
+        **kw
+    )
+
+
+class TestRegisterController(object):
+
+    @py.test.mark.parametrize('url', base_urls)
+    def test_registers_every_binary(self, session, paths, url):
+        result = register(session, url, [{'path': p} for p in paths])
+        assert result.status_int == 201
+        assert sorted(result.json.keys()) == [
+            'ceph-9.0.0-0.el7.x86_64.rpm', 'ceph-common-9.0.0-0.el7.x86_64.rpm']
+        assert Binary.query.count() == 2
+
+    def test_binaries_share_one_repo(self, session, paths):
+        register(session, base_urls[0], [{'path': p} for p in paths])
+        assert Repo.query.count() == 1
+        repo = Repo.query.one()
+        assert repo.binaries.count() == 2
+        assert repo.type == 'rpm'
+
+    def test_size_and_checksum_are_computed(self, session, paths):
+        register(session, base_urls[0], [{'path': paths[0]}])
+        binary = Binary.query.one()
+        assert binary.path == paths[0]
+        assert binary.size == 13
+        assert binary.checksum.startswith('318b')
+        assert binary.created is not None
+
+    def test_matching_checksum_is_accepted(self, session, paths):
+        checksum = storage.checksum(paths[0])
+        result = register(session, base_urls[0], [{'path': paths[0], 'checksum': checksum}])
+        assert result.status_int == 201
+        assert Binary.query.one().checksum == checksum
+
+    def test_checksum_that_does_not_match_is_rejected(self, session, paths):
+        result = register(
+            session, base_urls[0],
+            [{'path': paths[0], 'checksum': storage.checksum(paths[1])}],
+            expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_invalid_checksum_is_rejected(self, session, paths):
+        result = register(
+            session, base_urls[0], [{'path': paths[0], 'checksum': 'abc'}],
+            expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_name_and_built_by(self, session, paths):
+        register(
+            session, base_urls[0],
+            [{'path': paths[0], 'name': 'ceph.rpm', 'built_by': 'alfredo'}])
+        binary = Binary.query.one()
+        assert binary.name == 'ceph.rpm'
+        assert binary.built_by == 'alfredo'
+
+    def test_plain_list_of_binaries(self, session, paths):
+        result = session.app.post_json(
+            base_urls[0],
+            params=[{'path': p} for p in paths],
+            headers={'Authorization': util.make_credentials()},
+        )
+        assert result.status_int == 201
+        assert Binary.query.count() == 2
+
+    def test_missing_file_registers_nothing(self, session, paths, tmpdir):
+        missing = str(tmpdir.join('missing.rpm'))
+        result = register(
+            session, base_urls[0], [{'path': paths[0]}, {'path': missing}],
+            expect_errors=True)
+        assert result.status_int == 400
+        assert 'missing.rpm' in result.json['message']
+        assert Binary.query.count() == 0
+
+    def test_missing_path_is_invalid(self, session):
+        result = register(
+            session, base_urls[0], [{'name': 'ceph.rpm'}], expect_errors=True)
+        assert result.status_int == 400
+
+    def test_no_binaries_is_invalid(self, session):
+        result = register(session, base_urls[0], [], expect_errors=True)
+        assert result.status_int == 400
+
+    def test_duplicate_names_are_invalid(self, session, paths):
+        result = register(
+            session, base_urls[0], [{'path': paths[0]}, {'path': paths[0]}],
+            expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_existing_binaries_require_force(self, session, paths):
+        register(session, base_urls[0], [{'path': paths[0]}])
+        result = register(
+            session, base_urls[0], [{'path': p} for p in paths], expect_errors=True)
+        assert result.status_int == 400
+        assert 'force' in result.json['message']
+        assert Binary.query.count() == 1
+
+    def test_forced_register_updates_binaries(self, session, paths):
+        register(session, base_urls[0], [{'path': paths[0], 'built_by': 'alfredo'}])
+        result = register(
+            session, base_urls[0],
+            [{'path': paths[1], 'name': 'ceph-9.0.0-0.el7.x86_64.rpm'}],
+            body={'force': True})
+        assert result.status_int == 200
+        binary = Binary.query.one()
+        assert binary.path == paths[1]
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.built_by == 'alfredo'
+
+    def test_auth_fails(self, session, paths):
+        result = session.app.post_json(
+            base_urls[0],
+            params=dict(binaries=[{'path': p} for p in paths]),
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True
+        )
+        assert result.status_int == 401
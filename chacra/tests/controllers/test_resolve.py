@@ -0,0 +1,107 @@
+import pecan
+import py.test
+
+from chacra.models import Project, Binary
+from chacra.controllers import resolve
+
+
+class TestPathParts(object):
+
+    def test_trailing_slash_is_removed(self):
+        assert resolve.path_parts(('giant', 'head', '')) == ['giant', 'head']
+
+    def test_empty_components_are_rejected(self):
+        assert resolve.path_parts(('giant', '', 'head')) is None
+
+
+class TestResolvedBinaries(object):
+
+    def upload(self, session, tmpdir, url='/binaries/ceph/giant/head/centos/el7/x86_64/'):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            url,
+            upload_files=[('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr')]
+        )
+
+    def test_downloads_binary(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/ceph-9.0.0-0.el7.x86_64.rpm/')
+        assert result.body == 'hello tharrrr'
+
+    def test_binary_without_trailing_slash_redirects(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/ceph-9.0.0-0.el7.x86_64.rpm')
+        assert result.status_int == 302
+        assert result.follow().body == 'hello tharrrr'
+
+    def test_downloads_flavored_binary(self, session, tmpdir):
+        self.upload(
+            session, tmpdir,
+            url='/binaries/ceph/giant/head/centos/el7/x86_64/flavors/tcmalloc/')
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/tcmalloc/'
+            'ceph-9.0.0-0.el7.x86_64.rpm/')
+        assert result.body == 'hello tharrrr'
+
+    def test_wrong_flavor_is_not_found(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/tcmalloc/'
+            'ceph-9.0.0-0.el7.x86_64.rpm/',
+            expect_errors=True)
+        assert result.status_int == 404
+
+    def test_missing_binary_is_not_found(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/ceph-1.0.rpm/',
+            expect_errors=True)
+        assert result.status_int == 404
+
+    def test_arch_listing_is_not_resolved(self, session, tmpdir):
+        self.upload(session, tmpdir)
+        result = session.app.get('/binaries/ceph/giant/head/centos/el7/x86_64/')
+        assert result.json.keys() == ['ceph-9.0.0-0.el7.x86_64.rpm']
+
+
+class TestResolvedRepos(object):
+
+    def create_binary(self, session):
+        p = Project('foobar')
+        Binary(
+            'ceph-1.0.rpm',
+            p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            sha1="head",
+            ref="firefly",
+        )
+        session.commit()
+
+    @py.test.mark.parametrize('url', [
+        '/repos/foobar/firefly/head/centos/7/',
+        '/repos/foobar/firefly/head/centos/7/flavors/default/',
+    ])
+    def test_repo(self, session, url):
+        self.create_binary(session)
+        result = session.app.get(url)
+        assert result.json['distro_version'] == '7'
+
+    def test_repo_subpath(self, session):
+        self.create_binary(session)
+        result = session.app.get('/repos/foobar/firefly/head/centos/7/repo/')
+        assert '[foobar]' in result.body
+
+    def test_missing_repo_is_not_found(self, session):
+        self.create_binary(session)
+        result = session.app.get(
+            '/repos/foobar/firefly/head/centos/6/', expect_errors=True)
+        assert result.status_int == 404
+
+    def test_flavors_listing_is_not_resolved(self, session):
+        self.create_binary(session)
+        result = session.app.get('/repos/foobar/firefly/head/centos/7/flavors/')
+        assert result.json == ['default']
@@ -0,0 +1,229 @@
+import os
+import pecan
+import py.test
+
+from chacra.models import Binary
+from chacra.tests import util
+
+
+base_urls = [
+    '/binaries/ceph/giant/head/centos/el7/x86_64/uploads/',
+    '/binaries/ceph/giant/head/centos/el7/x86_64/flavors/default/uploads/',
+]
+
+
+def headers(**kw):
+    headers = {'Authorization': util.make_credentials()}
+    headers.update(kw)
+    return headers
+
+
+def open_upload(session, url, **kw):
+    data = {'name': 'ceph-9.0.0-0.el7.x86_64.rpm'}
+    data.update(kw)
+    return session.app.post_json(url, params=data).json
+
+
+def put_chunk(session, url, body, start=None, total='*', **kw):
+    extra = {}
+    if start is not None:
+        extra['Content-Range'] = 'bytes %s-%s/%s' % (start, start + len(body) - 1, total)
+    return session.app.put(
+        url,
+        params=body,
+        content_type='application/octet-stream',
+        headers=headers(**extra),
+        **kw
+    )
+
+
+class TestUploadsController(object):
+
+    @py.test.mark.parametrize('url', base_urls)
+    def test_open_upload(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(url, params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm'})
+        assert result.status_int == 201
+        assert result.json['offset'] == 0
+        assert result.json['name'] == 'ceph-9.0.0-0.el7.x86_64.rpm'
+
+    def test_open_upload_requires_a_name(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(base_urls[0], params={}, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_open_upload_rejects_paths_in_name(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            base_urls[0], params={'name': '../../etc/passwd'}, expect_errors=True)
+        assert result.status_int == 400
+
+    @py.test.mark.parametrize('size', [-1, '13', 1.5, True])
+    def test_open_upload_rejects_invalid_sizes(self, session, tmpdir, size):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            base_urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'size': size},
+            expect_errors=True)
+        assert result.status_int == 400
+
+    @py.test.mark.parametrize('url', base_urls)
+    def test_status_of_upload_without_binaries(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, url, size=13)
+        result = session.app.get(url + upload['id'] + '/')
+        assert result.json['offset'] == 0
+        assert result.json['size'] == 13
+
+    def test_open_upload_for_existing_binary_requires_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr')]
+        )
+        result = session.app.post_json(
+            base_urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm'},
+            expect_errors=True)
+        assert result.status_int == 400
+
+    def test_auth_fails(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            base_urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm'},
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True)
+        assert result.status_int == 401
+
+
+class TestUploadController(object):
+
+    @py.test.mark.parametrize('url', base_urls)
+    def test_upload_in_chunks(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, url, size=13)
+        upload_url = url + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ', start=0, total=13)
+        result = put_chunk(session, upload_url, 'tharrrr', start=6, total=13)
+        assert result.json['offset'] == 13
+        result = session.app.post_json(upload_url, params={})
+        assert result.status_int == 201
+        binary = Binary.get(1)
+        assert binary.size == 13
+        assert binary.checksum.startswith('318b')
+        assert open(binary.path).read() == 'hello tharrrr'
+
+    def test_binary_is_created_in_the_url_layout(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello tharrrr')
+        session.app.post_json(upload_url, params={})
+        binary = Binary.get(1)
+        assert binary.path == os.path.join(
+            str(tmpdir),
+            'ceph/giant/head/centos/el7/x86_64/ceph-9.0.0-0.el7.x86_64.rpm')
+
+    def test_chunks_without_range_are_appended(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ')
+        result = put_chunk(session, upload_url, 'tharrrr')
+        assert result.json['offset'] == 13
+
+    def test_out_of_sync_chunk_reports_offset(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ', start=0)
+        result = put_chunk(session, upload_url, 'rrr', start=10, expect_errors=True)
+        assert result.status_int == 409
+        assert result.json['offset'] == 6
+
+    def test_empty_put_reports_offset(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ', start=0)
+        result = put_chunk(session, upload_url, '')
+        assert result.json['offset'] == 6
+
+    def test_range_past_size_is_invalid(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0], size=3)
+        upload_url = base_urls[0] + upload['id'] + '/'
+        result = put_chunk(session, upload_url, 'hello ', start=0, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_body_longer_than_range_is_invalid(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0], size=13)
+        upload_url = base_urls[0] + upload['id'] + '/'
+        result = session.app.put(
+            upload_url,
+            params='hello tharrrr',
+            content_type='application/octet-stream',
+            headers=headers(**{'Content-Range': 'bytes 0-5/13'}),
+            expect_errors=True)
+        assert result.status_int == 400
+        assert session.app.get(upload_url).json['offset'] == 0
+
+    def test_chunk_without_range_past_size_is_invalid(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0], size=3)
+        upload_url = base_urls[0] + upload['id'] + '/'
+        result = put_chunk(session, upload_url, 'hello ', expect_errors=True)
+        assert result.status_int == 400
+        assert session.app.get(upload_url).json['offset'] == 0
+
+    def test_incomplete_upload_cannot_be_finalized(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0], size=13)
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ', start=0)
+        result = session.app.post_json(upload_url, params={}, expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_checksum_mismatch_is_rejected(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello tharrrr')
+        result = session.app.post_json(
+            upload_url, params={'checksum': 'a5725e467'}, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_forced_upload_updates_binary(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/centos/el7/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el7.x86_64.rpm', 'hello tharrrr')]
+        )
+        upload = open_upload(session, base_urls[0], force=True)
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'something changed')
+        result = session.app.post_json(upload_url, params={})
+        assert result.status_int == 200
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.size == 17
+
+    def test_unknown_upload_is_not_found(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        open_upload(session, base_urls[0])
+        result = put_chunk(
+            session, base_urls[0] + 'f' * 32 + '/', 'hello', expect_errors=True)
+        assert result.status_int == 404
+
+    def test_upload_can_be_discarded(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload = open_upload(session, base_urls[0])
+        upload_url = base_urls[0] + upload['id'] + '/'
+        put_chunk(session, upload_url, 'hello ')
+        result = session.app.delete(upload_url)
+        assert result.status_int == 204
+        directory = tmpdir.join('ceph/giant/head/centos/el7/x86_64')
+        assert directory.listdir() == []
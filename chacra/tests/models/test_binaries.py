@@ -1,3 +1,5 @@
+import py.test
+from sqlalchemy.exc import IntegrityError
 from chacra.models import Binary, Project, Repo
 
 
@@ -180,3 +182,226 @@ class TestGenericBinaries(object):
             arch='amd64',
             )
         assert binary.repo.is_generic is False
+
+
+class TestBinaryChecksum(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def test_checksum_is_computed_from_path(self, session, tmpdir):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            )
+        session.commit()
+        assert binary.checksum.startswith('318b')
+
+    def test_handed_checksum_is_not_recomputed(self, session, tmpdir, monkeypatch):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+
+        def fail(path):
+            raise AssertionError('checksum should not be recomputed')
+        monkeypatch.setattr('chacra.storage.checksum', fail)
+        binary = Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            checksum='318b',
+            size=13,
+            )
+        session.commit()
+        assert binary.checksum == '318b'
+
+    def test_handed_checksum_on_update_is_not_recomputed(self, session, tmpdir, monkeypatch):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            )
+        session.commit()
+
+        def fail(path):
+            raise AssertionError('checksum should not be recomputed')
+        monkeypatch.setattr('chacra.storage.checksum', fail)
+        binary = Binary.get(1)
+        binary.set_content(str(path), 'a5725e467', 13)
+        session.commit()
+        assert Binary.get(1).checksum == 'a5725e467'
+
+    def test_checksum_from_json_is_recomputed(self, session, tmpdir):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            )
+        session.commit()
+        binary = Binary.get(1)
+        binary.update_from_json(
+            {'checksum': 'a5725e467', '_content_checksum': 'a5725e467'})
+        session.commit()
+        assert Binary.get(1).checksum.startswith('318b')
+
+    def test_checksum_is_recomputed_when_path_changes(self, session, tmpdir):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        new_path = tmpdir.join('ceph-1.1.rpm')
+        new_path.write('something changed')
+        binary = Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            )
+        session.commit()
+        binary = Binary.get(1)
+        binary.path = str(new_path)
+        session.commit()
+        assert Binary.get(1).checksum.startswith('a5725e467')
+
+
+class TestBinaryContentChanged(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def create_binary(self, session, path):
+        Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=str(path),
+            size=path.size(),
+            )
+        session.commit()
+        return Binary.get(1)
+
+    def test_metadata_changes_do_not_recompute(self, session, tmpdir, monkeypatch):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = self.create_binary(session, path)
+
+        def fail(path):
+            raise AssertionError('checksum should not be recomputed')
+        monkeypatch.setattr('chacra.storage.checksum', fail)
+        binary.built_by = 'alfredo'
+        binary.signed = True
+        session.commit()
+        assert Binary.get(1).checksum.startswith('318b')
+
+    def test_same_path_does_not_recompute(self, session, tmpdir, monkeypatch):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = self.create_binary(session, path)
+
+        def fail(path):
+            raise AssertionError('checksum should not be recomputed')
+        monkeypatch.setattr('chacra.storage.checksum', fail)
+        binary.update_from_json({'path': str(path), 'built_by': 'alfredo'})
+        session.commit()
+        assert Binary.get(1).checksum.startswith('318b')
+
+    def test_different_size_recomputes(self, session, tmpdir):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = self.create_binary(session, path)
+        path.write('something changed')
+        binary.built_by = 'alfredo'
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.size == 17
+
+    def test_newer_file_recomputes(self, session, tmpdir):
+        path = tmpdir.join('ceph-1.0.rpm')
+        path.write('hello tharrrr')
+        binary = self.create_binary(session, path)
+        # same size, but written after the binary was saved
+        path.write('hello therrrr')
+        path.setmtime(path.mtime() + 3600)
+        binary.built_by = 'alfredo'
+        session.commit()
+        assert not Binary.get(1).checksum.startswith('318b')
+
+
+class TestGeneration(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def test_changes_with_the_content(self, session):
+        binary = Binary(
+            'ceph-1.0.rpm', self.p, distro='centos', distro_version='7',
+            arch='x86_64', checksum='a' * 128)
+        session.commit()
+        generation = binary.generation
+        binary.checksum = 'b' * 128
+        session.commit()
+        assert binary.generation != generation
+
+    def test_no_content_has_no_generation(self, session):
+        binary = Binary(
+            'ceph-1.0.rpm', self.p, distro='centos', distro_version='7',
+            arch='x86_64')
+        session.commit()
+        assert binary.generation is None
+
+
+class TestExists(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def test_exists(self, session):
+        Binary('ceph-1.0.rpm', self.p, distro='centos', distro_version='7', arch='x86_64')
+        session.commit()
+        assert Binary.exists(project=self.p, distro='centos', arch='x86_64') is True
+
+    def test_does_not_exist(self, session):
+        Binary('ceph-1.0.rpm', self.p, distro='centos', distro_version='7', arch='x86_64')
+        session.commit()
+        assert Binary.exists(project=self.p, distro='centos', arch='aarch64') is False
+
+
+class TestIdentity(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+
+    def test_duplicate_binaries_are_rejected(self, session):
+        Binary('ceph-1.0.rpm', self.p, ref='jewel', distro='centos', distro_version='7', arch='x86_64')
+        session.flush()
+        with py.test.raises(IntegrityError):
+            # looking up the repo autoflushes the duplicate
+            Binary('ceph-1.0.rpm', self.p, ref='jewel', distro='centos', distro_version='7', arch='x86_64')
+            session.flush()
+
+    def test_same_name_in_another_arch(self, session):
+        Binary('ceph-1.0.rpm', self.p, ref='jewel', distro='centos', distro_version='7', arch='x86_64')
+        Binary('ceph-1.0.rpm', self.p, ref='jewel', distro='centos', distro_version='7', arch='aarch64')
+        session.commit()
+        assert Binary.query.count() == 2
@@ -0,0 +1,77 @@
+from chacra.models import Binary, Project, Repo, projects
+
+
+def binary(name, project, ref='master', sha1='head', distro='centos'):
+    return Binary(
+        name, project, ref=ref, sha1=sha1, distro=distro,
+        distro_version='7', arch='x86_64')
+
+
+class TestGroupPairs(object):
+
+    def test_groups_values_by_key(self):
+        result = projects.group_pairs([('a', 1), ('b', 2), ('a', 3)])
+        assert result == {'a': [1, 3], 'b': [2]}
+
+    def test_none_values_are_empty(self):
+        assert projects.group_pairs([('a', None)]) == {'a': []}
+
+
+class TestRefsByProject(object):
+
+    def test_project_without_binaries(self, session):
+        Project('ceph')
+        session.commit()
+        assert projects.refs_by_project() == {'ceph': []}
+
+    def test_refs_are_distinct(self, session):
+        p = Project('ceph')
+        binary('ceph-1.0.rpm', p)
+        binary('ceph-common-1.0.rpm', p)
+        binary('ceph-1.0.rpm', p, ref='jewel')
+        session.commit()
+        assert sorted(projects.refs_by_project()['ceph']) == ['jewel', 'master']
+
+    def test_several_projects(self, session):
+        binary('ceph-1.0.rpm', Project('ceph'))
+        binary('ceph-deploy-1.0.rpm', Project('ceph-deploy'), ref='1.5')
+        session.commit()
+        assert projects.refs_by_project() == {
+            'ceph': ['master'], 'ceph-deploy': ['1.5']}
+
+    def test_repo_refs(self, session):
+        p = Project('ceph')
+        Repo(p, 'jewel', 'centos', '7')
+        Project('ceph-deploy')
+        session.commit()
+        assert projects.repo_refs_by_project() == {
+            'ceph': ['jewel'], 'ceph-deploy': []}
+
+
+class TestProjectJSON(object):
+
+    def test_sha1s_by_ref(self, session):
+        p = Project('ceph')
+        binary('ceph-1.0.rpm', p, sha1='aaaa')
+        binary('ceph-common-1.0.rpm', p, sha1='aaaa')
+        binary('ceph-1.0.rpm', p, sha1='bbbb', distro='ubuntu')
+        session.commit()
+        result = Project.get(p.id).__json__()
+        assert sorted(result['master']) == ['aaaa', 'bbbb']
+
+    def test_column_values(self, session):
+        p = Project('ceph')
+        binary('ceph-1.0.rpm', p, distro='centos')
+        binary('ceph-1.0.deb', p, distro='ubuntu')
+        session.commit()
+        assert sorted(p.distros) == ['centos', 'ubuntu']
+        assert p.archs == ['x86_64']
+
+    def test_values_of_a_project_that_was_not_flushed(self, session):
+        p = Project('ceph')
+        binary('ceph-1.0.rpm', p)
+        Repo(p, 'jewel', 'centos', '7')
+        # the queries flush the pending objects before running
+        assert p.archs == ['x86_64']
+        assert sorted(p.repo_refs) == ['jewel', 'master']
+        assert p.__json__() == {'master': ['head']}
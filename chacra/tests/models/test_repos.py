@@ -1,3 +1,4 @@
+import datetime
 from chacra.models import Project, Repo, Binary
 
 
@@ -123,3 +124,49 @@ class TestRepoMetricNames(object):
         session.commit()
         result = Repo.get(1).metric_name
         assert result == "repos.ceph.ubuntu.trusty"
+
+
+class TestRepoSettleTime(object):
+
+    def setup(self):
+        self.p = Project('ceph')
+        self.repo = Repo(
+            self.p,
+            ref='firefly',
+            distro='centos',
+            distro_version='7',
+        )
+        self.now = datetime.datetime.utcnow()
+
+    def test_marking_sets_the_times(self, session):
+        self.repo.needs_update = True
+        assert self.repo.dirtied is not None
+        assert self.repo.dirty_since == self.repo.dirtied
+
+    def test_marking_again_keeps_the_first_time(self, session):
+        self.repo.needs_update = True
+        first = self.repo.dirty_since
+        self.repo.needs_update = True
+        assert self.repo.dirty_since == first
+        assert self.repo.dirtied >= first
+
+    def test_building_resets_the_first_time(self, session):
+        self.repo.needs_update = True
+        self.repo.needs_update = False
+        assert self.repo.dirty_since is None
+
+    def test_never_marked(self, session):
+        assert self.repo.settle_time(30, 300, now=self.now) == 0
+
+    def test_waits_for_quiet_time(self, session):
+        self.repo.dirtied = self.repo.dirty_since = self.now - datetime.timedelta(seconds=10)
+        assert self.repo.settle_time(30, 300, now=self.now) == 20
+
+    def test_quiet_already(self, session):
+        self.repo.dirtied = self.repo.dirty_since = self.now - datetime.timedelta(seconds=40)
+        assert self.repo.settle_time(30, 300, now=self.now) == 0
+
+    def test_wait_is_limited(self, session):
+        self.repo.dirty_since = self.now - datetime.timedelta(seconds=290)
+        self.repo.dirtied = self.now - datetime.timedelta(seconds=1)
+        assert self.repo.settle_time(30, 300, now=self.now) == 10
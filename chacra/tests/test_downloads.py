@@ -0,0 +1,98 @@
+import pecan
+import pytest
+
+from chacra import downloads
+
+
+class FakeResponse(object):
+
+    def __init__(self):
+        self.headers = {}
+
+
+@pytest.fixture(autouse=True)
+def conf(request):
+    pecan.conf.binary_root = '/opt/binaries'
+
+    def teardown():
+        pecan.conf.download_offload = None
+        pecan.conf.download_locations = None
+        pecan.conf.delegate_downloads = False
+    request.addfinalizer(teardown)
+    return pecan.conf
+
+
+class TestBackendName(object):
+
+    def test_internal_by_default(self, conf):
+        conf.delegate_downloads = False
+        assert downloads.backend_name() == 'internal'
+
+    def test_delegate_downloads_uses_nginx(self, conf):
+        conf.delegate_downloads = True
+        assert downloads.backend_name() == 'x-accel-redirect'
+
+    def test_configured_backend(self, conf):
+        conf.delegate_downloads = True
+        conf.download_offload = 'x-sendfile'
+        assert downloads.backend_name() == 'x-sendfile'
+
+
+class TestInternalLocation(object):
+
+    def test_defaults_to_binary_root(self):
+        result = downloads.internal_location('/opt/binaries/ceph/master/ceph.rpm')
+        assert result == '/b/ceph/master/ceph.rpm'
+
+    def test_path_outside_of_locations(self):
+        assert downloads.internal_location('/tmp/ceph.rpm') is None
+
+    def test_partial_directory_names_do_not_match(self):
+        assert downloads.internal_location('/opt/binaries2/ceph.rpm') is None
+
+    def test_several_locations(self, conf):
+        conf.download_locations = {
+            '/opt/binaries': '/b/',
+            '/mnt/disk2': '/b2/',
+            '__force_dict__': True,
+        }
+        result = downloads.internal_location('/mnt/disk2/ceph/ceph.rpm')
+        assert result == '/b2/ceph/ceph.rpm'
+
+    def test_nested_locations_match_the_longest(self, conf):
+        conf.download_locations = {
+            '/opt/binaries': '/b/',
+            '/opt/binaries/ceph': '/ceph/',
+            '__force_dict__': True,
+        }
+        result = downloads.internal_location('/opt/binaries/ceph/ceph.rpm')
+        assert result == '/ceph/ceph.rpm'
+
+
+class TestOffload(object):
+
+    def test_x_accel_redirect(self, conf):
+        conf.download_offload = 'x-accel-redirect'
+        response = FakeResponse()
+        assert downloads.offload('/opt/binaries/ceph.rpm', response) is True
+        assert response.headers == {'X-Accel-Redirect': '/b/ceph.rpm'}
+
+    def test_x_accel_redirect_falls_back_outside_locations(self, conf):
+        conf.download_offload = 'x-accel-redirect'
+        response = FakeResponse()
+        assert downloads.offload('/tmp/ceph.rpm', response) is False
+        assert response.headers == {}
+
+    def test_x_sendfile(self, conf):
+        conf.download_offload = 'x-sendfile'
+        response = FakeResponse()
+        assert downloads.offload('/tmp/ceph.rpm', response) is True
+        assert response.headers == {'X-Sendfile': '/tmp/ceph.rpm'}
+
+    def test_internal(self, conf):
+        conf.download_offload = 'internal'
+        assert downloads.offload('/opt/binaries/ceph.rpm', FakeResponse()) is False
+
+    def test_unknown_backend_is_served_internally(self, conf):
+        conf.download_offload = 'carrier-pigeon'
+        assert downloads.offload('/opt/binaries/ceph.rpm', FakeResponse()) is False
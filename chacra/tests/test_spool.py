@@ -0,0 +1,47 @@
+import pecan
+import pytest
+
+from chacra import spool
+
+
+class TestSpoolCleanup(object):
+
+    @pytest.fixture(autouse=True)
+    def spool_root(self, tmpdir):
+        previous = getattr(pecan.conf, 'upload_spool_root', None)
+        pecan.conf.upload_spool_root = str(tmpdir.join('spool'))
+        try:
+            yield
+        finally:
+            pecan.conf.upload_spool_root = previous
+
+    def call(self, app, path):
+        environ = {'HTTP_X_UPLOAD_FILE': str(path)}
+        return spool.SpoolCleanup(app)(environ, lambda status, headers: None)
+
+    def test_file_is_removed_when_the_request_fails(self, tmpdir):
+        spooled = tmpdir.join('spool', '0000000001')
+        spooled.write('hello tharrrr', ensure=True)
+
+        def app(environ, start_response):
+            raise RuntimeError('boom')
+        with pytest.raises(RuntimeError):
+            self.call(app, spooled)
+        assert not spooled.check()
+
+    def test_adopted_file_is_not_touched(self, tmpdir):
+        spooled = tmpdir.join('spool', '0000000001')
+        spooled.write('hello tharrrr', ensure=True)
+        destination = tmpdir.join('ceph-1.0.rpm')
+
+        def app(environ, start_response):
+            spooled.move(destination)
+            return ['{}']
+        assert self.call(app, spooled) == ['{}']
+        assert destination.check()
+
+    def test_files_outside_the_spool_are_not_removed(self, tmpdir):
+        other = tmpdir.join('other')
+        other.write('hello tharrrr')
+        self.call(lambda environ, start_response: [], other)
+        assert other.check()
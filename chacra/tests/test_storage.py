@@ -0,0 +1,307 @@
+import os
+import time
+from StringIO import StringIO
+
+import pytest
+
+from chacra import storage
+
+
+class TestChecksum(object):
+
+    def test_computes_sha512(self, tmpdir):
+        binary = tmpdir.join('ceph-1.0.rpm')
+        binary.write('hello tharrrr')
+        result = storage.checksum(str(binary))
+        assert len(result) == 128
+        assert result.startswith('318b')
+
+    def test_reads_in_small_chunks(self, tmpdir):
+        binary = tmpdir.join('ceph-1.0.rpm')
+        binary.write('hello tharrrr')
+        result = storage.checksum(str(binary), chunk_size=2)
+        assert result.startswith('318b')
+
+
+class TestSave(object):
+
+    def test_writes_contents(self, tmpdir):
+        destination = str(tmpdir.join('ceph-1.0.rpm'))
+        storage.save(StringIO('hello tharrrr'), destination)
+        assert open(destination).read() == 'hello tharrrr'
+
+    def test_returns_checksum_and_size(self, tmpdir):
+        destination = str(tmpdir.join('ceph-1.0.rpm'))
+        checksum, size = storage.save(StringIO('hello tharrrr'), destination)
+        assert checksum.startswith('318b')
+        assert size == 13
+
+    def test_checksum_matches_file_on_disk(self, tmpdir):
+        destination = str(tmpdir.join('ceph-1.0.rpm'))
+        checksum, size = storage.save(
+            StringIO('hello tharrrr' * 1000), destination, chunk_size=7)
+        assert checksum == storage.checksum(destination)
+        assert size == 13000
+
+    def test_replaces_existing_file(self, tmpdir):
+        destination = tmpdir.join('ceph-1.0.rpm')
+        destination.write('hello tharrrr')
+        storage.save(StringIO('something changed'), str(destination))
+        assert destination.read() == 'something changed'
+
+    def test_leaves_no_temporary_files(self, tmpdir):
+        destination = str(tmpdir.join('ceph-1.0.rpm'))
+        storage.save(StringIO('hello tharrrr'), destination)
+        assert tmpdir.listdir() == [tmpdir.join('ceph-1.0.rpm')]
+
+    def test_failed_write_does_not_touch_destination(self, tmpdir, fake):
+        destination = tmpdir.join('ceph-1.0.rpm')
+        destination.write('hello tharrrr')
+
+        def read(size):
+            raise IOError('connection dropped')
+        with pytest.raises(IOError):
+            storage.save(fake(read=read), str(destination))
+        assert destination.read() == 'hello tharrrr'
+        assert tmpdir.listdir() == [destination]
+
+    def test_fsync_is_optional(self, tmpdir, monkeypatch):
+        calls = []
+        monkeypatch.setattr(storage.os, 'fsync', lambda fd: calls.append(fd))
+        storage.save(StringIO('hello tharrrr'), str(tmpdir.join('a.rpm')), fsync=False)
+        assert calls == []
+
+    def test_fsync_flushes_file_and_directory(self, tmpdir, monkeypatch):
+        calls = []
+        monkeypatch.setattr(storage.os, 'fsync', lambda fd: calls.append(fd))
+        storage.save(StringIO('hello tharrrr'), str(tmpdir.join('a.rpm')), fsync=True)
+        assert len(calls) == 2
+
+
+class TestLink(object):
+
+    def test_hardlinks_existing_content(self, tmpdir):
+        source = tmpdir.join('ceph-1.0.rpm')
+        source.write('hello tharrrr')
+        destination = tmpdir.join('ceph-1.0-copy.rpm')
+        storage.link(str(source), str(destination))
+        assert os.path.samefile(str(source), str(destination))
+
+    def test_copies_when_linking_fails(self, tmpdir, monkeypatch):
+        def link(source, destination):
+            raise OSError(18, 'Invalid cross-device link')
+        monkeypatch.setattr(storage.os, 'link', link)
+        source = tmpdir.join('ceph-1.0.rpm')
+        source.write('hello tharrrr')
+        destination = tmpdir.join('ceph-1.0-copy.rpm')
+        storage.link(str(source), str(destination))
+        assert destination.read() == 'hello tharrrr'
+        assert not os.path.samefile(str(source), str(destination))
+
+
+class TestAdopt(object):
+
+    def test_moves_file_into_place(self, tmpdir):
+        spooled = tmpdir.join('0000000001')
+        spooled.write('hello tharrrr')
+        destination = tmpdir.join('ceph-1.0.rpm')
+        storage.adopt(str(spooled), str(destination))
+        assert destination.read() == 'hello tharrrr'
+        assert not spooled.check()
+
+    def test_returns_checksum_and_size(self, tmpdir):
+        spooled = tmpdir.join('0000000001')
+        spooled.write('hello tharrrr')
+        checksum, size = storage.adopt(str(spooled), str(tmpdir.join('ceph-1.0.rpm')))
+        assert checksum.startswith('318b')
+        assert size == 13
+
+    def test_copies_across_filesystems(self, tmpdir, monkeypatch):
+        rename = os.rename
+        calls = []
+
+        def cross_device_rename(source, destination):
+            calls.append(source)
+            if len(calls) == 1:
+                raise OSError(18, 'Invalid cross-device link')
+            rename(source, destination)
+        monkeypatch.setattr(storage.os, 'rename', cross_device_rename)
+        spooled = tmpdir.join('0000000001')
+        spooled.write('hello tharrrr')
+        destination = tmpdir.join('ceph-1.0.rpm')
+        checksum, size = storage.adopt(str(spooled), str(destination))
+        assert destination.read() == 'hello tharrrr'
+        assert checksum.startswith('318b')
+        assert not spooled.check()
+
+
+class TestPartialUpload(object):
+
+    def test_create_starts_empty(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm', size=13)
+        assert upload.offset == 0
+        assert upload.name == 'ceph-1.0.rpm'
+        assert upload.size == 13
+        assert upload.exists()
+
+    def test_append_returns_new_offset(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        assert upload.append(StringIO('hello '), 0) == 6
+        assert upload.append(StringIO('tharrrr'), 6) == 13
+
+    def test_append_at_wrong_offset_is_refused(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        upload.append(StringIO('hello '), 0)
+        assert upload.append(StringIO('tharrrr'), 3) is None
+        assert upload.offset == 6
+
+    def test_checksum_is_carried_across_chunks(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        upload.append(StringIO('hello '), 0)
+        upload.append(StringIO('tharrrr'), 6)
+        assert upload.checksum().startswith('318b')
+
+    def test_checksum_across_processes(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        upload.append(StringIO('hello '), 0)
+        # as if the next chunk was handled by another process
+        upload = storage.PartialUpload(str(tmpdir), upload.id)
+        upload.append(StringIO('tharrrr'), 6)
+        assert upload.checksum().startswith('318b')
+
+    def test_append_reads_up_to_the_limit(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        assert upload.append(StringIO('hello tharrrr'), 0, limit=6) == 6
+
+    def test_bytes_are_kept_when_reading_fails(self, tmpdir, fake):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        chunks = ['hello ']
+
+        def read(size):
+            if chunks:
+                return chunks.pop()
+            raise IOError('connection dropped')
+        with pytest.raises(IOError):
+            upload.append(fake(read=read), 0)
+        assert upload.offset == 6
+        upload.append(StringIO('tharrrr'), 6)
+        assert upload.checksum().startswith('318b')
+
+    def test_publish_moves_file_and_cleans_up(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        upload.append(StringIO('hello tharrrr'), 0)
+        destination = tmpdir.join('ceph-1.0.rpm')
+        checksum, size = upload.publish(str(destination))
+        assert checksum.startswith('318b')
+        assert size == 13
+        assert destination.read() == 'hello tharrrr'
+        assert tmpdir.listdir() == [destination]
+
+
+class TestExpireUploads(object):
+
+    def age(self, path, seconds):
+        touched = time.time() - seconds
+        os.utime(path, (touched, touched))
+
+    def test_abandoned_uploads_are_removed(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        self.age(upload.path, 100)
+        self.age(upload.metadata_path, 100)
+        assert storage.expire_uploads(str(tmpdir), max_age=10) == 1
+        assert tmpdir.listdir() == []
+
+    def test_recent_chunks_keep_the_upload(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        # the metadata is only written when the upload is opened
+        self.age(upload.metadata_path, 100)
+        assert storage.expire_uploads(str(tmpdir), max_age=10) == 0
+        assert upload.exists()
+
+    def test_orphaned_metadata_is_removed(self, tmpdir):
+        upload = storage.PartialUpload.create(str(tmpdir), 'ceph-1.0.rpm')
+        os.remove(upload.path)
+        self.age(upload.metadata_path, 100)
+        assert storage.expire_uploads(str(tmpdir), max_age=10) == 1
+        assert tmpdir.listdir() == []
+
+    def test_binaries_are_left_alone(self, tmpdir):
+        binary = tmpdir.join('ceph-1.0.rpm')
+        binary.write('hello tharrrr')
+        self.age(str(binary), 100)
+        assert storage.expire_uploads(str(tmpdir), max_age=10) == 0
+        assert binary.check()
+
+
+class TestBlobStore(object):
+
+    @pytest.fixture(autouse=True)
+    def blob_root(self, tmpdir):
+        storage.conf.blob_root = str(tmpdir.join('blobs'))
+        yield
+        storage.conf.blob_root = None
+
+    def save(self, tmpdir, name, contents):
+        destination = tmpdir.join(name)
+        checksum, size = storage.save(StringIO(contents), str(destination))
+        return destination, checksum
+
+    def test_links_binary_into_the_store(self, tmpdir):
+        binary, checksum = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        blob = storage.blob_path(checksum)
+        assert os.path.samefile(str(binary), blob)
+        assert blob.endswith('/%s/%s/%s' % (checksum[:2], checksum[2:4], checksum))
+
+    def test_identical_uploads_share_the_content(self, tmpdir):
+        first, checksum = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        second, _ = self.save(tmpdir, 'ceph-1.0-copy.rpm', 'hello tharrrr')
+        assert os.path.samefile(str(first), str(second))
+        assert os.stat(str(first)).st_nlink == 3
+
+    def test_same_content_on_same_path_leaves_no_temporary_files(self, tmpdir):
+        self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        assert tmpdir.join('ceph-1.0.rpm').read() == 'hello tharrrr'
+        assert sorted(tmpdir.listdir()) == [tmpdir.join('blobs'), tmpdir.join('ceph-1.0.rpm')]
+
+    def test_different_content_is_not_shared(self, tmpdir):
+        first, _ = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        second, _ = self.save(tmpdir, 'ceph-2.0.rpm', 'something changed')
+        assert not os.path.samefile(str(first), str(second))
+
+    def test_remove_keeps_blob_while_in_use(self, tmpdir):
+        first, checksum = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        self.save(tmpdir, 'ceph-1.0-copy.rpm', 'hello tharrrr')
+        storage.remove(str(first), checksum)
+        assert os.path.exists(storage.blob_path(checksum))
+
+    def test_remove_releases_last_blob(self, tmpdir):
+        binary, checksum = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        storage.remove(str(binary), checksum)
+        assert not binary.check()
+        assert not os.path.exists(storage.blob_path(checksum))
+
+    def test_prune_removes_unused_blobs(self, tmpdir):
+        binary, checksum = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        in_use, _ = self.save(tmpdir, 'ceph-2.0.rpm', 'something changed')
+        os.remove(str(binary))
+        assert storage.prune_blobs() == 1
+        assert not os.path.exists(storage.blob_path(checksum))
+        assert in_use.read() == 'something changed'
+
+    def test_blob_path_rejects_invalid_checksums(self):
+        with pytest.raises(ValueError):
+            storage.blob_path('../../../etc/passwd')
+
+    def test_link_blob_rejects_invalid_checksums(self, tmpdir):
+        binary = tmpdir.join('ceph-1.0.rpm')
+        binary.write('hello tharrrr')
+        with pytest.raises(ValueError):
+            storage.link_blob(str(binary), '../../ceph-1.0-copy.rpm')
+        assert not tmpdir.join('ceph-1.0-copy.rpm').check()
+
+    def test_disabled_store_does_not_link(self, tmpdir):
+        storage.conf.blob_root = None
+        binary, _ = self.save(tmpdir, 'ceph-1.0.rpm', 'hello tharrrr')
+        assert os.stat(str(binary)).st_nlink == 1
+        assert not tmpdir.join('blobs').check()
@@ -459,6 +459,77 @@ class TestRepreproCommands(object):
         for c in commands:
             assert c[-2] in distro_versions
 
+class TestRepreproBatches(object):
+
+    def setup(self):
+        self.p = models.Project('ceph')
+
+    @pytest.fixture(autouse=True)
+    def binary_root(self, tmpdir):
+        self.binary_root = tmpdir
+
+    def binary(self, name, distro_version='trusty'):
+        # the checksum is computed from the file when the binary is flushed
+        path = self.binary_root.join(distro_version, name)
+        path.write(name, ensure=True)
+        return models.Binary(
+            name,
+            self.p,
+            ref='firefly',
+            distro='ubuntu',
+            distro_version=distro_version,
+            arch='all',
+            path=str(path),
+        )
+
+    def test_debs_share_a_batch(self, session):
+        batches = util.reprepro_batches(
+            [self.binary('ceph-1.1.deb'), self.binary('rbd-1.1.deb')])
+        assert len(batches) == 1
+        assert batches[0][:3] == ('ceph', 'includedeb', 'trusty')
+        assert len(batches[0][3]) == 2
+
+    def test_batch_per_distro_version(self, session):
+        batches = util.reprepro_batches(
+            [self.binary('ceph-1.1.deb'), self.binary('ceph-1.1.deb', 'xenial')])
+        assert sorted(b[2] for b in batches) == ['trusty', 'xenial']
+
+    def test_dsc_files_are_added_one_at_a_time(self, session):
+        batches = util.reprepro_batches(
+            [self.binary('ceph-1.1.dsc'), self.binary('rbd-1.1.dsc')])
+        assert [b[1] for b in batches] == ['includedsc', 'includedsc']
+
+    def test_generic_binaries_go_to_every_distro_version(self, session):
+        batches = util.reprepro_batches(
+            [self.binary('ceph-deploy-1.1.deb', 'generic')],
+            distro_versions=['trusty', 'xenial'])
+        assert sorted(b[2] for b in batches) == ['trusty', 'xenial']
+
+    def test_unknown_files_are_skipped(self, session):
+        assert util.reprepro_batches([self.binary('ceph-1.1.tar.gz')]) == []
+
+    def test_include_command_does_not_export(self, session, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        command = util.reprepro_include_command(
+            '/repo', 'ceph', 'includedeb', 'trusty', ['/path/a.deb', '/path/b.deb'])
+        assert '--export=never' in command
+        assert command[-4:] == ['includedeb', 'trusty', '/path/a.deb', '/path/b.deb']
+
+    def test_export_command(self, session, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        command = util.reprepro_export_command('/repo', 'ceph', set(['xenial', 'trusty']))
+        assert command[-3:] == ['export', 'trusty', 'xenial']
+
+    def test_package_name(self):
+        assert util.reprepro_package_name('/path/ceph-base_10.2.0-1trusty_amd64.deb') == 'ceph-base'
+
+    def test_remove_command_is_restricted_to_the_type(self, session, tmpdir):
+        pecan.conf.distributions_root = str(tmpdir)
+        command = util.reprepro_remove_command('/repo', 'ceph', 'dsc', 'trusty', ['rbd', 'ceph'])
+        assert '--export=never' in command
+        assert command[-6:] == ['-T', 'dsc', 'remove', 'trusty', 'ceph', 'rbd']
+
+
 class TestGetDistributionsFileContext(object):
 
     def setup(self):
@@ -7,6 +7,7 @@ from pecan.templating import MakoRenderer, ExtraNamespace
 
 from chacra import models
 from chacra.constants import DISTRIBUTIONS, REPO_OPTION_KEYS
+from chacra.controllers.util import repository_is_automatic
 
 logger = logging.getLogger(__name__)
 
@@ -98,6 +99,51 @@ def get_related_projects(project, repo_config=None):
     return matches
 
 
+def mark_related_repos(binary):
+    """
+    Check if ``binary`` is interesting for other configured projects, and if
+    so, then mark those other repos so that they can be re-built. If a related
+    project has no repositories one is created so that it can be queried by
+    the celery task later.
+    """
+    related_projects = get_related_projects(binary.project.name)
+    repos = []
+    projects = []
+    for project_name, refs in related_projects.items():
+        p = models.projects.get_or_create(name=project_name)
+        projects.append(p)
+        repo_query = []
+        if refs == ['all']:
+            # we need all the repos available
+            repo_query = models.Repo.filter_by(project=p).all()
+        else:
+            for ref in refs:
+                repo_query = models.Repo.filter_by(project=p, ref=ref).all()
+        if repo_query:
+            for r in repo_query:
+                repos.append(r)
+
+    if not repos:
+        # there are no repositories associated with this project, so go ahead
+        # and create one so that it can be queried by the celery task later
+        for project in projects:
+            repo = models.Repo(
+                project,
+                binary.ref,
+                binary.distro,
+                binary.distro_version,
+                sha1=binary.sha1,
+            )
+            repo.needs_update = repository_is_automatic(project.name)
+            repo.type = binary._get_repo_type()
+
+    else:
+        for repo in repos:
+            repo.needs_update = repository_is_automatic(repo.project.name)
+            if repo.type is None:
+                repo.type = binary._get_repo_type()
+
+
 def get_combined_repos(project, repo_config=None):
     """
     Configuration can define specific project repositories to be
@@ -267,6 +313,13 @@ def reprepro_confdir(project_name):
     return confdir_path
 
 
+reprepro_include_flags = {
+    'deb': 'includedeb',
+    'dsc': 'includedsc',
+    'changes': 'include',
+}
+
+
 def reprepro_command(repository_path, binary, distro_version=None):
     """
     Depending on the filetype we are dealing the reprepro command will need to
@@ -275,14 +328,9 @@ def reprepro_command(repository_path, binary, distro_version=None):
     treaded differently.
     """
     distro_version = distro_version or binary.distro_version
-    include_flags = {
-        'deb': 'includedeb',
-        'dsc': 'includedsc',
-        'changes': 'include',
-    }
     # It is OK to fail so that the KeyError can be catched and properly ignored
     # when adding such an unknown file to the repo
-    include_flag = include_flags[binary.extension]
+    include_flag = reprepro_include_flags[binary.extension]
     return [
         'reprepro',
         '--confdir', reprepro_confdir(binary.project.name),
@@ -296,8 +344,7 @@ def reprepro_command(repository_path, binary, distro_version=None):
     ]
 
 
-def reprepro_commands(repository_path, binary,
-        distro_versions=None, fallback_version=None):
+def reprepro_distro_versions(binary, distro_versions=None, fallback_version=None):
     """
     When a generic (non-distro-version-specific) DEB binary is built it can't
     be added with reprepro as-is because internal chacra mechanisms infer the
@@ -317,31 +364,42 @@ def reprepro_commands(repository_path, binary,
     * universal
     * any
 
-    Instead of returning a single command (as a list so that it can be consumed
-    with Popen) it will return all possible commands if ``distro_versions`` is
-    used or just a single item in a list if none are passed.
+    Returns the distro versions (reprepro codenames) the binary needs to be
+    added to, all of ``distro_versions`` (or the ``fallback_version``) for
+    generic binaries, or just the binary's own distro version otherwise.
     """
     if binary.is_generic:
         if not distro_versions:
             if fallback_version:
-                distro_versions = [fallback_version]
-            else:
-                # at this point we don't have either distro_versions or
-                # a fallback and the binary is generic which means we will be
-                # unable to add it back to the repos, so give up with
-                # a warning.
-                logger.warning(
-                    "%s is generic but no fallback or distro versions where defined"
-                )
-                logger.warning("no reprepro command will be issued")
-                return []
-    else:
-        # since this is not a generic binary, use its own distro_version to
-        # create the reprepro command
-        distro_versions = [binary.distro_version]
+                return [fallback_version]
+            # at this point we don't have either distro_versions or
+            # a fallback and the binary is generic which means we will be
+            # unable to add it back to the repos, so give up with
+            # a warning.
+            logger.warning(
+                "%s is generic but no fallback or distro versions where defined",
+                binary.name
+            )
+            return []
+        return list(distro_versions)
+    # since this is not a generic binary, use its own distro_version to
+    # create the reprepro command
+    return [binary.distro_version]
 
+
+def reprepro_commands(repository_path, binary,
+        distro_versions=None, fallback_version=None):
+    """
+    Instead of returning a single command (as a list so that it can be consumed
+    with Popen) it will return all possible commands if ``distro_versions`` is
+    used (see ``reprepro_distro_versions``) or just a single item in a list if
+    none are passed.
+    """
+    versions = reprepro_distro_versions(binary, distro_versions, fallback_version)
+    if not versions:
+        logger.warning("no reprepro command will be issued")
     commands = []
-    for distro_version in distro_versions:
+    for distro_version in versions:
         commands.append(
             reprepro_command(
                 repository_path,
@@ -351,6 +409,97 @@ def reprepro_commands(repository_path, binary,
         )
     return commands
 
+
+def reprepro_batches(binaries, distro_versions=None, fallback_version=None):
+    """
+    Group ``binaries`` so that they can be added with as few reprepro calls as
+    possible: all the .deb files for a distro version (codename) of a project
+    go in a single ``includedeb`` call, while .dsc and .changes files (which
+    reprepro only takes one at a time) get a batch each. Files of an unknown
+    type are skipped.
+
+    Returns a list of ``(project_name, include_flag, distro_version,
+    binaries)`` tuples, see ``reprepro_include_command``.
+    """
+    batches = []
+    debs = {}
+    for binary in binaries:
+        include_flag = reprepro_include_flags.get(binary.extension)
+        if include_flag is None:
+            continue
+        project_name = binary.project.name
+        for distro_version in reprepro_distro_versions(
+                binary, distro_versions, fallback_version):
+            if include_flag != 'includedeb':
+                batches.append((project_name, include_flag, distro_version, [binary]))
+                continue
+            key = (project_name, distro_version)
+            if key not in debs:
+                debs[key] = (project_name, include_flag, distro_version, [])
+                batches.append(debs[key])
+            debs[key][3].append(binary)
+    return batches
+
+
+def reprepro_include_command(repository_path, project_name, include_flag,
+                             distro_version, paths):
+    """
+    A reprepro command that adds every file in ``paths`` to ``distro_version``
+    without exporting the indexes, which is done once at the end with
+    ``reprepro_export_command``.
+    """
+    return [
+        'reprepro',
+        '--confdir', reprepro_confdir(project_name),
+        '-b', repository_path,
+        '-C', 'main',
+        '--ignore=wrongdistribution',
+        '--ignore=wrongversion',
+        '--ignore=undefinedtarget',
+        '--export=never',
+        include_flag, distro_version,
+    ] + list(paths)
+
+
+def reprepro_package_name(path):
+    """
+    The name of the package in a .deb or .dsc file, taken from its file name
+    which follows the ``<name>_<version>_<arch>.deb`` Debian convention.
+    """
+    return os.path.basename(path).split('_')[0]
+
+
+def reprepro_remove_command(repository_path, project_name, package_type,
+                            distro_version, packages):
+    """
+    A reprepro command that removes ``packages`` (by name) of
+    ``package_type`` ('deb' or 'dsc') from ``distro_version`` without
+    exporting the indexes. Restricting the type keeps the removal of a source
+    package from taking the binaries built from it along.
+    """
+    return [
+        'reprepro',
+        '--confdir', reprepro_confdir(project_name),
+        '-b', repository_path,
+        '--export=never',
+        '-T', package_type,
+        'remove', distro_version,
+    ] + sorted(packages)
+
+
+def reprepro_export_command(repository_path, project_name, distro_versions):
+    """
+    Export the indexes of all ``distro_versions`` at once, for binaries that
+    were added with ``reprepro_include_command``.
+    """
+    return [
+        'reprepro',
+        '--confdir', reprepro_confdir(project_name),
+        '-b', repository_path,
+        'export',
+    ] + sorted(distro_versions)
+
+
 def repository_is_disabled(project_name, repo_config=None):
     repo_config = repo_config or getattr(conf, 'repos', {})
     disable_unconfigured_repos = getattr(conf, 'disable_unconfigured_repos', False)
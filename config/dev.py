@@ -1,5 +1,6 @@
 from pecan.hooks import TransactionHook, RequestViewerHook
 from chacra import models
+from chacra import hooks
 
 
 # Server Specific Configurations
@@ -22,6 +23,7 @@ app = {
             models.clear
         ),
         RequestViewerHook(),
+        hooks.CacheHook(),
     ],
     'debug': True,
 }
@@ -68,10 +70,48 @@ binary_root = '%(confdir)s/public'
 repos_root = '%(confdir)s/repos'
 distributions_root = '%(confdir)s/distributions'
 
+# When True uploaded binaries are flushed to disk before the request completes,
+# which is slower but survives a crash
+fsync_uploads = False
+
+# Resumable uploads that are not touched in this many seconds are removed
+upload_expiry = 7 * 24 * 60 * 60
+
+# Optional content-addressed store (in the same filesystem as binary_root) so
+# that identical binaries are hardlinked instead of copied
+# blob_root = '%(confdir)s/blobs'
+
+# Directory where the web server spools upload bodies (in the same filesystem
+# as binary_root), enables taking uploads by path from the X-Upload-File header
+# upload_spool_root = '%(confdir)s/spool'
+
+# How many files are stat'ed and hashed at the same time when registering
+# binaries that are already on disk
+register_workers = 4
+
+# How many createrepo processes run at the same time when building the
+# metadata of the arch directories of an RPM repository
+createrepo_workers = 4
+
 # When True it will set the headers so that Nginx can serve the download
 # instead of Pecan.
 delegate_downloads = False
 
+# Overrides delegate_downloads with the web server that sends the files:
+# 'x-accel-redirect' (Nginx), 'x-sendfile' (Apache, lighttpd) or 'internal'.
+# download_offload = 'x-accel-redirect'
+# Nginx internal location for every directory binaries are stored in. The keys
+# are paths, not identifiers, so '__force_dict__' is required for pecan to keep
+# this as a plain dictionary (it raises a ValueError otherwise)
+# download_locations = {
+#     '%(confdir)s/public': '/b/',
+#     '__force_dict__': True,
+# }
+
+# How long (in seconds) caches can keep responses before revalidating them,
+# binary downloads that pin a sha1 and a generation are cached forever
+cache_max_age = 60
+
 # Basic HTTP Auth credentials
 api_user = 'admin'
 api_key = 'secret'
@@ -81,10 +121,24 @@ api_key = 'secret'
 # be rebuilt
 polling_cycle = 15
 
-# Once a "create repo" task is called, how many seconds (if any) to wait before actually
-# creating the repository
+# How many seconds (if any) to wait after the last binary was added to
+# a repository before actually creating it
 quiet_time = 30
 
+# The wait starts over every time a binary is added to the repository, so that
+# a build that keeps uploading ends up in a single repository build, but it is
+# never longer than this many seconds (defaults to 10 times the quiet_time)
+max_quiet_time = 300
+
+# Send repos to be built as soon as they are marked as needing an update,
+# instead of waiting for the next polling cycle
+trigger_builds = True
+
+# Workers building a repository hold a lease on it for this many seconds, and
+# renew it while the build runs. A repository whose worker died is built again
+# once the lease expires
+build_lease_time = 300
+
 
 # Use this to define how distributions files will be created per project
 distributions = {